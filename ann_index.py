@@ -0,0 +1,277 @@
+"""
+ANN index factory for the PDF knowledge base
+Builds Flat, IVF, HNSW or IVF-PQ FAISS indexes, picks a default from the
+corpus size and measures recall@k vs latency against exact search. Indexes
+rank by inner product ('ip', cosine similarity for normalized vectors) or
+by L2 distance ('l2'). Flat, IVF and HNSW indexes can hold compressed
+vectors for a cheaper first pass: scalar-quantized to fp16 or int8 (2 or 1
+bytes per dimension instead of 4) and/or PCA-reduced; the caller rescores
+the candidates with the full-precision vectors.
+"""
+
+import math
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import faiss
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+METRICS = {'l2': faiss.METRIC_L2, 'ip': faiss.METRIC_INNER_PRODUCT}
+CODECS = ('none', 'fp16', 'int8')
+_SQ_TYPES = {'fp16': faiss.ScalarQuantizer.QT_fp16, 'int8': faiss.ScalarQuantizer.QT_8bit}
+
+# PCA and int8 ranges are trained on up to this many vectors
+TRANSFORM_TRAINING_SIZE = 65536
+
+# Vectors are added and scanned in blocks of this many rows
+ADD_BATCH_SIZE = 65536
+
+
+def choose_index_type(n: int) -> str:
+    """Pick an index type from the number of vectors"""
+    if n < 50_000:
+        return 'flat'      # exact; a full scan is still only a few ms
+    if n < 500_000:
+        return 'hnsw'      # best recall/latency while the vectors fit in RAM
+    if n < 2_000_000:
+        return 'ivf'
+    return 'ivfpq'         # compressed codes once raw vectors get too big
+
+
+def default_params(kind: str, n: int, dim: int) -> Dict:
+    """Sensible build and query parameters for an index type and corpus size"""
+    if kind == 'hnsw':
+        return {'M': 32, 'efConstruction': 80, 'efSearch': 64}
+    
+    if kind in ('ivf', 'ivfpq'):
+        # ~4*sqrt(n) lists, with enough training points (39 per centroid) for each
+        nlist = int(min(max(4 * math.sqrt(max(n, 1)), 16), 65536, max(n // 39, 1)))
+        params = {'nlist': nlist, 'nprobe': min(nlist, max(8, nlist // 64))}
+        if kind == 'ivfpq':
+            # 8-bit sub-quantizers of ~8 dims each (384 dims -> 48 bytes per vector)
+            m = max(d for d in range(1, dim // 8 + 1) if dim % d == 0)
+            params.update({'m': m, 'nbits': 8})
+        return params
+    
+    return {}
+
+
+def flat_index(dim: int, metric: str = 'l2'):
+    """Exact index for a metric"""
+    return faiss.IndexFlatIP(dim) if metric == 'ip' else faiss.IndexFlatL2(dim)
+
+
+def build_index(kind: str, dim: int, params: Dict, metric: str = 'l2',
+                codec: str = 'none', pca_dim: int = 0):
+    """
+    Create an empty index that accepts add_with_ids. codec (fp16/int8)
+    applies to flat, ivf and hnsw (ivfpq codes are compressed already);
+    pca_dim > 0 projects vectors to that many dimensions first, in which
+    case params must have been chosen for pca_dim.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {tuple(METRICS)}")
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec '{codec}', expected one of {CODECS}")
+    inner = pca_dim or dim
+    
+    if kind == 'flat':
+        index = (flat_index(inner, metric) if codec == 'none' else
+                 faiss.IndexScalarQuantizer(inner, _SQ_TYPES[codec], METRICS[metric]))
+    elif kind == 'hnsw':
+        index = (faiss.IndexHNSWFlat(inner, params['M'], METRICS[metric]) if codec == 'none' else
+                 faiss.IndexHNSWSQ(inner, _SQ_TYPES[codec], params['M'], METRICS[metric]))
+        index.hnsw.efConstruction = params['efConstruction']
+        index.hnsw.efSearch = params['efSearch']
+    elif kind == 'ivf':
+        index = (faiss.IndexIVFFlat(flat_index(inner, metric), inner, params['nlist'], METRICS[metric])
+                 if codec == 'none' else
+                 faiss.IndexIVFScalarQuantizer(flat_index(inner, metric), inner, params['nlist'],
+                                               _SQ_TYPES[codec], METRICS[metric]))
+    elif kind == 'ivfpq':
+        index = faiss.IndexIVFPQ(flat_index(inner, metric), inner, params['nlist'],
+                                 params['m'], params['nbits'], METRICS[metric])
+    else:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {INDEX_TYPES}")
+    
+    if kind in ('ivf', 'ivfpq'):
+        index.nprobe = params['nprobe']
+    if pca_dim:
+        index = faiss.IndexPreTransform(faiss.PCAMatrix(dim, pca_dim), index)
+    # IVF indexes store ids themselves
+    return faiss.IndexIDMap2(index) if kind in ('flat', 'hnsw') else index
+
+
+def is_compressed(index_meta: Dict) -> bool:
+    """First-pass scores of this index are approximate and need rescoring"""
+    return (index_meta.get('codec', 'none') != 'none' or bool(index_meta.get('pca_dim'))
+            or index_meta['type'] == 'ivfpq')
+
+
+def training_size(kind: str, params: Dict, codec: str = 'none', pca_dim: int = 0) -> int:
+    """How many vectors to sample for training (0 = no training needed)"""
+    size = 0
+    if kind == 'ivf':
+        size = params['nlist'] * 64
+    elif kind == 'ivfpq':
+        size = max(params['nlist'] * 64, 256 * 64)
+    if pca_dim or codec == 'int8':
+        size = max(size, TRANSFORM_TRAINING_SIZE)
+    return size
+
+
+def populate(index, kind: str, params: Dict, vectors: np.ndarray, ids: np.ndarray,
+             codec: str = 'none', pca_dim: int = 0):
+    """Train (if needed) and fill an index from a possibly memory-mapped vector array"""
+    n = len(vectors)
+    sample = min(training_size(kind, params, codec, pca_dim), n)
+    if sample:
+        rows = np.sort(np.random.default_rng(0).choice(n, sample, replace=False))
+        index.train(np.ascontiguousarray(vectors[rows], dtype='float32'))
+    
+    add_vectors(index, vectors, ids)
+
+
+def add_vectors(index, vectors: np.ndarray, ids: np.ndarray):
+    """Add vectors to a (trained) index in blocks"""
+    for start in range(0, len(vectors), ADD_BATCH_SIZE):
+        stop = min(start + ADD_BATCH_SIZE, len(vectors))
+        index.add_with_ids(np.ascontiguousarray(vectors[start:stop], dtype='float32'),
+                           np.asarray(ids[start:stop], dtype='int64'))
+
+
+def exact_scores(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Full-precision inner products (or squared L2 distances) of a query to
+    some rows of a possibly memory-mapped vector array: only those rows are read
+    """
+    candidates = np.asarray(vectors[np.asarray(rows)], dtype='float32')
+    if metric == 'ip':
+        return candidates @ query
+    diff = candidates - query
+    return np.einsum('ij,ij->i', diff, diff)
+
+
+def rescore(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray, metric: str):
+    """rows reordered best first by exact_scores(), and those scores"""
+    scores = exact_scores(vectors, rows, query, metric)
+    order = np.argsort(-scores if metric == 'ip' else scores, kind='stable')
+    return np.asarray(rows)[order], scores[order]
+
+
+def supports_remove(kind: str) -> bool:
+    """HNSW graphs cannot drop vectors; those indexes are rebuilt instead"""
+    return kind != 'hnsw'
+
+
+def search_params(kind: str, params: Dict, nprobe: Optional[int] = None,
+                  ef_search: Optional[int] = None):
+    """Per-query search parameters (None = use the index defaults)"""
+    if kind in ('ivf', 'ivfpq') and nprobe is not None:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if kind == 'hnsw' and ef_search is not None:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
+
+
+def sweep_settings(kind: str, params: Dict) -> List[Dict]:
+    """Query-time settings to try in a recall/latency report"""
+    if kind in ('ivf', 'ivfpq'):
+        values = sorted({v for v in (1, 2, 4, 8, 16, 32, 64, 128, 256) if v <= params['nlist']}
+                        | {params['nprobe']})
+        return [{'nprobe': v} for v in values]
+    if kind == 'hnsw':
+        values = sorted({16, 32, 64, 128, 256, params['efSearch']})
+        return [{'ef_search': v} for v in values]
+    return [{}]
+
+
+def recall_report(index, kind: str, params: Dict, vectors: np.ndarray, ids: np.ndarray,
+                  queries: np.ndarray, k: int = 10, metric: str = 'l2') -> List[Dict]:
+    """
+    Recall@k and single-query latency of the index for each query-time
+    setting, measured against exact (flat) search over the same vectors.
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    
+    exact = flat_index(vectors.shape[1], metric)
+    for start in range(0, len(vectors), ADD_BATCH_SIZE):
+        exact.add(np.ascontiguousarray(vectors[start:start + ADD_BATCH_SIZE], dtype='float32'))
+    _, truth_rows = exact.search(queries, k)
+    truth = [set(np.asarray(ids)[row[row >= 0]].tolist()) for row in truth_rows]
+    
+    report = []
+    for setting in sweep_settings(kind, params):
+        search_kwargs = {}
+        query_params = search_params(kind, params, **setting)
+        if query_params is not None:
+            search_kwargs['params'] = query_params
+        
+        hits = 0
+        latencies = []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            _, labels = index.search(query[None, :], k, **search_kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected.intersection(labels[0].tolist()))
+        
+        report.append({
+            'type': kind,
+            **setting,
+            f'recall@{k}': hits / max(sum(len(expected) for expected in truth), 1),
+            'mean_ms': float(np.mean(latencies)),
+            'p95_ms': float(np.percentile(latencies, 95))
+        })
+    return report
+
+
+def compression_report(vectors: np.ndarray, queries: np.ndarray, k: int = 10, metric: str = 'l2',
+                       rescore_factor: int = 4, variants: Optional[List] = None) -> List[Dict]:
+    """
+    Memory vs recall@k of compressed first-pass encodings, each a flat scan
+    of (codec, pca_dim) vectors: index size, recall@k of the first pass
+    alone and after exactly rescoring its top k * rescore_factor, and the
+    latency of both together, against exact search.
+    """
+    n, dim = vectors.shape
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    if variants is None:
+        variants = [(codec, 0) for codec in CODECS] + [
+            (codec, pca_dim) for pca_dim in (dim // 2, dim // 4) for codec in ('fp16', 'int8')]
+    
+    exact = flat_index(dim, metric)
+    for start in range(0, n, ADD_BATCH_SIZE):
+        exact.add(np.ascontiguousarray(vectors[start:start + ADD_BATCH_SIZE], dtype='float32'))
+    _, truth_rows = exact.search(queries, k)
+    truth = [set(row[row >= 0].tolist()) for row in truth_rows]
+    total = max(sum(len(expected) for expected in truth), 1)
+    
+    report = []
+    for codec, pca_dim in variants:
+        if pca_dim and not pca_dim < min(dim, n):
+            continue  # PCA needs more vectors than output dimensions
+        index = build_index('flat', dim, {}, metric, codec, pca_dim)
+        populate(index, 'flat', {}, vectors, np.arange(n), codec, pca_dim)
+        size = len(faiss.serialize_index(index))
+        
+        first_hits = rescored_hits = 0
+        latencies = []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            _, labels = index.search(query[None, :], k * rescore_factor)
+            candidates = labels[0][labels[0] >= 0]
+            best, _ = rescore(vectors, candidates, query, metric)
+            latencies.append((time.perf_counter() - start) * 1000)
+            first_hits += len(expected.intersection(candidates[:k].tolist()))
+            rescored_hits += len(expected.intersection(best[:k].tolist()))
+        
+        report.append({
+            'codec': codec,
+            'pca_dim': pca_dim,
+            'bytes_per_vector': size / max(n, 1),
+            'index_mb': size / 1e6,
+            f'recall@{k}': first_hits / total,
+            f'recall@{k}_rescored': rescored_hits / total,
+            'mean_ms': float(np.mean(latencies)) if latencies else 0.0
+        })
+    return report
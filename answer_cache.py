@@ -0,0 +1,127 @@
+"""
+Full-response answer cache for /api/chat
+Answers are keyed by (normalized question, knowledge base version, Gemini
+model), so a rebuilt knowledge base or a model switch never serves a stale
+answer. Uses Redis when REDIS_URL is reachable (shared by all workers) and
+an in-process LRU otherwise; both expire entries after a TTL and hold at
+most max_entries answers.
+"""
+
+import json
+import time
+import hashlib
+import unicodedata
+from typing import Dict, Optional
+
+from lru_cache import LRUCache
+from metrics import metrics
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Response `source` of a cache hit; the original source moves to cached_source
+CACHE_SOURCE = "answer_cache"
+
+
+def normalize_question(question: str) -> str:
+    """Case, spacing and trailing punctuation don't change the answer"""
+    question = unicodedata.normalize('NFKC', question).casefold()
+    return ' '.join(question.split()).rstrip('?!. ')
+
+
+class AnswerCache:
+    """Question -> chat response cache with Redis and in-process backends"""
+    
+    def __init__(self, redis_url: Optional[str] = None, max_entries: int = 5000,
+                 ttl_seconds: int = 3600, namespace: str = "miningai:answers"):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+        self._redis = None
+        self._memory = None
+        self._memory_version = None
+        
+        if redis_url and redis is not None:
+            try:
+                client = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+                client.ping()
+                self._redis = client
+            except Exception as e:
+                print(f"⚠️  Answer cache: Redis unavailable ({e}), using in-process cache")
+        
+        if self._redis is None:
+            self._memory = LRUCache(max_entries, ttl_seconds)
+    
+    @property
+    def backend(self) -> str:
+        return "redis" if self._redis is not None else "memory"
+    
+    def _key(self, question: str, index_version: str, model: str) -> str:
+        raw = json.dumps([normalize_question(question), index_version, model])
+        return f"{self.namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+    
+    def get(self, question: str, index_version: str, model: str) -> Optional[Dict]:
+        """Cached response for the question, marked as a cache hit, or None"""
+        key = self._key(question, index_version, model)
+        response = None
+        
+        if self._redis is not None:
+            try:
+                payload = self._redis.get(key)
+                response = json.loads(payload) if payload else None
+            except Exception as e:
+                metrics.inc('answer_cache.errors')
+                print(f"⚠️  Answer cache read failed: {e}")
+        else:
+            if self._memory_version != index_version:
+                # New knowledge base: nothing cached so far can be served again
+                self._memory.clear()
+                self._memory_version = index_version
+            response = self._memory.get(key)
+        
+        if response is None:
+            metrics.inc('answer_cache.misses')
+            return None
+        
+        metrics.inc('answer_cache.hits')
+        return {**response, "source": CACHE_SOURCE, "cached_source": response.get("source")}
+    
+    def put(self, question: str, index_version: str, model: str, response: Dict):
+        key = self._key(question, index_version, model)
+        
+        if self._redis is None:
+            self._memory.put(key, dict(response))
+            return
+        
+        # Redis entries expire by TTL; an insertion-ordered index trims the oldest past max_entries
+        index_key = f"{self.namespace}:index"
+        try:
+            pipe = self._redis.pipeline()
+            pipe.set(key, json.dumps(response), ex=self.ttl_seconds)
+            pipe.zadd(index_key, {key: time.time()})
+            pipe.zremrangebyscore(index_key, 0, time.time() - self.ttl_seconds)
+            pipe.zcard(index_key)
+            excess = pipe.execute()[-1] - self.max_entries
+            if excess > 0:
+                oldest = self._redis.zrange(index_key, 0, excess - 1)
+                if oldest:
+                    pipe = self._redis.pipeline()
+                    pipe.delete(*oldest)
+                    pipe.zrem(index_key, *oldest)
+                    pipe.execute()
+        except Exception as e:
+            metrics.inc('answer_cache.errors')
+            print(f"⚠️  Answer cache write failed: {e}")
+    
+    def stats(self) -> Dict:
+        stats = {
+            'backend': self.backend,
+            'ttl_seconds': self.ttl_seconds,
+            'max_entries': self.max_entries,
+            'hit_rate': metrics.ratio('answer_cache.hits', 'answer_cache.misses')
+        }
+        if self._memory is not None:
+            stats['size'] = len(self._memory)
+        return stats
@@ -0,0 +1,217 @@
+"""
+ASGI serving mode
+Serves a Flask app under an ASGI server with selected routes replaced by
+native async handlers: network calls (Gemini) are awaited on the event loop,
+CPU-bound embedding/FAISS work runs on a bounded thread pool and blocking
+database writes on a second one, so one process holds hundreds of in-flight
+chats. Every other route is served by the Flask app through WsgiToAsgi.
+
+    uvicorn main:asgi_app --host 0.0.0.0 --port $PORT
+    uvicorn main_production:asgi_app --host 0.0.0.0 --port $PORT
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+
+from metrics import metrics
+
+# Threads for embedding/FAISS work (the native code releases the GIL)
+ASGI_CPU_WORKERS = int(os.getenv('ASGI_CPU_WORKERS', str(os.cpu_count() or 1)))
+# Threads for blocking I/O such as database commits
+ASGI_IO_WORKERS = int(os.getenv('ASGI_IO_WORKERS', '32'))
+# Async requests held at once; more are answered 503 with Retry-After
+ASGI_MAX_IN_FLIGHT = int(os.getenv('ASGI_MAX_IN_FLIGHT', '500'))
+ASGI_MAX_BODY_BYTES = int(os.getenv('ASGI_MAX_BODY_BYTES', str(1024 * 1024)))
+
+
+class AsyncResponse(NamedTuple):
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+
+def json_response(data, status: int = 200, headers: Optional[Dict[str, str]] = None) -> AsyncResponse:
+    return AsyncResponse(status, [('Content-Type', 'application/json'), *(headers or {}).items()],
+                         json.dumps(data).encode('utf-8'))
+
+
+def flask_response(flask_app, rv) -> AsyncResponse:
+    """
+    Finish a Flask view return value (after_request hooks included) as an
+    AsyncResponse. Call inside the request context the value was made in.
+    """
+    response = flask_app.process_response(flask_app.make_response(rv))
+    return AsyncResponse(response.status_code, list(response.headers.items()), response.get_data())
+
+
+class AsyncRequest:
+    """Buffered HTTP request as seen by an async handler"""
+    
+    def __init__(self, scope: Dict, body: bytes):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+    
+    def json(self):
+        """Parsed JSON body, or None if it is missing or invalid"""
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+    
+    def environ(self) -> Dict:
+        """WSGI environ for the request, to run Flask hooks and views on it"""
+        scope = self.scope
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': self.method,
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': self.path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('ascii'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(self.body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(self.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+        for name, value in self.headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'content-length':
+                environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+        return environ
+
+
+Handler = Callable[[AsyncRequest], Awaitable[AsyncResponse]]
+
+
+class AsyncChatApp:
+    """ASGI app: async handlers for chosen routes, the Flask app for the rest"""
+    
+    def __init__(self, flask_app, cpu_workers: int = ASGI_CPU_WORKERS,
+                 io_workers: int = ASGI_IO_WORKERS, max_in_flight: int = ASGI_MAX_IN_FLIGHT):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.cpu_workers = max(1, cpu_workers)
+        self.io_workers = max(1, io_workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = 0
+        self._routes = {}
+        self._cpu_executor = None
+        self._io_executor = None
+    
+    def route(self, path: str, methods: Tuple[str, ...] = ('POST',)):
+        """Register an async handler; other methods on the path still go to Flask"""
+        def decorator(handler: Handler) -> Handler:
+            for method in methods:
+                self._routes[(method, path)] = handler
+            return handler
+        return decorator
+    
+    async def run_cpu(self, fn: Callable, *args, **kwargs):
+        """Run embedding/FAISS work on the bounded CPU pool"""
+        if self._cpu_executor is None:
+            self._cpu_executor = ThreadPoolExecutor(self.cpu_workers, thread_name_prefix='asgi-cpu')
+        return await asyncio.get_running_loop().run_in_executor(
+            self._cpu_executor, functools.partial(fn, *args, **kwargs))
+    
+    async def run_io(self, fn: Callable, *args, **kwargs):
+        """Run blocking I/O (database, Redis) on the I/O pool"""
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(self.io_workers, thread_name_prefix='asgi-io')
+        return await asyncio.get_running_loop().run_in_executor(
+            self._io_executor, functools.partial(fn, *args, **kwargs))
+    
+    def shutdown(self):
+        for executor in (self._cpu_executor, self._io_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._cpu_executor = self._io_executor = None
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        
+        handler = self._routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+            return
+        
+        if self.in_flight >= self.max_in_flight:
+            metrics.inc('asgi.rejected')
+            await self._send(send, json_response({"error": "Server busy, retry shortly", "success": False},
+                                                 503, {'Retry-After': '1'}))
+            return
+        
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            body = await self._read_body(receive)
+            if body is None:
+                response = json_response({"error": "Request body too large", "success": False}, 413)
+            else:
+                response = await handler(AsyncRequest(scope, body))
+        except Exception as e:
+            print(f"ASGI handler error on {scope['path']}: {e}")
+            response = json_response({"error": "Internal server error", "success": False}, 500)
+        finally:
+            self.in_flight -= 1
+        
+        metrics.observe(f"asgi{scope['path'].replace('/', '.')}", (time.perf_counter() - start) * 1000)
+        await self._send(send, response)
+    
+    async def _read_body(self, receive) -> Optional[bytes]:
+        """Request body, or None once it exceeds ASGI_MAX_BODY_BYTES"""
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > ASGI_MAX_BODY_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+    
+    @staticmethod
+    async def _send(send, response: AsyncResponse):
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in response.headers if name.lower() != 'content-length']
+        headers.append((b'content-length', str(len(response.body)).encode('ascii')))
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': response.body})
+    
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,258 @@
+"""
+Shared chat engine
+Question analysis, PDF retrieval and Gemini generation behind one lazily
+built, process-wide object. main.py and main_production.py both use
+get_engine(), so a process holds a single PDFRAGSystem (and embedding
+model) whichever entry point it was started from. Importing this module
+loads nothing; each component is built on first use.
+"""
+
+import os
+import threading
+from typing import Dict, Iterator, Optional
+
+# Gemini AI client (pooled HTTP, deadlines, retries, circuit breaker)
+from gemini_client import GeminiClient, GeminiError, CircuitOpenError, ModelSelector, MODEL_FAILOVER_STATUS
+
+
+class QuestionAnalyzer:
+    """Analyzes questions to determine complexity and best source."""
+    
+    def __init__(self):
+        self.simple_patterns = [
+            'what is', 'what are', 'define', 'explain', 'describe',
+            'how does', 'how do', 'types of', 'list', 'name'
+        ]
+        self.complex_patterns = [
+            'compare', 'analyze', 'evaluate', 'why', 'latest',
+            'recent', 'current', 'trend', 'future', 'predict',
+            'best practice', 'recommend', 'should i', 'which is better'
+        ]
+    
+    def analyze(self, question: str) -> Dict:
+        """Analyze question complexity and type."""
+        question_lower = question.lower()
+        
+        # Check if simple or complex
+        is_simple = any(pattern in question_lower for pattern in self.simple_patterns)
+        is_complex = any(pattern in question_lower for pattern in self.complex_patterns)
+        
+        # Check if asking for latest/current info
+        needs_current = any(word in question_lower for word in ['latest', 'recent', 'current', 'new', '2024', '2025', 'today'])
+        
+        # Determine complexity score
+        complexity = 'simple' if is_simple and not is_complex else 'complex' if is_complex else 'medium'
+        
+        return {
+            'complexity': complexity,
+            'needs_current_info': needs_current,
+            'is_simple': is_simple,
+            'is_complex': is_complex,
+            'recommended_source': 'local' if is_simple and not needs_current else 'ai' if is_complex or needs_current else 'local'
+        }
+
+
+class GeminiAI:
+    """Gemini AI integration for complex queries."""
+    
+    def __init__(self, timeout: Optional[float] = None, redis_url: Optional[str] = None):
+        self.client = None
+        # The model is resolved by the first real request (shared with the
+        # other workers), not probed here
+        self.models = ModelSelector(redis_url=redis_url)
+        
+        api_key = os.getenv('GEMINI_API_KEY')
+        if api_key:
+            try:
+                self.client = GeminiClient(api_key, timeout=timeout)
+            except Exception as e:
+                print(f"✗ Gemini AI error: {e}")
+    
+    @property
+    def model_name(self) -> str:
+        return self.models.current()
+    
+    def is_available(self) -> bool:
+        """Check if Gemini is available."""
+        return self.client is not None
+    
+    def model_id(self) -> str:
+        """Name of the model calls currently go to"""
+        return self.model_name if self.client is not None else ''
+    
+    def build_prompt(self, question: str, context: str = "") -> str:
+        """Prompt sent to Gemini for a question and its PDF context."""
+        system_prompt = """You are a specialized AI assistant for the mining industry.
+            Provide accurate, detailed answers about mining operations, equipment, safety, 
+            geology, mineral processing, and all types of mining (gold, copper, iron, 
+            diamond, lithium, coal, etc.).
+            
+            Keep responses clear, professional, and focused on mining topics."""
+        
+        if context:
+            return f"{system_prompt}\n\nContext: {context}\n\nQuestion: {question}\n\nAnswer:"
+        return f"{system_prompt}\n\nQuestion: {question}\n\nAnswer:"
+    
+    def get_response(self, question: str, context: str = "") -> str:
+        """
+        Get response from Gemini AI.
+        None when it fails or the circuit breaker is open (callers fall back
+        to raw PDF text).
+        """
+        if not self.is_available():
+            return None
+        
+        prompt = self.build_prompt(question, context)
+        model = self.model_name
+        try:
+            while True:
+                try:
+                    text = self.client.generate(model, prompt)
+                    self.models.confirm(model)
+                    return text
+                except GeminiError as e:
+                    model = self._failover(model, e)
+        except Exception as e:
+            print(f"Gemini error: {e}")
+            return None
+    
+    async def get_response_async(self, question: str, context: str = "") -> str:
+        """get_response() that awaits Gemini instead of blocking a thread."""
+        if not self.is_available():
+            return None
+        
+        prompt = self.build_prompt(question, context)
+        model = self.model_name
+        try:
+            while True:
+                try:
+                    text = await self.client.agenerate(model, prompt)
+                    self.models.confirm(model)
+                    return text
+                except GeminiError as e:
+                    model = self._failover(model, e)
+        except Exception as e:
+            print(f"Gemini error: {e}")
+            return None
+    
+    def stream_response(self, question: str, context: str = "") -> Iterator[str]:
+        """
+        Yield response text from Gemini as it is generated.
+        Errors propagate to the caller, which decides on a fallback.
+        """
+        prompt = self.build_prompt(question, context)
+        model = self.model_name
+        while True:
+            started = False
+            try:
+                for text in self.client.stream(model, prompt):
+                    started = True
+                    yield text
+                self.models.confirm(model)
+                return
+            except GeminiError as e:
+                if started:
+                    raise
+                model = self._failover(model, e)
+    
+    def _failover(self, model: str, error: GeminiError) -> str:
+        """Next model to try after error, or re-raise it if it isn't about the model"""
+        if error.status not in MODEL_FAILOVER_STATUS or isinstance(error, CircuitOpenError):
+            raise error
+        next_model = self.models.failover(model)
+        if next_model is None or next_model == model:
+            raise error
+        print(f"  Gemini model {model} unavailable ({error.status}), switching to {next_model}")
+        return next_model
+    
+    def stats(self) -> Dict:
+        stats = {"available": self.is_available(), **self.models.stats()}
+        if self.client is not None:
+            stats.update(self.client.stats())
+        return stats
+
+
+class Engine:
+    """Lazily built retrieval and generation components shared by a process"""
+    
+    def __init__(self, gemini_timeout: Optional[float] = None, redis_url: Optional[str] = None):
+        self.gemini_timeout = gemini_timeout
+        self.redis_url = redis_url
+        self.pdf_rag_error: Optional[Exception] = None
+        self._pdf_rag = None
+        self._pdf_rag_loaded = False
+        self._gemini = None
+        self._analyzer = None
+        self._reranker = None
+        self._lock = threading.Lock()
+    
+    @property
+    def pdf_rag(self):
+        """PDFRAGSystem, or None if it can't be loaded (see pdf_rag_error)"""
+        if not self._pdf_rag_loaded:
+            with self._lock:
+                if not self._pdf_rag_loaded:
+                    self._pdf_rag = self._load_pdf_rag()
+                    self._pdf_rag_loaded = True
+        return self._pdf_rag
+    
+    @property
+    def gemini(self) -> GeminiAI:
+        if self._gemini is None:
+            with self._lock:
+                if self._gemini is None:
+                    self._gemini = GeminiAI(timeout=self.gemini_timeout, redis_url=self.redis_url)
+        return self._gemini
+    
+    @property
+    def analyzer(self) -> QuestionAnalyzer:
+        if self._analyzer is None:
+            with self._lock:
+                if self._analyzer is None:
+                    self._analyzer = QuestionAnalyzer()
+        return self._analyzer
+    
+    @property
+    def reranker(self):
+        """Reranker for search results (see reranker.py)"""
+        if self._reranker is None:
+            with self._lock:
+                if self._reranker is None:
+                    from reranker import Reranker
+                    self._reranker = Reranker()
+        return self._reranker
+    
+    def _load_pdf_rag(self):
+        try:
+            from pdf_processor import PDFRAGSystem
+        except ImportError as e:
+            self.pdf_rag_error = e
+            print("⚠️  PDF RAG system not available")
+            return None
+        
+        print("Initializing PDF RAG system...")
+        try:
+            pdf_rag = PDFRAGSystem()
+            print("✓ PDF RAG system ready!")
+            return pdf_rag
+        except Exception as e:
+            self.pdf_rag_error = e
+            print(f"⚠️  PDF RAG initialization failed: {e}")
+            return None
+
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(gemini_timeout: Optional[float] = None, redis_url: Optional[str] = None) -> Engine:
+    """
+    The process-wide Engine. Settings apply when it is first created;
+    later callers get the same instance whatever they pass.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = Engine(gemini_timeout=gemini_timeout, redis_url=redis_url)
+    return _engine
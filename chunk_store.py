@@ -0,0 +1,280 @@
+"""
+Memory-mapped columnar chunk store for the PDF knowledge base
+One UTF-8 text blob plus an offsets array, metadata as typed numpy columns,
+interned source names and the float32 embedding of every chunk. Readers mmap
+the files, so every gunicorn worker shares the same OS page cache and opening
+the store takes milliseconds.
+"""
+
+import os
+import json
+import mmap
+import shutil
+from collections.abc import Sequence
+from typing import Dict, List, Optional
+import numpy as np
+
+TEXT_FILE = "text.bin"
+OFFSETS_FILE = "offsets.npy"
+SOURCES_FILE = "sources.json"
+VECTORS_FILE = "vectors.f32"
+INFO_FILE = "info.json"
+
+# column name -> dtype; one .npy file per column
+COLUMNS = {
+    'vector_id': np.int64,
+    'source': np.int32,
+    'chunk_id': np.int32,
+    'page_start': np.int32,
+    'page_end': np.int32,
+    'char_start': np.int64,
+    'char_end': np.int64,
+}
+
+
+class ChunkStoreWriter:
+    """
+    Builds a chunk store in a temporary folder and swaps it into place on close().
+    Text goes straight to disk; only the small integer columns stay in memory.
+    """
+    
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.tmp_folder = folder + ".tmp"
+        shutil.rmtree(self.tmp_folder, ignore_errors=True)
+        os.makedirs(self.tmp_folder)
+        
+        self._text = open(os.path.join(self.tmp_folder, TEXT_FILE), "wb")
+        self._vectors = open(os.path.join(self.tmp_folder, VECTORS_FILE), "wb")
+        self._dim = 0
+        self._offset = 0
+        self._offsets = [np.zeros(1, dtype=np.int64)]
+        self._sources = []
+        self._source_idx = {}
+        # parts copied from an existing store (numpy) followed by new rows (lists)
+        self._parts = {name: [] for name in COLUMNS}
+        self._rows = {name: [] for name in COLUMNS}
+        self._row_offsets = []
+    
+    def _intern(self, source: str) -> int:
+        idx = self._source_idx.get(source)
+        if idx is None:
+            idx = self._source_idx[source] = len(self._sources)
+            self._sources.append(source)
+        return idx
+    
+    def _flush_rows(self):
+        """Move pending row values into numpy parts, keeping row order"""
+        if not self._row_offsets:
+            return
+        for name, dtype in COLUMNS.items():
+            self._parts[name].append(np.asarray(self._rows[name], dtype=dtype))
+            self._rows[name] = []
+        self._offsets.append(np.asarray(self._row_offsets, dtype=np.int64))
+        self._row_offsets = []
+    
+    def _set_dim(self, dim: int):
+        if self._dim and dim != self._dim:
+            raise ValueError(f"Embedding dimension changed from {self._dim} to {dim}")
+        self._dim = dim
+    
+    def add_batch(self, texts: List[str], metas: List[Dict], vector_ids: List[int],
+                  vectors: np.ndarray):
+        """Append chunks together with their embeddings"""
+        self._set_dim(vectors.shape[1])
+        self._vectors.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        
+        row = self._rows
+        for text, meta, vector_id in zip(texts, metas, vector_ids):
+            data = text.encode("utf-8")
+            self._text.write(data)
+            self._offset += len(data)
+            self._row_offsets.append(self._offset)
+            
+            row['vector_id'].append(vector_id)
+            row['source'].append(self._intern(meta['source']))
+            row['chunk_id'].append(meta['chunk_id'])
+            row['page_start'].append(meta.get('page_start', 0))
+            row['page_end'].append(meta.get('page_end', 0))
+            row['char_start'].append(meta.get('char_start', 0))
+            row['char_end'].append(meta.get('char_end', 0))
+    
+    def extend_from(self, store: "ChunkStore", rows: np.ndarray):
+        """Copy the given rows (ascending) of an existing store, text included"""
+        self._flush_rows()
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        
+        starts = store.offsets[rows]
+        lengths = store.offsets[rows + 1] - starts
+        
+        # Copy runs of consecutive rows with one write each
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        for run in np.split(np.arange(len(rows)), breaks):
+            first, last = run[0], run[-1]
+            self._text.write(store.blob[starts[first]:starts[last] + lengths[last]])
+        
+        self._offsets.append(self._offset + np.cumsum(lengths))
+        self._offset += int(lengths.sum())
+        
+        if len(store.vectors):
+            self._set_dim(store.dim)
+            for start in range(0, len(rows), 65536):
+                self._vectors.write(np.ascontiguousarray(store.vectors[rows[start:start + 65536]]).tobytes())
+        
+        remap = np.asarray([self._intern(name) for name in store.sources], dtype=np.int32)
+        for name in COLUMNS:
+            column = np.asarray(store.columns[name][rows])
+            if name == 'source':
+                column = remap[column]
+            self._parts[name].append(column.astype(COLUMNS[name]))
+    
+    def close(self):
+        """Write the columns and atomically replace the store folder"""
+        self._flush_rows()
+        self._text.close()
+        self._vectors.close()
+        
+        np.save(os.path.join(self.tmp_folder, OFFSETS_FILE), np.concatenate(self._offsets))
+        for name, dtype in COLUMNS.items():
+            parts = self._parts[name]
+            column = np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+            np.save(os.path.join(self.tmp_folder, f"{name}.npy"), column)
+        with open(os.path.join(self.tmp_folder, SOURCES_FILE), "w") as f:
+            json.dump(self._sources, f)
+        with open(os.path.join(self.tmp_folder, INFO_FILE), "w") as f:
+            json.dump({'dim': self._dim}, f)
+        
+        # Open readers keep their mmaps of the old files after the swap
+        old_folder = self.folder + ".old"
+        shutil.rmtree(old_folder, ignore_errors=True)
+        if os.path.exists(self.folder):
+            os.replace(self.folder, old_folder)
+        os.replace(self.tmp_folder, self.folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+    
+    def abort(self):
+        """Discard a partially written store"""
+        self._text.close()
+        self._vectors.close()
+        shutil.rmtree(self.tmp_folder, ignore_errors=True)
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view of a chunk store"""
+    
+    def __init__(self, folder: str):
+        self.folder = folder
+        
+        text_path = os.path.join(folder, TEXT_FILE)
+        if os.path.getsize(text_path) > 0:
+            with open(text_path, "rb") as f:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.blob = b""  # mmap cannot map an empty file
+        
+        self.offsets = np.load(os.path.join(folder, OFFSETS_FILE), mmap_mode='r')
+        self.columns = {
+            name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode='r')
+            for name in COLUMNS
+        }
+        with open(os.path.join(folder, SOURCES_FILE)) as f:
+            self.sources = json.load(f)
+        with open(os.path.join(folder, INFO_FILE)) as f:
+            self.dim = json.load(f)['dim']
+        
+        # Full-precision embeddings, row-aligned with the columns
+        if len(self) and self.dim:
+            self.vectors = np.memmap(os.path.join(folder, VECTORS_FILE), dtype=np.float32,
+                                     mode='r', shape=(len(self), self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        
+        # Chunks per source; small (one int per PDF)
+        self._totals = np.bincount(self.columns['source'], minlength=len(self.sources))
+        
+        self.texts = ChunkTexts(self)
+        self.metadata = ChunkMetadata(self)
+    
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, INFO_FILE))
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    @property
+    def vector_ids(self) -> np.ndarray:
+        return self.columns['vector_id']
+    
+    def text(self, row: int) -> str:
+        """Decode the text of one chunk"""
+        return self.blob[int(self.offsets[row]):int(self.offsets[row + 1])].decode("utf-8")
+    
+    def meta(self, row: int) -> Dict:
+        """Build the metadata dict of one chunk"""
+        columns = self.columns
+        source = int(columns['source'][row])
+        return {
+            'source': self.sources[source],
+            'chunk_id': int(columns['chunk_id'][row]),
+            'total_chunks': int(self._totals[source]),
+            'page_start': int(columns['page_start'][row]),
+            'page_end': int(columns['page_end'][row]),
+            'char_start': int(columns['char_start'][row]),
+            'char_end': int(columns['char_end'][row])
+        }
+    
+    def find_rows(self, vector_ids) -> List[Optional[int]]:
+        """Map vector ids to rows (ids are stored in ascending order)"""
+        ids = self.vector_ids
+        rows = np.searchsorted(ids, vector_ids)
+        return [
+            int(row) if row < len(ids) and ids[row] == vector_id else None
+            for row, vector_id in zip(rows, vector_ids)
+        ]
+    
+    def rows_for_sources(self, names: List[str]) -> np.ndarray:
+        """Rows whose chunks came from any of the given sources"""
+        names = set(names)
+        wanted = [idx for idx, name in enumerate(self.sources) if name in names]
+        return np.flatnonzero(np.isin(self.columns['source'], wanted))
+    
+    def source_names(self) -> List[str]:
+        """Sources that still have chunks in the store"""
+        return [name for name, total in zip(self.sources, self._totals) if total]
+
+
+class ChunkTexts(Sequence):
+    """List-like view of chunk texts, decoded lazily by index"""
+    
+    def __init__(self, store: ChunkStore):
+        self._store = store
+    
+    def __len__(self) -> int:
+        return len(self._store)
+    
+    def __getitem__(self, row: int) -> str:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self._store.text(row)
+
+
+class ChunkMetadata(Sequence):
+    """List-like view of chunk metadata dicts, built lazily by index"""
+    
+    def __init__(self, store: ChunkStore):
+        self._store = store
+    
+    def __len__(self) -> int:
+        return len(self._store)
+    
+    def __getitem__(self, row: int) -> Dict:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self._store.meta(row)
@@ -19,6 +19,26 @@ class Config:
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///miningai.db')
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     
+    # Answer cache (Redis at REDIS_URL, in-process LRU if unreachable)
+    ANSWER_CACHE_TTL_SECONDS = int(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '5000'))
+    
+    # Semantic cache: serve the answer of a cached question at or above this cosine similarity
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+    
+    # Below the PDF RAG confidence threshold: refuse ("not in the documents"),
+    # extractive (raw PDF text) or off (ask Gemini anyway)
+    CONFIDENCE_GATE = os.getenv('CONFIDENCE_GATE', 'refuse')
+    
+    # Write-behind queue for ChatHistory/APIUsage/AuditLog rows
+    # (overflow when full: block, then insert inline | sync | drop)
+    WRITE_BEHIND_MAX_QUEUE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE', '10000'))
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200'))
+    WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv('WRITE_BEHIND_FLUSH_SECONDS', '0.5'))
+    WRITE_BEHIND_OVERFLOW = os.getenv('WRITE_BEHIND_OVERFLOW', 'block')
+    WRITE_BEHIND_BLOCK_SECONDS = float(os.getenv('WRITE_BEHIND_BLOCK_SECONDS', '1.0'))
+    
     # CORS
     ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', 'http://localhost:3000').split(',')
     
@@ -26,6 +46,7 @@ class Config:
     RATE_LIMIT_STORAGE_URL = os.getenv('RATE_LIMIT_STORAGE_URL', 'memory://')
     RATELIMIT_DEFAULT = "200 per day, 50 per hour"
     RATELIMIT_CHAT = "10 per minute"
+    RATELIMIT_SEARCH_BATCH = "30 per minute"
     
     # File Upload
     MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '10'))
@@ -35,6 +56,8 @@ class Config:
     # API Configuration
     API_TIMEOUT_SECONDS = int(os.getenv('API_TIMEOUT_SECONDS', '30'))
     MAX_QUESTION_LENGTH = int(os.getenv('MAX_QUESTION_LENGTH', '1000'))
+    SEARCH_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_BATCH_MAX_QUERIES', '100'))
+    SEARCH_MAX_TOP_K = int(os.getenv('SEARCH_MAX_TOP_K', '20'))
     
     # Monitoring
     SENTRY_DSN = os.getenv('SENTRY_DSN')
@@ -57,6 +80,7 @@ class DevelopmentConfig(Config):
     # Relaxed rate limits for dev
     RATELIMIT_DEFAULT = "1000 per day, 200 per hour"
     RATELIMIT_CHAT = "100 per minute"
+    RATELIMIT_SEARCH_BATCH = "300 per minute"
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,137 @@
+"""
+Context packing between retrieval and generation
+Turns ranked search results into the PDF context of the Gemini prompt:
+hits that trail the best ones by a large score gap are dropped, hits that
+are neighbouring chunks of the same PDF are merged into one span (their
+50-word overlap kept once) and the spans are packed, best first, into a
+token budget.
+"""
+
+import os
+from typing import Dict, List
+
+from metrics import metrics
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '2000'))
+# Hits ranked after a drop of this much (cosine similarity) between two
+# consecutive scores are left out; 0 keeps every hit
+CONTEXT_SCORE_GAP = float(os.getenv('CONTEXT_SCORE_GAP', '0.1'))
+
+# Rough size of a token in English text; Gemini has no local tokenizer
+CHARS_PER_TOKEN = 4
+# A span that doesn't fit is cut to the remaining budget if that leaves this much
+MIN_PARTIAL_TOKENS = 100
+SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def drop_after_gap(results: List[Dict], gap: float = CONTEXT_SCORE_GAP) -> List[Dict]:
+    """
+    The results before the first drop of at least `gap` between consecutive
+    similarity scores, in their ranked order. Reranked and lexical results
+    are kept as they are: the cross-encoder already cut them and its order
+    isn't the similarity order, and term coverage isn't on the cosine scale.
+    """
+    if (gap <= 0 or len(results) < 2
+            or any('rerank_score' in r or r.get('score_kind', 'cosine') != 'cosine' for r in results)):
+        return list(results)
+    for i in range(1, len(results)):
+        if results[i - 1]['similarity_score'] - results[i]['similarity_score'] >= gap:
+            return list(results[:i])
+    return list(results)
+
+
+def merge_adjacent(results: List[Dict]) -> List[Dict]:
+    """
+    Spans of consecutive chunks (same source, chunk_ids n, n+1, ...) among
+    the results, in the order of their best-ranked chunk. Each span has
+    text, source, chunk_ids, page_start, page_end and similarity_score.
+    """
+    first_seen = {}
+    by_chunk = {}
+    for position, result in enumerate(results):
+        meta = result['metadata']
+        key = (meta['source'], meta['chunk_id'])
+        if key not in by_chunk:
+            by_chunk[key] = result
+            first_seen[key] = position
+    
+    spans = []
+    span = None
+    for key in sorted(by_chunk):
+        result = by_chunk[key]
+        meta = result['metadata']
+        if (span is not None and key == (span['source'], span['chunk_ids'][-1] + 1)
+                and span['char_end'] is not None and 'char_start' in meta):
+            # Chunks are slices of the PDF text: skip what the span already holds
+            overlap = span['char_end'] - meta['char_start']
+            span['text'] += result['text'][overlap:] if overlap >= 0 else " " + result['text']
+            span['chunk_ids'].append(meta['chunk_id'])
+            span['char_end'] = meta['char_end']
+            span['page_end'] = meta.get('page_end')
+            span['similarity_score'] = max(span['similarity_score'], result['similarity_score'])
+            span['position'] = min(span['position'], first_seen[key])
+            continue
+        span = {
+            'text': result['text'],
+            'source': meta['source'],
+            'chunk_ids': [meta['chunk_id']],
+            'page_start': meta.get('page_start'),
+            'page_end': meta.get('page_end'),
+            'char_end': meta.get('char_end'),
+            'similarity_score': result['similarity_score'],
+            'position': first_seen[key]
+        }
+        spans.append(span)
+    
+    spans.sort(key=lambda s: s['position'])
+    for span in spans:
+        del span['position'], span['char_end']
+    return spans
+
+
+def _cut(text: str, tokens: int) -> str:
+    """Text shortened to about `tokens` tokens, at a word boundary"""
+    cut = text[:tokens * CHARS_PER_TOKEN]
+    return cut[:cut.rfind(' ')] if ' ' in cut else cut
+
+
+def pack_context(results: List[Dict], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 score_gap: float = CONTEXT_SCORE_GAP) -> Dict:
+    """
+    Prompt context for ranked search results. Returns context (the text),
+    spans (the packed spans), sources, tokens (estimated) and raw_tokens
+    (what joining every result's text would have cost).
+    """
+    raw_tokens = estimate_tokens(SEPARATOR.join(r['text'] for r in results))
+    
+    packed = []
+    used = 0
+    for span in merge_adjacent(drop_after_gap(results, score_gap)):
+        room = token_budget - used - (estimate_tokens(SEPARATOR) if packed else 0)
+        tokens = estimate_tokens(span['text'])
+        if tokens > room:
+            if room < MIN_PARTIAL_TOKENS and packed:
+                break
+            span = {**span, 'text': _cut(span['text'], max(room, MIN_PARTIAL_TOKENS)), 'truncated': True}
+            tokens = estimate_tokens(span['text'])
+        packed.append(span)
+        used += tokens + (estimate_tokens(SEPARATOR) if len(packed) > 1 else 0)
+        if span.get('truncated'):
+            break
+    
+    context = SEPARATOR.join(span['text'] for span in packed)
+    tokens = estimate_tokens(context)
+    metrics.inc('context.requests')
+    metrics.inc('context.tokens', tokens)
+    metrics.inc('context.raw_tokens', raw_tokens)
+    return {
+        'context': context,
+        'spans': packed,
+        'sources': list(dict.fromkeys(span['source'] for span in packed)),
+        'tokens': tokens,
+        'raw_tokens': raw_tokens
+    }
@@ -2,7 +2,7 @@
 Production-grade database models using SQLAlchemy
 Replaces pickle files and localStorage
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, JSON, DateTime, Boolean, Text
+from sqlalchemy import create_engine, Column, Integer, String, Float, JSON, DateTime, Boolean, Text, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 from datetime import datetime
@@ -43,7 +43,7 @@ class DocumentChunk(Base):
     
     id = Column(Integer, primary_key=True)
     text = Column(Text, nullable=False)
-    embedding = Column(JSON)  # Store as JSON for now, use pgvector in production
+    embedding = Column(LargeBinary)  # float16 bytes (np.float16.tobytes), use pgvector in production
     source = Column(String(255), nullable=False, index=True)
     chunk_id = Column(Integer, nullable=False)
     total_chunks = Column(Integer, nullable=False)
@@ -153,9 +153,24 @@ def get_db():
         db.close()
 
 
+def new_session():
+    """Session of its own, not the calling thread's (for background writers)"""
+    return SessionLocal.session_factory()
+
+
 def close_db():
     """Close database connection"""
     if SessionLocal:
         SessionLocal.remove()
     if engine:
         engine.dispose()
+
+
+def _after_fork():
+    """A forked worker must not reuse the parent's pooled connections; drop them unclosed"""
+    if engine is not None:
+        engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,231 @@
+"""
+Persistent embedding cache for PDF ingestion
+Chunk embeddings are keyed by (model name, chunk text hash), so rebuilds,
+re-chunking and restarts after a crash only embed text the model has not
+seen before. Each model gets its own folder of flat binary files:
+
+    keys.u64     8-byte blake2b digest per entry
+    vectors.f32  float32 embedding per entry (row-aligned with keys)
+    used.u32     generation (ingestion run) that last used the entry
+    info.json    model name, dimension and current generation
+    lock         held (flock) by the one process that has the cache open
+
+New entries are appended and flushed as they are created; on close the
+least recently used entries are evicted once the cache exceeds max_bytes.
+Appends and compaction are not safe against a second writer, so a process
+that finds the cache locked gets CacheBusyError and ingests without it.
+"""
+
+import os
+import re
+import json
+import hashlib
+from typing import Dict, List, Tuple
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: no locking, run one ingesting process at a time
+
+KEYS_FILE = "keys.u64"
+VECTORS_FILE = "vectors.f32"
+USED_FILE = "used.u32"
+INFO_FILE = "info.json"
+LOCK_FILE = "lock"
+
+# Evict down to this fraction of max_bytes so every run doesn't compact again
+EVICT_TARGET = 0.9
+
+
+def text_key(model_name: str, text: str) -> int:
+    """64-bit digest of (model, text)"""
+    digest = hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class CacheBusyError(RuntimeError):
+    """Another process has the embedding cache open"""
+
+
+class EmbeddingCache:
+    """Disk-backed (model, text hash) -> embedding cache with size-based LRU eviction"""
+    
+    def __init__(self, folder: str, model_name: str, max_bytes: int):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.folder = os.path.join(folder, re.sub(r'[^\w.-]+', '_', model_name))
+        os.makedirs(self.folder, exist_ok=True)
+        self._lock = self._acquire_lock()
+        
+        info = {}
+        if os.path.exists(self._path(INFO_FILE)):
+            with open(self._path(INFO_FILE)) as f:
+                info = json.load(f)
+        self.dim = info.get('dim', 0)
+        self.generation = info.get('generation', 0) + 1
+        
+        # Rows beyond the last clean close (e.g. a crashed run) are kept as long
+        # as both files have them; partial trailing writes are dropped
+        keys = np.fromfile(self._path(KEYS_FILE), dtype=np.uint64) if self.dim else np.zeros(0, np.uint64)
+        count = len(keys)
+        if self.dim:
+            count = min(count, os.path.getsize(self._path(VECTORS_FILE)) // (4 * self.dim))
+        self._keys = keys[:count]
+        self._order = np.argsort(self._keys, kind='stable')
+        self._sorted_keys = self._keys[self._order]
+        self._vectors = (np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode='r',
+                                   shape=(count, self.dim)) if count else None)
+        
+        used = (np.fromfile(self._path(USED_FILE), dtype=np.uint32)
+                if count and os.path.exists(self._path(USED_FILE)) else np.zeros(0, np.uint32))
+        self._used = np.full(count, self.generation - 1, dtype=np.uint32)
+        self._used[:min(len(used), count)] = used[:count]
+        
+        # Entries created in this run: key -> vector, appended to disk as they arrive
+        self._new: Dict[int, np.ndarray] = {}
+        self._new_keys: List[int] = []
+        self._truncate(count)
+        self._keys_out = open(self._path(KEYS_FILE), "ab")
+        self._vectors_out = open(self._path(VECTORS_FILE), "ab")
+        
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+    
+    def _acquire_lock(self):
+        """Exclusive lock on the cache until close(); the OS drops it if the process dies"""
+        lock = open(self._path(LOCK_FILE), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                raise CacheBusyError(f"embedding cache {self.folder} is in use by another process")
+        return lock
+    
+    def _truncate(self, count: int):
+        """Cut both data files back to count whole rows"""
+        for name, row_bytes in ((KEYS_FILE, 8), (VECTORS_FILE, 4 * self.dim)):
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) != count * row_bytes:
+                with open(path, "r+b") as f:
+                    f.truncate(count * row_bytes)
+    
+    @property
+    def entry_bytes(self) -> int:
+        return 8 + 4 + 4 * self.dim
+    
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._new_keys)
+    
+    def lookup(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+        """
+        Returns (keys, vectors, missing): vectors has a row per text, filled
+        for hits (None while the cache is empty); missing lists the positions
+        that still need embedding.
+        """
+        keys = np.fromiter((text_key(self.model_name, text) for text in texts),
+                           dtype=np.uint64, count=len(texts))
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32) if self.dim else None
+        missing = []
+        
+        if len(self._sorted_keys):
+            pos = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+            found = self._sorted_keys[pos] == keys
+            rows = self._order[pos[found]]
+            vectors[found] = self._vectors[rows]
+            self._used[rows] = self.generation
+        else:
+            found = np.zeros(len(texts), dtype=bool)
+        
+        for i in np.flatnonzero(~found):
+            vector = self._new.get(int(keys[i]))
+            if vector is None:
+                missing.append(int(i))
+            else:
+                vectors[i] = vector
+        
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return keys, vectors, missing
+    
+    def put(self, keys: np.ndarray, vectors: np.ndarray):
+        """Add freshly computed embeddings"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not self.dim:
+            # Record the dimension right away so rows survive a crash in this run
+            self.dim = vectors.shape[1]
+            self._write_info(self.generation - 1)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension changed from {self.dim} to {vectors.shape[1]}")
+        
+        fresh = []
+        for key, vector in zip(keys.tolist(), vectors):
+            if key not in self._new:
+                self._new[key] = vector
+                self._new_keys.append(key)
+                fresh.append(vector)
+        if not fresh:
+            return
+        
+        self._keys_out.write(np.asarray(self._new_keys[-len(fresh):], dtype=np.uint64).tobytes())
+        self._vectors_out.write(np.stack(fresh).tobytes())
+        self._keys_out.flush()
+        self._vectors_out.flush()
+    
+    def close(self):
+        """Record usage, evict least recently used entries over the size limit"""
+        self._keys_out.close()
+        self._vectors_out.close()
+        
+        count = len(self)
+        used = np.concatenate([self._used, np.full(len(self._new_keys), self.generation, dtype=np.uint32)])
+        
+        if count and count * self.entry_bytes > self.max_bytes:
+            keep = int(self.max_bytes * EVICT_TARGET) // self.entry_bytes
+            # Most recently used first; newer rows win ties
+            rows = np.sort(np.lexsort((-np.arange(count), -used.astype(np.int64)))[:keep])
+            self._compact(rows)
+            used = used[rows]
+            self.evicted += count - len(rows)
+        
+        used.tofile(self._path(USED_FILE))
+        self._write_info(self.generation)
+        self._lock.close()
+    
+    def _write_info(self, generation: int):
+        tmp = self._path(INFO_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({'model': self.model_name, 'dim': self.dim, 'generation': generation}, f)
+        os.replace(tmp, self._path(INFO_FILE))
+    
+    def _compact(self, rows: np.ndarray):
+        """Rewrite the data files keeping only the given rows (ascending)"""
+        keys = np.fromfile(self._path(KEYS_FILE), dtype=np.uint64)
+        vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode='r',
+                            shape=(len(keys), self.dim))
+        
+        keys[rows].tofile(self._path(KEYS_FILE + ".tmp"))
+        with open(self._path(VECTORS_FILE + ".tmp"), "wb") as f:
+            for start in range(0, len(rows), 65536):
+                f.write(np.ascontiguousarray(vectors[rows[start:start + 65536]]).tobytes())
+        del vectors
+        
+        os.replace(self._path(KEYS_FILE + ".tmp"), self._path(KEYS_FILE))
+        os.replace(self._path(VECTORS_FILE + ".tmp"), self._path(VECTORS_FILE))
+        self._vectors = None
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evicted': self.evicted,
+            'entries': len(self) - self.evicted,
+            'size_mb': (len(self) - self.evicted) * self.entry_bytes / 1e6
+        }
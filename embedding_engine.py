@@ -0,0 +1,100 @@
+"""
+Batch embedding engine for PDF ingestion
+Optionally spreads encode batches over a pool of CPU worker processes (each
+with its own model copy and a share of the cores), sorting chunks by length
+first so each worker's batches pad to similar lengths, and returns
+embeddings in the original order. Keeps a running chunks/sec figure for
+sizing ingestion nodes.
+"""
+
+import os
+import time
+import multiprocessing
+from typing import Callable, Dict, List
+import numpy as np
+
+# Model loaded once per worker process
+_worker_model = None
+
+
+def _init_worker(model_factory: Callable, model_name: str, threads: int):
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = model_factory(model_name)
+
+
+def _encode_in_worker(texts: List[str], batch_size: int) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=batch_size,
+                                show_progress_bar=False).astype('float32')
+
+
+class EmbeddingEngine:
+    """Optionally multi-process, length-sorted sentence-transformer encoding"""
+    
+    def __init__(self, model, model_factory: Callable, model_name: str,
+                 batch_size: int = 64, workers: int = 1):
+        self.model = model
+        self.model_factory = model_factory
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.chunks = 0
+        self.seconds = 0.0
+        self._pool = None
+    
+    def _get_pool(self):
+        """Start the worker pool on first use (a fully cached run never needs it)"""
+        if self._pool is None:
+            # spawn: forking a process that already ran torch can deadlock in OpenMP
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self._pool = multiprocessing.get_context("spawn").Pool(
+                processes=self.workers, initializer=_init_worker,
+                initargs=(self.model_factory, self.model_name, threads))
+        return self._pool
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts; rows come back in the order of texts"""
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        
+        start = time.perf_counter()
+        if self.workers == 1:
+            # encode() already sorts by length within the call
+            embeddings = self.model.encode(texts, batch_size=self.batch_size,
+                                           show_progress_bar=False).astype('float32')
+        else:
+            # Longest first, the same character-length key encode() sorts by,
+            # and whole batches per task so each worker pads similar lengths
+            lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+            order = np.argsort(-lengths, kind='stable')
+            ordered = [texts[i] for i in order]
+            per_task = self.batch_size * max(1, -(-len(ordered) // (self.batch_size * self.workers * 4)))
+            pool = self._get_pool()
+            jobs = [pool.apply_async(_encode_in_worker, (ordered[i:i + per_task], self.batch_size))
+                    for i in range(0, len(ordered), per_task)]
+            parts = [job.get() for job in jobs]
+            embeddings = np.empty((len(texts), parts[0].shape[1]), dtype='float32')
+            embeddings[order] = np.concatenate(parts)
+        
+        self.chunks += len(texts)
+        self.seconds += time.perf_counter() - start
+        return embeddings
+    
+    def stats(self) -> Dict:
+        return {
+            'chunks': self.chunks,
+            'seconds': self.seconds,
+            'chunks_per_sec': self.chunks / self.seconds if self.seconds else 0.0,
+            'workers': self.workers,
+            'batch_size': self.batch_size
+        }
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
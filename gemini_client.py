@@ -0,0 +1,551 @@
+"""
+Resilient Gemini REST client
+One pooled HTTP connection set per process, a deadline per call covering all
+attempts, jittered exponential backoff on retryable errors (429, 5xx,
+timeouts, connection failures), an optional hedged duplicate request once an
+attempt runs past the recent p95 latency, and a circuit breaker that fails
+calls immediately while Gemini is degraded so callers fall back to raw PDF
+text. GEMINI_API_BASE points the client at a local stand-in server for tests.
+ModelSelector picks the model lazily (no startup probing) and fails over to
+the next candidate when a call hits a model-specific error.
+"""
+
+import os
+import json
+import time
+import logging
+import random
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+from metrics import metrics
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# httpx logs every request at INFO; the apps log at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+API_TIMEOUT_SECONDS = float(os.getenv('API_TIMEOUT_SECONDS', '30'))
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '2'))
+GEMINI_POOL_CONNECTIONS = int(os.getenv('GEMINI_POOL_CONNECTIONS', '20'))
+# Send a duplicate request when an attempt outlives the p95 of recent calls
+GEMINI_HEDGE = os.getenv('GEMINI_HEDGE', '0') == '1'
+GEMINI_BREAKER_FAILURES = int(os.getenv('GEMINI_BREAKER_FAILURES', '5'))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv('GEMINI_BREAKER_COOLDOWN_SECONDS', '30'))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_MAX_SECONDS = 4.0
+HEDGE_MIN_SAMPLES = 20
+
+# Model candidates in order of preference and where the chosen one is shared
+GEMINI_MODELS = [m.strip() for m in os.getenv(
+    'GEMINI_MODELS', 'gemini-2.5-flash,gemini-2.0-flash,gemini-flash-latest').split(',') if m.strip()]
+GEMINI_MODEL_RECORD = os.getenv('GEMINI_MODEL_RECORD',
+                                os.path.join(tempfile.gettempdir(), 'miningai_gemini_model.json'))
+GEMINI_MODEL_TTL_SECONDS = float(os.getenv('GEMINI_MODEL_TTL_SECONDS', '3600'))
+RECORD_REFRESH_SECONDS = 30
+# Errors that are about the model (retired, no access, its quota used up), not the service
+MODEL_FAILOVER_STATUS = {403, 404, 429}
+
+
+class GeminiError(Exception):
+    """Failed Gemini call; status is None for transport errors"""
+    
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = False,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(GeminiError):
+    """Raised without calling Gemini while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive retryable failures;
+    open -> half-open after `cooldown` seconds, letting one trial call through;
+    the trial closes the breaker on success and reopens it on failure. A call
+    that ends without either (cancelled, or an error on our side) releases
+    the trial so the next call can make it.
+    """
+    
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._trial_running = False
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._trial_running = False
+            self.state = 'closed'
+    
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self._consecutive >= self.failures:
+                if self.state != 'open':
+                    metrics.inc('gemini.breaker_opened')
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+    
+    def release(self):
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial_running = False
+
+
+class LatencyWindow:
+    """Latencies of the last successful calls, for the hedging delay"""
+    
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class GeminiClient:
+    """generateContent / streamGenerateContent over pooled HTTP connections"""
+    
+    def __init__(self, api_key: str, base_url: str = GEMINI_API_BASE,
+                 timeout: Optional[float] = None, max_retries: int = GEMINI_MAX_RETRIES,
+                 hedge: bool = GEMINI_HEDGE, pool_connections: int = GEMINI_POOL_CONNECTIONS,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout or API_TIMEOUT_SECONDS
+        self.max_retries = max(0, max_retries)
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN_SECONDS)
+        self.latency = LatencyWindow()
+        self._headers = {'x-goog-api-key': api_key, 'Content-Type': 'application/json'}
+        self._limits = httpx.Limits(max_connections=pool_connections,
+                                    max_keepalive_connections=pool_connections)
+        self._http = httpx.Client(base_url=self.base_url, headers=self._headers, limits=self._limits)
+        self._async_http = None
+        self._hedge_pool = None
+    
+    # ------------------------------------------------------------------ sync
+    
+    def generate(self, model: str, prompt: str, timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None) -> str:
+        """Response text; raises GeminiError once retries or the deadline run out"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self._check_breaker()
+            try:
+                text = self._hedged(model, prompt, deadline)
+            except GeminiError as e:
+                delay = self._retry_delay(e, attempt, retries, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                metrics.inc('gemini.retries')
+                time.sleep(delay)
+                continue
+            finally:
+                self.breaker.release()
+            return text
+    
+    def stream(self, model: str, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Yield response text as it is generated. Not retried: part of the
+        answer may already be with the client.
+        """
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        self._check_breaker()
+        try:
+            with self._http.stream('POST', f"/v1beta/models/{model}:streamGenerateContent",
+                                   params={'alt': 'sse'}, json=self._body(prompt),
+                                   timeout=timeout) as response:
+                if response.status_code != 200:
+                    response.read()
+                    raise self._http_error(response)
+                for line in response.iter_lines():
+                    if time.monotonic() > deadline:
+                        raise GeminiError("deadline exceeded", retryable=True)
+                    if line.startswith('data:'):
+                        text = self._text(self._json(line[5:]), required=False)
+                        if text:
+                            yield text
+        except (httpx.TransportError, GeminiError) as e:
+            error = e if isinstance(e, GeminiError) else self._transport_error(e)
+            self._record(error)
+            raise error
+        except GeneratorExit:
+            # The caller stopped reading (client went away): Gemini was answering
+            self.breaker.record_success()
+            raise
+        finally:
+            self.breaker.release()
+        self.breaker.record_success()
+    
+    def _hedged(self, model: str, prompt: str, deadline: float) -> str:
+        delay = self.latency.p95() if self.hedge else None
+        if delay is None or delay >= self._remaining(deadline):
+            return self._attempt(model, prompt, deadline)
+        
+        if self._hedge_pool is None:
+            self._hedge_pool = ThreadPoolExecutor(self._limits.max_connections, thread_name_prefix='gemini-hedge')
+        first = self._hedge_pool.submit(self._attempt, model, prompt, deadline)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        
+        metrics.inc('gemini.hedges')
+        pending = {first, self._hedge_pool.submit(self._attempt, model, prompt, deadline)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()  # the slower request finishes in the background
+                error = future.exception()
+        raise error
+    
+    def _attempt(self, model: str, prompt: str, deadline: float) -> str:
+        start = time.monotonic()
+        try:
+            response = self._http.post(f"/v1beta/models/{model}:generateContent",
+                                       json=self._body(prompt), timeout=self._remaining(deadline))
+        except httpx.TransportError as e:
+            error = self._transport_error(e)
+        else:
+            error = self._http_error(response) if response.status_code != 200 else None
+            if error is None:
+                try:
+                    text = self._text(self._json(response.content))
+                except GeminiError as e:
+                    error = e
+                else:
+                    self._record_success(start)
+                    return text
+        self._record(error)
+        raise error
+    
+    # ----------------------------------------------------------------- async
+    
+    async def agenerate(self, model: str, prompt: str, timeout: Optional[float] = None) -> str:
+        """generate() for the event loop: awaits I/O, hedges with a second task"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            self._check_breaker()
+            try:
+                text = await self._ahedged(model, prompt, deadline)
+            except GeminiError as e:
+                delay = self._retry_delay(e, attempt, self.max_retries, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                metrics.inc('gemini.retries')
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                self.breaker.release()
+            return text
+    
+    async def _ahedged(self, model: str, prompt: str, deadline: float) -> str:
+        delay = self.latency.p95() if self.hedge else None
+        if delay is None or delay >= self._remaining(deadline):
+            return await self._aattempt(model, prompt, deadline)
+        
+        first = asyncio.ensure_future(self._aattempt(model, prompt, deadline))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done:
+            return first.result()
+        
+        metrics.inc('gemini.hedges')
+        pending = {first, asyncio.ensure_future(self._aattempt(model, prompt, deadline))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _aattempt(self, model: str, prompt: str, deadline: float) -> str:
+        if self._async_http is None:
+            self._async_http = httpx.AsyncClient(base_url=self.base_url, headers=self._headers,
+                                                 limits=self._limits)
+        start = time.monotonic()
+        try:
+            response = await self._async_http.post(f"/v1beta/models/{model}:generateContent",
+                                                   json=self._body(prompt),
+                                                   timeout=self._remaining(deadline))
+        except httpx.TransportError as e:
+            error = self._transport_error(e)
+        else:
+            error = self._http_error(response) if response.status_code != 200 else None
+            if error is None:
+                try:
+                    text = self._text(self._json(response.content))
+                except GeminiError as e:
+                    error = e
+                else:
+                    self._record_success(start)
+                    return text
+        self._record(error)
+        raise error
+    
+    # --------------------------------------------------------------- helpers
+    
+    @staticmethod
+    def _body(prompt: str) -> Dict:
+        return {'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]}
+    
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise GeminiError("deadline exceeded")
+        return remaining
+    
+    @staticmethod
+    def _json(body) -> Dict:
+        """A response body (or SSE event) as a dict; anything else is a GeminiError"""
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            raise GeminiError(f"malformed response: {e}", status=200)
+        if not isinstance(payload, dict):
+            raise GeminiError("malformed response: not a JSON object", status=200)
+        return payload
+    
+    @staticmethod
+    def _text(payload: Dict, required: bool = True) -> str:
+        try:
+            candidates = payload.get('candidates') or []
+            parts = (candidates[0].get('content') or {}).get('parts', []) if candidates else []
+            text = ''.join(part.get('text', '') for part in parts)
+        except (AttributeError, TypeError) as e:
+            raise GeminiError(f"malformed response: {e}", status=200)
+        if not text and required:
+            reason = (payload.get('promptFeedback') or {}).get('blockReason') \
+                or (candidates[0].get('finishReason') if candidates else 'no candidates')
+            raise GeminiError(f"empty response ({reason})", status=200)
+        return text
+    
+    @staticmethod
+    def _transport_error(error: httpx.TransportError) -> GeminiError:
+        if isinstance(error, httpx.TimeoutException):
+            return GeminiError("timed out", retryable=True)
+        return GeminiError(f"connection failed: {error}", retryable=True)
+    
+    @staticmethod
+    def _http_error(response: httpx.Response) -> GeminiError:
+        try:
+            message = response.json()['error']['message']
+        except Exception:
+            message = response.text[:200]
+        retry_after = response.headers.get('Retry-After')
+        return GeminiError(f"HTTP {response.status_code}: {message}", status=response.status_code,
+                           retryable=response.status_code in RETRYABLE_STATUS,
+                           retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+    
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            metrics.inc('gemini.breaker_rejected')
+            raise CircuitOpenError("circuit open: Gemini is failing, not calling it")
+    
+    def _retry_delay(self, error: GeminiError, attempt: int, retries: int, deadline: float) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up"""
+        if not error.retryable or attempt >= retries or isinstance(error, CircuitOpenError):
+            return None
+        # Full jitter: uniform over [0, exponential cap]
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+    
+    def _record_success(self, start: float):
+        elapsed = time.monotonic() - start
+        self.latency.add(elapsed)
+        self.breaker.record_success()
+        metrics.observe('gemini.request', elapsed * 1000)
+    
+    def _record(self, error: GeminiError):
+        """Count a failed attempt; only overload/outage errors trip the breaker"""
+        metrics.inc('gemini.errors')
+        if error.retryable:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+    
+    def stats(self) -> Dict:
+        p95 = self.latency.p95()
+        return {
+            'breaker': self.breaker.state,
+            'timeout_seconds': self.timeout,
+            'max_retries': self.max_retries,
+            'hedge': self.hedge,
+            'p95_ms': round(p95 * 1000, 2) if p95 is not None else None
+        }
+    
+    def close(self):
+        self._http.close()
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+
+
+class ModelSelector:
+    """
+    Which Gemini model to call, chosen without probing: the model in the
+    shared record (Redis when reachable, else a JSON file, so all workers on
+    a host agree), or the first candidate. A call failing with a
+    model-specific error moves to the next candidate and records it; the
+    record expires after ttl so the preferred model is tried again later.
+    """
+    
+    def __init__(self, candidates: List[str] = GEMINI_MODELS, record_path: str = GEMINI_MODEL_RECORD,
+                 ttl_seconds: float = GEMINI_MODEL_TTL_SECONDS, redis_url: Optional[str] = None,
+                 redis_key: str = "miningai:gemini_model"):
+        self.candidates = list(candidates)
+        self.record_path = record_path
+        self.ttl_seconds = ttl_seconds
+        self.redis_url = redis_url
+        self.redis_key = redis_key
+        self._redis = None
+        self._model = None
+        self._recorded = False
+        self._expires_at = 0.0  # wall clock: the record is shared between processes
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def current(self) -> str:
+        """Model to call now; re-reads the shared record every few seconds"""
+        with self._lock:
+            now = time.time()
+            if self._model is None or now - self._checked_at >= RECORD_REFRESH_SECONDS or now >= self._expires_at:
+                self._checked_at = now
+                record = self._read()
+                if record and record.get('model') in self.candidates and record.get('expires_at', 0) > now:
+                    self._model, self._expires_at = record['model'], record['expires_at']
+                    self._recorded = True
+                elif self._model is None or now >= self._expires_at:
+                    # Nothing shared yet: the preferred model, recorded once a call succeeds
+                    self._model, self._expires_at = self.candidates[0], now + self.ttl_seconds
+                    self._recorded = False
+            return self._model
+    
+    def confirm(self, model: str):
+        """A call to model succeeded: share it unless the record already says so"""
+        with self._lock:
+            if model == self._model and self._recorded and self._expires_at - time.time() > self.ttl_seconds / 2:
+                return
+            self._set(model)
+    
+    def failover(self, failed: str) -> Optional[str]:
+        """Next candidate after a model-specific failure, or None if none is left"""
+        with self._lock:
+            metrics.inc('gemini.model_failovers')
+            if self._model != failed:
+                return self._model  # another request already moved on
+            index = self.candidates.index(failed) + 1 if failed in self.candidates else 0
+            if index >= len(self.candidates):
+                return None
+            self._set(self.candidates[index])
+            return self._model
+    
+    def _set(self, model: str):
+        self._model, self._expires_at = model, time.time() + self.ttl_seconds
+        self._recorded = True
+        self._write({'model': model, 'expires_at': self._expires_at})
+    
+    def _redis_client(self):
+        if self._redis is None and self.redis_url and redis is not None:
+            try:
+                client = redis.Redis.from_url(self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+                client.ping()
+                self._redis = client
+            except Exception:
+                self.redis_url = None  # use the file from now on
+        return self._redis
+    
+    def _read(self) -> Optional[Dict]:
+        try:
+            client = self._redis_client()
+            if client is not None:
+                payload = client.get(self.redis_key)
+            else:
+                with open(self.record_path, 'r') as f:
+                    payload = f.read()
+            return json.loads(payload) if payload else None
+        except (OSError, ValueError):
+            return None
+        except Exception as e:
+            print(f"⚠️  Gemini model record read failed: {e}")
+            return None
+    
+    def _write(self, record: Dict):
+        try:
+            client = self._redis_client()
+            if client is not None:
+                client.set(self.redis_key, json.dumps(record), ex=int(self.ttl_seconds))
+                return
+            # Write then rename, so other workers never read half a record
+            tmp_path = f"{self.record_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, self.record_path)
+        except Exception as e:
+            print(f"⚠️  Gemini model record write failed: {e}")
+    
+    def stats(self) -> Dict:
+        return {
+            'model': self._model,
+            'candidates': self.candidates,
+            'record': 'redis' if self._redis is not None else self.record_path,
+            'expires_in_seconds': max(0, round(self._expires_at - time.time())) if self._model else None
+        }
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini REST API
+Answers generateContent and streamGenerateContent (alt=sse) with canned text
+after a configurable latency, and fails a share of requests, so timeouts,
+retries, hedging and the circuit breaker can be exercised without a key:
+
+    python gemini_stub_server.py --port 8089 --latency 0.3 --fail-rate 0.2
+    GEMINI_API_BASE=http://localhost:8089 GEMINI_API_KEY=test python main.py
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROUTE = re.compile(r'^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)')
+
+
+def make_handler(args):
+    class GeminiStub(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+        disable_nagle_algorithm = True
+        
+        def do_POST(self):
+            try:
+                self._respond()
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # client gave up (deadline, hedge loser)
+        
+        def _respond(self):
+            match = ROUTE.match(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not match:
+                return self._json(404, {"error": {"code": 404, "message": "Not found"}})
+            model, method = match.groups()
+            if args.models and model not in args.models:
+                return self._json(404, {"error": {"code": 404, "message": f"models/{model} is not found"}})
+            
+            time.sleep(max(0.0, random.gauss(args.latency, args.jitter)))
+            if random.random() < args.fail_rate:
+                return self._json(args.fail_status, {"error": {"code": args.fail_status, "message": "stub failure"}})
+            
+            prompt = json.loads(body)['contents'][-1]['parts'][0]['text']
+            question = prompt.rsplit('Question:', 1)[-1].replace('Answer:', '').strip()
+            answer = f"Stub answer from {model} to: {question[:200]}"
+            
+            if method == 'generateContent':
+                return self._json(200, self._candidate(answer))
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for word in answer.split(' '):
+                self.wfile.write(f"data: {json.dumps(self._candidate(word + ' '))}\r\n\r\n".encode())
+                self.wfile.flush()
+                time.sleep(args.token_delay)
+            self.close_connection = True
+        
+        @staticmethod
+        def _candidate(text):
+            return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                    "finishReason": "STOP"}]}
+        
+        def _json(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+    
+    return GeminiStub
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in Gemini API server")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.2, help="mean response delay (s)")
+    parser.add_argument('--jitter', type=float, default=0.05, help="delay standard deviation (s)")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--token-delay', type=float, default=0.02, help="delay between streamed words (s)")
+    parser.add_argument('--models', nargs='*', help="models that exist (default: any)")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args))
+    print(f"Gemini stand-in listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
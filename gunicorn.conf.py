@@ -0,0 +1,45 @@
+"""
+Gunicorn settings (read automatically from the working directory)
+
+With preload (the default) the app is imported once in the master: the
+embedding model and the knowledge base are loaded before the workers are
+forked and shared with them copy-on-write, the FAISS index and chunk store
+through their memory-mapped files. Each worker then only pays for its own
+heap. Set GUNICORN_PRELOAD=0 to load the app in every worker instead
+(needed for code reloads with HUP).
+
+    gunicorn main:app
+    gunicorn main_production:app
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# Intra-op threads each worker gives torch for query embedding
+torch_threads = int(os.getenv('TORCH_THREADS_PER_WORKER', '0')) or max(1, (os.cpu_count() or 1) // workers)
+
+if preload_app:
+    # The master must not start an OpenMP thread pool: a forked child
+    # inherits the pool's bookkeeping but not its threads and can hang on its
+    # first encode. Workers size their own pool in post_fork().
+    os.environ['OMP_NUM_THREADS'] = '1'
+
+
+def when_ready(server):
+    # Keep the loaded app out of the cyclic GC, whose passes would otherwise
+    # write to (and so un-share) every object the workers inherited
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(torch_threads)
@@ -0,0 +1,298 @@
+"""
+BM25 inverted index for the PDF knowledge base
+Built from the chunk store at ingestion and saved in the same knowledge base
+version, so lexical and vector search always cover the same chunks. Catches
+what embeddings blur: equipment model numbers, mineral formulas and clause
+ids ("Komatsu 980E", "Fe3O4", "ISO 45001"). Flat arrays, memory-mapped:
+
+    terms.u64      8-byte blake2b hash of each term, sorted
+    offsets.npy    start of each term's postings (len(terms) + 1 entries)
+    rows.i32       chunk store row of each posting, per term ascending
+    weights.f32    BM25 term-frequency weight of each posting
+    idf.f32        BM25 idf of each term
+    info.json      k1, b, chunk count, average chunk length
+
+Building streams: postings are collected in blocks, sorted and spilled to
+run files, then merged one hash range at a time, so memory is bounded by
+the block size rather than by the corpus.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+
+TERMS_FILE = "terms.u64"
+OFFSETS_FILE = "offsets.npy"
+ROWS_FILE = "rows.i32"
+WEIGHTS_FILE = "weights.f32"
+IDF_FILE = "idf.f32"
+INFO_FILE = "info.json"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Postings held in memory while building (spilled to a sorted run when full)
+BUILD_BLOCK_POSTINGS = 1 << 20
+RUNS_FOLDER = "runs.tmp"
+
+# Words joined by . - / stay one token ("980e", "fe3o4", "45001-2018") and
+# their parts are indexed as well, so "ISO-45001" also matches "ISO 45001"
+_TOKEN_RE = re.compile(r'[0-9a-z]+(?:[./-][0-9a-z]+)*')
+_PART_RE = re.compile(r'[./-]')
+
+# Clause and document ids are three or more digit groups ("04/0007/2003", "3.2.1")
+_CLAUSE_RE = re.compile(r'[0-9]+(?:[./-][0-9]+){2,}')
+# Numbers with a unit or ordinal suffix ("100m", "10kg", "2nd", "1990s") are
+# quantities, not model numbers
+UNITS = ('mm', 'cm', 'm', 'km', 'ft', 'in', 'mi', 'g', 'kg', 't', 'kt', 'mt', 'lb', 'lbs', 'oz',
+         'l', 'ml', 's', 'ms', 'min', 'h', 'hr', 'hrs', 'yr', 'yrs', 'st', 'nd', 'rd', 'th',
+         'w', 'kw', 'mw', 'v', 'kv', 'a', 'hz', 'pa', 'kpa', 'mpa', 'psi', 'db', 'ppm', 'mph', 'kph')
+_QUANTITY_RE = re.compile(r'[0-9]+(?:\.[0-9]+)?(?:%s)' % '|'.join(UNITS))
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it its of on or
+should that the their there these this to was what when where which who why
+will with you your about into than then them they we our not no
+""".split())
+
+
+def tokenize(text: str, parts: bool = True) -> List[str]:
+    """Lowercased terms of a text, stopwords dropped, compound parts added"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    terms = []
+    for token in _TOKEN_RE.findall(text):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if parts and len(token) > 3 and _PART_RE.search(token):
+            terms.extend(part for part in _PART_RE.split(token) if len(part) > 1)
+    return terms
+
+
+def is_identifier(term: str) -> bool:
+    """
+    Model numbers, formulas, clause ids ("980e", "fe3o4", "04/0007/2003"):
+    terms mixing letters and digits, or three or more digit groups. Plain
+    numbers, years and quantities ("10", "2019", "3.5", "100m") are not.
+    """
+    if _CLAUSE_RE.fullmatch(term):
+        return True
+    return (any(ch.isdigit() for ch in term) and any(ch.isalpha() for ch in term)
+            and not _QUANTITY_RE.fullmatch(term))
+
+
+def _hash_terms(terms: Iterable[str]) -> np.ndarray:
+    return np.fromiter((int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+                        for term in terms), dtype=np.uint64)
+
+
+def build(folder: str, texts: Iterable[str], k1: float = BM25_K1, b: float = BM25_B,
+          block_postings: int = BUILD_BLOCK_POSTINGS) -> Dict:
+    """Index texts (row i = i-th text) into folder; returns the info written"""
+    os.makedirs(folder, exist_ok=True)
+    runs_folder = os.path.join(folder, RUNS_FOLDER)
+    shutil.rmtree(runs_folder, ignore_errors=True)
+    os.makedirs(runs_folder)
+    try:
+        runs, lengths = _spill_runs(runs_folder, texts, max(1, block_postings))
+        return _merge_runs(folder, runs, lengths, k1, b, max(1, block_postings))
+    finally:
+        shutil.rmtree(runs_folder, ignore_errors=True)
+
+
+def _spill_runs(runs_folder: str, texts: Iterable[str],
+                block_postings: int) -> Tuple[List[Tuple[np.ndarray, np.ndarray, np.ndarray]], np.ndarray]:
+    """
+    Write the postings of texts as runs sorted by term hash (rows ascending
+    within a term, and from one run to the next). Returns the memory-mapped
+    (hashes, rows, tfs) of each run and the term count of every text.
+    """
+    runs = []
+    length_parts = []
+    block_terms, block_rows, block_tfs, block_lengths = [], [], [], []
+    
+    def spill():
+        hashes = _hash_terms(block_terms)
+        order = np.argsort(hashes, kind='stable')
+        path = os.path.join(runs_folder, str(len(runs)))
+        hashes[order].tofile(path + ".u64")
+        np.asarray(block_rows, dtype=np.int32)[order].tofile(path + ".i32")
+        np.asarray(block_tfs, dtype=np.float32)[order].tofile(path + ".f32")
+        runs.append((_map(path + ".u64", np.uint64), _map(path + ".i32", np.int32),
+                     _map(path + ".f32", np.float32)))
+        block_terms.clear()
+        block_rows.clear()
+        block_tfs.clear()
+    
+    for row, text in enumerate(texts):
+        counts = defaultdict(int)
+        terms = tokenize(text)
+        for term in terms:
+            counts[term] += 1
+        block_terms.extend(counts)
+        block_rows.extend([row] * len(counts))
+        block_tfs.extend(counts.values())
+        block_lengths.append(len(terms))
+        if len(block_terms) >= block_postings:
+            spill()
+            length_parts.append(np.asarray(block_lengths, dtype=np.float32))
+            block_lengths = []
+    if block_terms:
+        spill()
+    length_parts.append(np.asarray(block_lengths, dtype=np.float32))
+    return runs, np.concatenate(length_parts)
+
+
+def _merge_runs(folder: str, runs: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                lengths: np.ndarray, k1: float, b: float, block_postings: int) -> Dict:
+    """
+    Merge sorted runs into the index files, one slice of the hash space at a
+    time. Hashes are uniform, so each slice holds about block_postings postings.
+    """
+    n = len(lengths)
+    avgdl = float(lengths.mean()) if n else 0.0
+    total = sum(len(hashes) for hashes, _, _ in runs)
+    slices = max(1, -(-total // block_postings))
+    bounds = np.asarray([(i << 64) // slices for i in range(1, slices)], dtype=np.uint64)
+    cuts = [np.concatenate([[0], np.searchsorted(hashes, bounds), [len(hashes)]])
+            for hashes, _, _ in runs]
+    
+    offset_parts = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with open(os.path.join(folder, TERMS_FILE), "wb") as terms_file, \
+            open(os.path.join(folder, ROWS_FILE), "wb") as rows_file, \
+            open(os.path.join(folder, WEIGHTS_FILE), "wb") as weights_file, \
+            open(os.path.join(folder, IDF_FILE), "wb") as idf_file:
+        for i in range(slices):
+            parts = [(hashes[cut[i]:cut[i + 1]], rows[cut[i]:cut[i + 1]], tfs[cut[i]:cut[i + 1]])
+                     for (hashes, rows, tfs), cut in zip(runs, cuts)]
+            if not any(len(part[0]) for part in parts):
+                continue
+            hashes, rows, tfs = (np.concatenate([part[j] for part in parts]) for j in range(3))
+            # Stable, so a term's postings keep run order: rows stay ascending
+            order = np.argsort(hashes, kind='stable')
+            hashes, rows, tfs = hashes[order], rows[order], tfs[order]
+            terms, counts = np.unique(hashes, return_counts=True)
+            
+            # Everything but idf is fixed per posting, so queries only multiply and add
+            norm = k1 * (1 - b + b * lengths[rows] / max(avgdl, 1e-9))
+            weights = (tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+            idf = np.log(1 + (n - counts + 0.5) / (counts + 0.5)).astype(np.float32)
+            
+            terms.tofile(terms_file)
+            rows.tofile(rows_file)
+            weights.tofile(weights_file)
+            idf.tofile(idf_file)
+            offset_parts.append(position + np.cumsum(counts))
+            position += len(rows)
+    
+    offsets = np.concatenate(offset_parts).astype(np.int64)
+    np.save(os.path.join(folder, OFFSETS_FILE), offsets)
+    info = {'k1': k1, 'b': b, 'chunks': n, 'avgdl': avgdl, 'terms': len(offsets) - 1}
+    with open(os.path.join(folder, INFO_FILE), "w") as f:
+        json.dump(info, f)
+    return info
+
+
+def _map(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)  # memmap cannot map an empty file
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class LexicalIndex:
+    """Read-only, memory-mapped BM25 index"""
+    
+    def __init__(self, folder: str):
+        self.folder = folder
+        with open(os.path.join(folder, INFO_FILE)) as f:
+            self.info = json.load(f)
+        self.terms = _map(os.path.join(folder, TERMS_FILE), np.uint64)
+        self.offsets = np.load(os.path.join(folder, OFFSETS_FILE), mmap_mode='r')
+        self.rows = _map(os.path.join(folder, ROWS_FILE), np.int32)
+        self.weights = _map(os.path.join(folder, WEIGHTS_FILE), np.float32)
+        self.idf = _map(os.path.join(folder, IDF_FILE), np.float32)
+    
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, INFO_FILE))
+    
+    def __len__(self) -> int:
+        return self.info['chunks']
+    
+    def _term_ids(self, terms: List[str]) -> List[int]:
+        """Positions of the indexed terms among `terms` (unknown ones skipped)"""
+        if not terms or not len(self.terms):
+            return []
+        hashes = _hash_terms(terms)
+        positions = np.searchsorted(self.terms, hashes)
+        return [int(p) for p, h in zip(positions, hashes) if p < len(self.terms) and self.terms[p] == h]
+    
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+        return self.rows[start:end], self.weights[start:end]
+    
+    def score(self, terms: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, BM25 scores) of every chunk matching any of the terms"""
+        term_ids = self._term_ids(list(dict.fromkeys(terms)))
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = np.concatenate([self._postings(t)[0] for t in term_ids])
+        weights = np.concatenate([self._postings(t)[1] * self.idf[t] for t in term_ids])
+        matched, inverse = np.unique(rows, return_inverse=True)
+        return matched, np.bincount(inverse, weights=weights).astype(np.float32)
+    
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Best (row, score) pairs for a query, highest score first"""
+        rows, scores = self.score(tokenize(query))
+        return _top(rows, scores, top_k)
+    
+    def search_all_of(self, terms: List[str], query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Like search(), restricted to chunks that contain every one of `terms`"""
+        term_ids = self._term_ids(terms)
+        if len(term_ids) < len(set(terms)):
+            return []  # some term occurs nowhere
+        rows = self._postings(term_ids[0])[0]
+        for term_id in term_ids[1:]:
+            rows = np.intersect1d(rows, self._postings(term_id)[0], assume_unique=True)
+        if not len(rows):
+            return []
+        matched, scores = self.score(tokenize(query))
+        keep = np.isin(matched, rows, assume_unique=True)
+        return _top(matched[keep], scores[keep], top_k)
+    
+    def coverage(self, terms: List[str], rows: List[int]) -> np.ndarray:
+        """Fraction of the distinct terms each row contains"""
+        terms = list(dict.fromkeys(terms))
+        found = np.zeros(len(rows), dtype=np.float32)
+        if not terms:
+            return found
+        rows = np.asarray(rows, dtype=np.int32)
+        for term_id in self._term_ids(terms):
+            term_rows = self._postings(term_id)[0]
+            positions = np.minimum(np.searchsorted(term_rows, rows), len(term_rows) - 1)
+            found += term_rows[positions] == rows
+        return found / len(terms)
+
+
+def _top(rows: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    if len(rows) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[best], scores[best]
+    order = np.argsort(-scores, kind='stable')
+    return [(int(rows[i]), float(scores[i])) for i in order]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[int]:
+    """Rows ordered by sum of 1 / (k + rank) over the rankings they appear in"""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] += 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
@@ -9,7 +9,7 @@ import os
 import json
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 import numpy as np
 
 # Load API key from .env
@@ -32,19 +32,8 @@ try:
 except ImportError:
     NLP_AVAILABLE = False
 
-# Gemini AI import - Try new package first
-try:
-    import google.genai as genai
-    GEMINI_AVAILABLE = True
-    GEMINI_PACKAGE = 'genai'
-except ImportError:
-    try:
-        import google.generativeai as genai
-        GEMINI_AVAILABLE = True
-        GEMINI_PACKAGE = 'generativeai'
-    except ImportError:
-        GEMINI_AVAILABLE = False
-        GEMINI_PACKAGE = None
+# Question analysis, PDF RAG and Gemini, shared with main_production.py
+from chat_engine import get_engine
 
 # Web search imports
 try:
@@ -53,148 +42,10 @@ try:
 except ImportError:
     WEB_SEARCH_AVAILABLE = False
 
-# PDF RAG System
-try:
-    from pdf_processor import PDFRAGSystem
-    PDF_RAG_AVAILABLE = True
-except ImportError:
-    PDF_RAG_AVAILABLE = False
-    print("⚠️  PDF RAG system not available")
-
-
-class QuestionAnalyzer:
-    """Analyzes questions to determine complexity and best source."""
-    
-    def __init__(self):
-        self.simple_patterns = [
-            'what is', 'what are', 'define', 'explain', 'describe',
-            'how does', 'how do', 'types of', 'list', 'name'
-        ]
-        self.complex_patterns = [
-            'compare', 'analyze', 'evaluate', 'why', 'latest',
-            'recent', 'current', 'trend', 'future', 'predict',
-            'best practice', 'recommend', 'should i', 'which is better'
-        ]
-    
-    def analyze(self, question: str) -> Dict:
-        """Analyze question complexity and type."""
-        question_lower = question.lower()
-        
-        # Check if simple or complex
-        is_simple = any(pattern in question_lower for pattern in self.simple_patterns)
-        is_complex = any(pattern in question_lower for pattern in self.complex_patterns)
-        
-        # Check if asking for latest/current info
-        needs_current = any(word in question_lower for word in ['latest', 'recent', 'current', 'new', '2024', '2025', 'today'])
-        
-        # Determine complexity score
-        complexity = 'simple' if is_simple and not is_complex else 'complex' if is_complex else 'medium'
-        
-        return {
-            'complexity': complexity,
-            'needs_current_info': needs_current,
-            'is_simple': is_simple,
-            'is_complex': is_complex,
-            'recommended_source': 'local' if is_simple and not needs_current else 'ai' if is_complex or needs_current else 'local'
-        }
-
-
-class GeminiAI:
-    """Gemini AI integration for complex queries."""
-    
-    def __init__(self):
-        self.client = None
-        self.model_name = None
-        
-        if GEMINI_AVAILABLE:
-            api_key = os.getenv('GEMINI_API_KEY')
-            if api_key:
-                try:
-                    if GEMINI_PACKAGE == 'genai':
-                        # New google.genai package
-                        from google import genai as genai_new
-                        self.client = genai_new.Client(api_key=api_key)
-                        
-                        # Try models in order of preference
-                        model_names = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-flash-latest']
-                        
-                        for model_name in model_names:
-                            try:
-                                # Test the model
-                                response = self.client.models.generate_content(
-                                    model=model_name,
-                                    contents='Hi'
-                                )
-                                self.model_name = model_name
-                                print(f"✓ Gemini AI connected: {model_name}")
-                                break
-                            except Exception as e:
-                                print(f"  Trying next model... ({model_name} failed)")
-                                continue
-                    
-                    elif GEMINI_PACKAGE == 'generativeai':
-                        # Old google.generativeai package
-                        genai.configure(api_key=api_key)
-                        model_names = ['gemini-1.5-flash', 'gemini-1.5-pro', 'gemini-pro']
-                        
-                        for model_name in model_names:
-                            try:
-                                self.model_name = genai.GenerativeModel(model_name)
-                                test_response = self.model_name.generate_content("Hi")
-                                print(f"✓ Gemini AI connected: {model_name}")
-                                break
-                            except Exception as e:
-                                print(f"  Trying next model... ({model_name} failed)")
-                                continue
-                
-                except Exception as e:
-                    print(f"✗ Gemini AI error: {e}")
-    
-    def is_available(self) -> bool:
-        """Check if Gemini is available."""
-        if GEMINI_PACKAGE == 'genai':
-            return self.client is not None and self.model_name is not None
-        else:
-            return self.model_name is not None
-    
-    def get_response(self, question: str, context: str = "") -> str:
-        """Get response from Gemini AI."""
-        if not self.is_available():
-            return None
-        
-        try:
-            system_prompt = """You are a specialized AI assistant for the mining industry.
-            Provide accurate, detailed answers about mining operations, equipment, safety, 
-            geology, mineral processing, and all types of mining (gold, copper, iron, 
-            diamond, lithium, coal, etc.).
-            
-            Keep responses clear, professional, and focused on mining topics."""
-            
-            if context:
-                prompt = f"{system_prompt}\n\nContext: {context}\n\nQuestion: {question}\n\nAnswer:"
-            else:
-                prompt = f"{system_prompt}\n\nQuestion: {question}\n\nAnswer:"
-            
-            if GEMINI_PACKAGE == 'genai':
-                # New package API
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=prompt
-                )
-                return response.text
-            else:
-                # Old package API
-                response = self.model_name.generate_content(prompt)
-                if hasattr(response, 'text'):
-                    return response.text
-                elif hasattr(response, 'parts'):
-                    return ''.join(part.text for part in response.parts)
-                else:
-                    return str(response)
-        
-        except Exception as e:
-            print(f"Gemini error: {e}")
-            return None
+from answer_cache import AnswerCache
+from semantic_cache import SemanticCache
+from context_packer import pack_context
+from metrics import metrics, process_memory
 
 
 class EnhancedMiningKnowledgeBase:
@@ -379,23 +230,27 @@ class SmartMiningChatbot:
     """PDF RAG chatbot - answers come exclusively from your PDFs."""
     
     def __init__(self):
-        # Initialize PDF RAG system
-        if PDF_RAG_AVAILABLE:
-            print("Initializing PDF RAG system...")
-            try:
-                self.pdf_rag = PDFRAGSystem()
-                print("✓ PDF RAG system ready!")
-            except Exception as e:
-                print(f"⚠️  PDF RAG initialization failed: {e}")
-                self.pdf_rag = None
-        else:
-            self.pdf_rag = None
-            print("⚠️  PDF RAG system not available")
+        # PDF RAG, analyzer and Gemini come from the process-wide engine
+        engine = get_engine(redis_url=os.getenv('REDIS_URL'))
+        self.pdf_rag = engine.pdf_rag
+        self.analyzer = engine.analyzer
+        self.gemini = engine.gemini
+        self.reranker = engine.reranker
+        # Below the confidence threshold: 'refuse' (answer "not in the
+        # documents"), 'extractive' (raw PDF text) or 'off' (ask Gemini anyway)
+        self.confidence_gate = os.getenv('CONFIDENCE_GATE', 'refuse')
         
         # Initialize components
-        self.analyzer = QuestionAnalyzer()
-        self.gemini = GeminiAI()
         self.conversation_history = []
+        self.answer_cache = AnswerCache(
+            redis_url=os.getenv('REDIS_URL'),
+            max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '5000')),
+            ttl_seconds=int(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+        )
+        self.semantic_cache = SemanticCache(
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92')),
+            max_entries=int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+        )
     
     def clean_markdown(self, text: str) -> str:
         """Remove markdown formatting from text."""
@@ -444,6 +299,31 @@ class SmartMiningChatbot:
         3. Use Gemini AI with PDF context
         4. Return response with source citations
         """
+        result, retrieval = self.retrieve(question)
+        if result is not None:
+            return result
+        
+        print("Using Gemini AI with PDF context...")
+        gemini_response = self.gemini.get_response(question, retrieval['context'])
+        return self.compose_response(question, retrieval, gemini_response)
+    
+    async def get_response_async(self, question: str, run_cpu: Callable) -> dict:
+        """
+        get_response() for the ASGI app: retrieval and caching go through
+        run_cpu (a bounded executor) and the Gemini call is awaited.
+        """
+        result, retrieval = await run_cpu(self.retrieve, question)
+        if result is not None:
+            return result
+        
+        gemini_response = await self.gemini.get_response_async(question, retrieval['context'])
+        return await run_cpu(self.compose_response, question, retrieval, gemini_response)
+    
+    def retrieve(self, question: str) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        Steps 1-3 of get_response(). Returns (response, None) when no Gemini
+        call is needed, otherwise (None, retrieval) for compose_response().
+        """
         
         # Step 1: Check if mining-related
         if not self.is_mining_related(question):
@@ -453,7 +333,7 @@ class SmartMiningChatbot:
                 "source": "filter",
                 "analysis": {"complexity": "n/a"},
                 "success": False
-            }
+            }, None
         
         # Step 2: Analyze question
         analysis = self.analyzer.analyze(question)
@@ -467,11 +347,28 @@ class SmartMiningChatbot:
                 "source": "error",
                 "analysis": analysis,
                 "success": False
-            }
+            }, None
+        
+        # Same question against the same knowledge base and model: reuse the answer
+        cache_key = (question, self.pdf_rag.index_version, self.gemini.model_id())
+        cached = self.answer_cache.get(*cache_key)
+        if cached is not None:
+            return cached, None
         
         try:
-            # Search PDFs
-            pdf_results = self.pdf_rag.search(question, top_k=5)
+            # A rephrasing of a recently answered question gets the same answer
+            # (the query embedding is cached, so search() doesn't encode again).
+            # Questions search() answers lexically skip it and aren't encoded.
+            query_embedding = None
+            if not self.pdf_rag.answers_lexically(question):
+                query_embedding = self.pdf_rag.embed_query(question)
+                cached = self.semantic_cache.get(question, query_embedding, *cache_key[1:])
+                if cached is not None:
+                    return cached, None
+            
+            # Search PDFs (a wider candidate set when reranking)
+            pdf_results = self.pdf_rag.search(question, top_k=self.reranker.candidates)
+            pdf_results = self.reranker.rerank(question, pdf_results, cache_key[1])
             
             if not pdf_results:
                 return {
@@ -480,63 +377,95 @@ class SmartMiningChatbot:
                     "source": "no_results",
                     "analysis": analysis,
                     "success": False
-                }
+                }, None
             
             # Get confidence and context
-            pdf_confidence = pdf_results[0]['similarity_score']
+            pdf_confidence = max(r['similarity_score'] for r in pdf_results)
             print(f"PDF RAG confidence: {pdf_confidence:.2f}")
             
-            # Prepare context from top results
-            pdf_context = "\n\n".join([r['text'] for r in pdf_results])
-            pdf_sources = [r['metadata']['source'] for r in pdf_results]
+            # Prepare context from top results: neighbouring chunks merged,
+            # weak hits dropped, within the prompt token budget
+            packed = pack_context(pdf_results)
+            retrieval = {
+                "analysis": analysis,
+                "cache_key": cache_key,
+                "query_embedding": query_embedding,
+                "pdf_results": pdf_results,
+                "confidence": float(pdf_confidence),
+                "context": packed['context'],
+                "pdf_sources": packed['sources']
+            }
             
-            # Step 4: Use Gemini AI with PDF context
-            if not self.gemini.is_available():
-                # Fallback: return raw PDF content if Gemini not available
+            # Nothing retrieved is close enough to the question for a Gemini call
+            # (judged by cosine similarity; identifier and lexical matches pass)
+            gate_confidence = self.pdf_rag.confidence(pdf_results)
+            if (self.confidence_gate != 'off' and gate_confidence is not None
+                    and gate_confidence < self.pdf_rag.confidence_threshold):
+                metrics.inc('confidence_gate.skipped')
+                if self.confidence_gate == 'extractive':
+                    return self.compose_response(question, retrieval, None), None
                 return {
-                    "response": f"Based on the documents:\n\n{pdf_results[0]['text']}",
+                    "response": "I couldn't find information about this in the provided documents. Please try rephrasing your question or ensure the topic is covered in the PDFs.",
                     "confidence": float(pdf_confidence),
-                    "source": "pdf_raw",
+                    "source": "low_confidence",
                     "analysis": analysis,
-                    "success": True,
-                    "pdf_sources": list(set(pdf_sources))
-                }
+                    "success": False
+                }, None
+            metrics.inc('confidence_gate.passed')
             
-            print("Using Gemini AI with PDF context...")
-            gemini_response = self.gemini.get_response(question, pdf_context)
+            # Step 4: Use Gemini AI with PDF context
+            if not self.gemini.is_available():
+                # Fallback: return raw PDF content if Gemini not available
+                return self.compose_response(question, retrieval, None), None
             
+            return None, retrieval
+        
+        except Exception as e:
+            return self.error_response(e, analysis), None
+    
+    def compose_response(self, question: str, retrieval: dict, gemini_response: Optional[str]) -> dict:
+        """Step 4 of get_response(): the Gemini answer, or raw PDF text without one"""
+        try:
             if gemini_response:
                 # Clean markdown formatting
                 cleaned_response = self.clean_markdown(gemini_response)
                 
-                return {
+                result = {
                     "response": cleaned_response,
-                    "confidence": float(pdf_confidence),
+                    "confidence": retrieval['confidence'],
                     "source": "pdf_rag_gemini",
-                    "analysis": analysis,
+                    "analysis": retrieval['analysis'],
                     "success": True,
-                    "pdf_sources": list(set(pdf_sources))
+                    "pdf_sources": retrieval['pdf_sources']
                 }
+                cache_key = retrieval['cache_key']
+                self.answer_cache.put(*cache_key, result)
+                if retrieval['query_embedding'] is not None:
+                    self.semantic_cache.put(question, retrieval['query_embedding'], *cache_key[1:], result)
+                return result
             else:
-                # Gemini failed, return raw PDF content
+                # Gemini failed or unavailable, return raw PDF content
                 return {
-                    "response": f"Based on the documents:\n\n{pdf_results[0]['text']}",
-                    "confidence": float(pdf_confidence),
+                    "response": f"Based on the documents:\n\n{retrieval['pdf_results'][0]['text']}",
+                    "confidence": retrieval['confidence'],
                     "source": "pdf_raw",
-                    "analysis": analysis,
+                    "analysis": retrieval['analysis'],
                     "success": True,
-                    "pdf_sources": list(set(pdf_sources))
+                    "pdf_sources": retrieval['pdf_sources']
                 }
         
         except Exception as e:
-            print(f"Error processing question: {e}")
-            return {
-                "response": f"An error occurred while processing your question: {str(e)}",
-                "confidence": 0.0,
-                "source": "error",
-                "analysis": analysis,
-                "success": False
-            }
+            return self.error_response(e, retrieval['analysis'])
+    
+    def error_response(self, error: Exception, analysis: dict) -> dict:
+        print(f"Error processing question: {error}")
+        return {
+            "response": f"An error occurred while processing your question: {str(error)}",
+            "confidence": 0.0,
+            "source": "error",
+            "analysis": analysis,
+            "success": False
+        }
     
     def add_to_history(self, question: str, response: dict):
         """Add interaction to conversation history."""
@@ -558,6 +487,12 @@ print("Initializing smart mining chatbot...")
 chatbot = SmartMiningChatbot()
 print("✓ Chatbot ready!")
 
+@app.before_request
+def use_current_knowledge_base():
+    # Pick up a knowledge base version published by another process
+    if chatbot.pdf_rag:
+        chatbot.pdf_rag.swap_to_current()
+
 @app.route('/', methods=['GET'])
 def home():
     pdf_info = {}
@@ -565,7 +500,7 @@ def home():
         pdf_info = {
             "available": True,
             "chunks_indexed": len(chatbot.pdf_rag.chunks),
-            "pdfs_processed": len(set([m['source'] for m in chatbot.pdf_rag.metadata])) if chatbot.pdf_rag.metadata else 0
+            "pdfs_processed": len(chatbot.pdf_rag.list_sources())
         }
     else:
         pdf_info = {"available": False}
@@ -615,7 +550,8 @@ def status():
         pdf_info = {
             "available": True,
             "chunks_indexed": len(chatbot.pdf_rag.chunks),
-            "pdfs_processed": len(set([m['source'] for m in chatbot.pdf_rag.metadata])) if chatbot.pdf_rag.metadata else 0
+            "pdfs_processed": len(chatbot.pdf_rag.list_sources()),
+            "query_cache": chatbot.pdf_rag.query_cache.stats()
         }
     else:
         pdf_info = {"available": False}
@@ -627,6 +563,17 @@ def status():
         "strategy": "PDF RAG → Gemini AI (answers from your PDFs only)"
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        **metrics.snapshot(),
+        "answer_cache": chatbot.answer_cache.stats(),
+        "semantic_cache": chatbot.semantic_cache.stats(),
+        "gemini": chatbot.gemini.stats(),
+        "reranker": chatbot.reranker.stats(),
+        "memory": process_memory()
+    })
+
 @app.route('/api/health', methods=['GET'])
 def health():
     return jsonify({
@@ -635,6 +582,36 @@ def health():
         "port": 5001
     })
 
+# ASGI serving mode (uvicorn main:asgi_app): /api/chat awaits Gemini instead
+# of holding a worker; every other route is served by the Flask app above
+try:
+    from asgi import AsyncChatApp, json_response
+    asgi_app = AsyncChatApp(app)
+except ImportError:
+    asgi_app = None
+
+if asgi_app is not None:
+    @asgi_app.route('/api/chat')
+    async def chat_async(request):
+        cors = {"Access-Control-Allow-Origin": "*"}
+        data = request.json()
+        if not isinstance(data, dict):
+            return json_response({"error": "Invalid JSON body", "success": False,
+                                  "response": "An error occurred."}, 400, cors)
+        
+        question = data.get('question', '')
+        if not question:
+            return json_response({"error": "No question provided"}, 400, cors)
+        
+        print(f"📝 Question received (async): '{question}'")
+        
+        if chatbot.pdf_rag:
+            await asgi_app.run_cpu(chatbot.pdf_rag.swap_to_current)
+        result = await chatbot.get_response_async(question, asgi_app.run_cpu)
+        chatbot.add_to_history(question, result)
+        
+        return json_response(result, headers=cors)
+
 
 if __name__ == '__main__':
     # Get port from environment (for cloud platforms)
@@ -9,10 +9,11 @@ Production-Grade MiningAI Backend
 - Security Headers
 """
 import os
+import json
 import time
 import logging
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -27,9 +28,14 @@ from auth import (
     hash_password, verify_password, create_access_token, create_refresh_token,
     get_jwt_identity, revoke_token, get_jwt
 )
-from database import init_db, get_db, User, ChatHistory, APIUsage, AuditLog
+from database import init_db, get_db, new_session, User, ChatHistory, APIUsage, AuditLog
 from validators import validate_question, validate_file_upload, get_client_ip, sanitize_filename
-from pdf_processor import PDFRAGSystem
+from chat_engine import get_engine
+from answer_cache import AnswerCache
+from semantic_cache import SemanticCache
+from context_packer import pack_context
+from metrics import metrics, process_memory
+from write_behind import WriteBehindQueue
 
 # Configure structured logging
 from pythonjsonlogger import jsonlogger
@@ -109,11 +115,11 @@ def set_security_headers(response):
     return response
 
 
-# Initialize AI components
+# Initialize AI components (one shared engine per process)
+engine = get_engine(gemini_timeout=config.API_TIMEOUT_SECONDS, redis_url=config.REDIS_URL)
 try:
-    from main import GeminiAI, QuestionAnalyzer
-    gemini_ai = GeminiAI()
-    question_analyzer = QuestionAnalyzer()
+    gemini_ai = engine.gemini
+    question_analyzer = engine.analyzer
     logger.info("AI components initialized", extra={"gemini_available": gemini_ai.is_available()})
 except Exception as e:
     logger.error("Failed to initialize AI components", extra={"error": str(e)}, exc_info=True)
@@ -121,12 +127,43 @@ except Exception as e:
     question_analyzer = None
 
 # Initialize PDF RAG
-try:
-    pdf_rag = PDFRAGSystem()
+pdf_rag = engine.pdf_rag
+reranker = engine.reranker
+if pdf_rag is not None:
     logger.info("PDF RAG initialized", extra={"chunks": len(pdf_rag.chunks) if pdf_rag.chunks else 0})
-except Exception as e:
-    logger.error("Failed to initialize PDF RAG", extra={"error": str(e)}, exc_info=True)
-    pdf_rag = None
+else:
+    logger.error("Failed to initialize PDF RAG", extra={"error": str(engine.pdf_rag_error)})
+
+
+@app.before_request
+def use_current_knowledge_base():
+    """Pick up a knowledge base version published by another process"""
+    if pdf_rag is not None and pdf_rag.swap_to_current():
+        logger.info("Knowledge base swapped", extra={"version": pdf_rag.index_version,
+                                                     "chunks": len(pdf_rag.chunks)})
+
+
+answer_cache = AnswerCache(
+    redis_url=config.REDIS_URL,
+    max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS
+)
+logger.info("Answer cache initialized", extra={"backend": answer_cache.backend})
+
+semantic_cache = SemanticCache(
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    max_entries=config.SEMANTIC_CACHE_MAX_ENTRIES
+)
+
+# ChatHistory, APIUsage and AuditLog rows are inserted in the background, in batches
+write_queue = WriteBehindQueue(
+    new_session,
+    max_size=config.WRITE_BEHIND_MAX_QUEUE,
+    batch_size=config.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=config.WRITE_BEHIND_FLUSH_SECONDS,
+    overflow=config.WRITE_BEHIND_OVERFLOW,
+    block_seconds=config.WRITE_BEHIND_BLOCK_SECONDS
+)
 
 
 # ============================================================================
@@ -180,15 +217,14 @@ def register():
         refresh_token = create_refresh_token(identity=user.id)
         
         # Log audit
-        audit = AuditLog(
+        write_queue.put(
+            AuditLog,
             user_id=user.id,
             action='user_registered',
             ip_address=get_client_ip(),
             user_agent=request.headers.get('User-Agent', '')[:500],
             success=True
         )
-        db.add(audit)
-        db.commit()
         
         logger.info("User registered", extra={
             "user_id": user.id,
@@ -202,7 +238,7 @@ def register():
             "refresh_token": refresh_token,
             "user": user.to_dict()
         }), 201
-        
+    
     except Exception as e:
         logger.error("Registration error", extra={"error": str(e)}, exc_info=True)
         return jsonify({"error": "Registration failed"}), 500
@@ -228,7 +264,8 @@ def login():
         
         if not user or not verify_password(user.password_hash, password):
             # Log failed attempt
-            audit = AuditLog(
+            write_queue.put(
+                AuditLog,
                 user_id=user.id if user else None,
                 action='login_failed',
                 ip_address=get_client_ip(),
@@ -236,8 +273,6 @@ def login():
                 success=False,
                 details={"email": email}
             )
-            db.add(audit)
-            db.commit()
             
             return jsonify({"error": "Invalid email or password"}), 401
         
@@ -253,15 +288,14 @@ def login():
         refresh_token = create_refresh_token(identity=user.id)
         
         # Log successful login
-        audit = AuditLog(
+        write_queue.put(
+            AuditLog,
             user_id=user.id,
             action='login_success',
             ip_address=get_client_ip(),
             user_agent=request.headers.get('User-Agent', '')[:500],
             success=True
         )
-        db.add(audit)
-        db.commit()
         
         logger.info("User logged in", extra={
             "user_id": user.id,
@@ -275,7 +309,7 @@ def login():
             "refresh_token": refresh_token,
             "user": user.to_dict()
         }), 200
-        
+    
     except Exception as e:
         logger.error("Login error", extra={"error": str(e)}, exc_info=True)
         return jsonify({"error": "Login failed"}), 500
@@ -292,20 +326,18 @@ def logout():
         user_id = get_jwt_identity()
         
         # Log logout
-        db = next(get_db())
-        audit = AuditLog(
+        write_queue.put(
+            AuditLog,
             user_id=user_id,
             action='logout',
             ip_address=get_client_ip(),
             success=True
         )
-        db.add(audit)
-        db.commit()
         
         logger.info("User logged out", extra={"user_id": user_id})
         
         return jsonify({"success": True, "message": "Logged out successfully"}), 200
-        
+    
     except Exception as e:
         logger.error("Logout error", extra={"error": str(e)}, exc_info=True)
         return jsonify({"error": "Logout failed"}), 500
@@ -320,7 +352,7 @@ def refresh():
         access_token = create_access_token(identity=user_id)
         
         return jsonify({"access_token": access_token}), 200
-        
+    
     except Exception as e:
         logger.error("Token refresh error", extra={"error": str(e)}, exc_info=True)
         return jsonify({"error": "Token refresh failed"}), 500
@@ -330,6 +362,163 @@ def refresh():
 # CHAT ENDPOINTS
 # ============================================================================
 
+def _lookup_cached_answer(question: str):
+    """
+    Check the exact and semantic answer caches.
+    Returns (cache_key, query_embedding (None if not encoded), cached response or None).
+    """
+    cache_key = (question, pdf_rag.index_version, gemini_ai.model_id())
+    cached = answer_cache.get(*cache_key)
+    query_embedding = None
+    
+    # A rephrasing of a recently answered question gets the same answer
+    # (the query embedding is cached, so search() doesn't encode again).
+    # Questions search() answers lexically skip it and aren't encoded.
+    if cached is None and not pdf_rag.answers_lexically(question):
+        query_embedding = pdf_rag.embed_query(question)
+        cached = semantic_cache.get(question, query_embedding, *cache_key[1:])
+    
+    return cache_key, query_embedding, cached
+
+
+def _remember_answer(cache_key, query_embedding, answer: dict):
+    answer_cache.put(*cache_key, answer)
+    if query_embedding is not None:
+        semantic_cache.put(cache_key[0], query_embedding, *cache_key[1:], answer)
+
+
+def _retrieve_answer(question: str):
+    """
+    Cache lookup and PDF search for a chat question (the CPU-bound part).
+    Returns (answer, None) when no Gemini call is needed, otherwise
+    (None, retrieval) for _finish_answer().
+    """
+    # Same (or a near-identical) question against the same knowledge base and model
+    cache_key, query_embedding, cached = _lookup_cached_answer(question)
+    
+    if cached is not None:
+        return {
+            "response": cached['response'],
+            "confidence": cached['confidence'],
+            "source": cached['source'],
+            "pdf_sources": cached['pdf_sources']
+        }, None
+    
+    # Search PDFs (a wider candidate set when reranking)
+    pdf_results = pdf_rag.search(question, top_k=reranker.candidates)
+    pdf_results = reranker.rerank(question, pdf_results, cache_key[1])
+    
+    if not pdf_results:
+        return {
+            "response": "I couldn't find relevant information in the provided documents.",
+            "confidence": 0.0,
+            "source": "no_results",
+            "pdf_sources": []
+        }, None
+    
+    # Neighbouring chunks merged, weak hits dropped, within the prompt token budget
+    packed = pack_context(pdf_results)
+    retrieval = {
+        "cache_key": cache_key,
+        "query_embedding": query_embedding,
+        "pdf_results": pdf_results,
+        "pdf_context": packed['context'],
+        "pdf_sources": packed['sources'],
+        "confidence": max(r['similarity_score'] for r in pdf_results)
+    }
+    
+    # Nothing retrieved is close enough to the question for a Gemini call
+    # (judged by cosine similarity; identifier and lexical matches pass)
+    gate_confidence = pdf_rag.confidence(pdf_results)
+    if (config.CONFIDENCE_GATE != 'off' and gate_confidence is not None
+            and gate_confidence < pdf_rag.confidence_threshold):
+        metrics.inc('confidence_gate.skipped')
+        if config.CONFIDENCE_GATE == 'extractive':
+            return _finish_answer(retrieval, None), None
+        return {
+            "response": "I couldn't find information about this in the provided documents.",
+            "confidence": retrieval['confidence'],
+            "source": "low_confidence",
+            "pdf_sources": []
+        }, None
+    metrics.inc('confidence_gate.passed')
+    
+    return None, retrieval
+
+
+def _finish_answer(retrieval: dict, gemini_response) -> dict:
+    """Answer from the Gemini response, or raw PDF text if Gemini failed"""
+    if gemini_response:
+        answer = {
+            "response": gemini_response,
+            "confidence": retrieval['confidence'],
+            "source": "pdf_rag_gemini",
+            "pdf_sources": retrieval['pdf_sources']
+        }
+        _remember_answer(retrieval['cache_key'], retrieval['query_embedding'], answer)
+        return answer
+    
+    return {
+        "response": f"Based on the documents: {retrieval['pdf_results'][0]['text'][:800]}",
+        "confidence": retrieval['confidence'],
+        "source": "pdf_raw",
+        "pdf_sources": retrieval['pdf_sources']
+    }
+
+
+def _save_chat(user_id, endpoint: str, question: str, answer: dict, start_time: float,
+               return_id: bool = False):
+    """
+    Record an answered chat: its ChatHistory row and APIUsage record go to
+    the write-behind queue, except that with return_id the ChatHistory row
+    is inserted right away so its id can be sent to the client.
+    Returns (chat_history id or None, response_time_ms).
+    """
+    history = dict(
+        user_id=user_id,
+        question=question,
+        response=answer['response'],
+        source=answer['source'],
+        confidence=answer['confidence'],
+        pdf_sources=answer['pdf_sources']
+    )
+    chat_history_id = None
+    if return_id:
+        db = next(get_db())
+        chat_history = ChatHistory(**history)
+        db.add(chat_history)
+        db.commit()
+        chat_history_id = chat_history.id
+    else:
+        write_queue.put(ChatHistory, **history)
+    
+    # Track API usage
+    response_time_ms = (time.time() - start_time) * 1000
+    write_queue.put(
+        APIUsage,
+        user_id=user_id,
+        endpoint=endpoint,
+        method='POST',
+        status_code=200,
+        response_time_ms=response_time_ms,
+        gemini_tokens_used=len(answer['response']) // 4  # Rough estimate
+    )
+    
+    return chat_history_id, response_time_ms
+
+
+def _save_chat_error(user_id, endpoint: str, start_time: float, error: Exception):
+    write_queue.put(
+        APIUsage,
+        user_id=user_id,
+        endpoint=endpoint,
+        method='POST',
+        status_code=500,
+        response_time_ms=(time.time() - start_time) * 1000,
+        error_message=str(error)[:500]
+    )
+
+
 @app.route('/api/chat', methods=['POST'])
 @require_auth
 @limiter.limit(config.RATELIMIT_CHAT)
@@ -364,94 +553,249 @@ def chat():
                 "success": False
             }), 503
         
-        # Search PDFs
-        pdf_results = pdf_rag.search(sanitized_question, top_k=5)
-        
-        if not pdf_results:
-            response_text = "I couldn't find relevant information in the provided documents."
-            confidence = 0.0
-            source = "no_results"
-            pdf_sources = []
-        else:
+        answer, retrieval = _retrieve_answer(sanitized_question)
+        if answer is None:
             # Get context and generate response
-            pdf_context = "\n\n".join([r['text'] for r in pdf_results])
-            pdf_sources = list(set([r['metadata']['source'] for r in pdf_results]))
-            confidence = pdf_results[0]['similarity_score']
-            
-            gemini_response = gemini_ai.get_response(sanitized_question, pdf_context)
-            
-            if gemini_response:
-                response_text = gemini_response
-                source = "pdf_rag_gemini"
-            else:
-                response_text = f"Based on the documents: {pdf_results[0]['text'][:800]}"
-                source = "pdf_raw"
+            gemini_response = gemini_ai.get_response(sanitized_question, retrieval['pdf_context'])
+            answer = _finish_answer(retrieval, gemini_response)
         
         # Save to database
-        db = next(get_db())
-        chat_history = ChatHistory(
-            user_id=user_id,
-            question=sanitized_question,
-            response=response_text,
-            source=source,
-            confidence=confidence,
-            pdf_sources=pdf_sources
-        )
-        db.add(chat_history)
+        _, response_time_ms = _save_chat(user_id, '/api/chat', sanitized_question, answer, start_time)
+        
+        logger.info("Chat response generated", extra={
+            "user_id": user_id,
+            "source": answer['source'],
+            "confidence": answer['confidence'],
+            "response_time_ms": response_time_ms
+        })
+        
+        return jsonify({**answer, "success": True}), 200
+    
+    except Exception as e:
+        logger.error("Chat error", extra={
+            "user_id": user_id,
+            "error": str(e)
+        }, exc_info=True)
+        
+        # Track error
+        _save_chat_error(user_id, '/api/chat', start_time, e)
+        
+        return jsonify({
+            "error": "An error occurred processing your request",
+            "success": False
+        }), 500
+
+
+@app.route('/api/search/batch', methods=['POST'])
+@require_auth
+@limiter.limit(config.RATELIMIT_SEARCH_BATCH)
+def search_batch():
+    """Retrieve ranked PDF passages for many queries in one request"""
+    start_time = time.time()
+    user_id = get_jwt_identity()
+    
+    try:
+        data = request.json or {}
+        queries = data.get('queries')
+        top_k = data.get('top_k', 5)
+        
+        if not isinstance(queries, list) or not queries:
+            return jsonify({"error": "queries must be a non-empty list", "success": False}), 400
+        
+        if len(queries) > config.SEARCH_BATCH_MAX_QUERIES:
+            return jsonify({
+                "error": f"Too many queries (max {config.SEARCH_BATCH_MAX_QUERIES} per request)",
+                "success": False
+            }), 400
+        
+        if not isinstance(top_k, int) or not 1 <= top_k <= config.SEARCH_MAX_TOP_K:
+            return jsonify({
+                "error": f"top_k must be between 1 and {config.SEARCH_MAX_TOP_K}",
+                "success": False
+            }), 400
+        
+        sanitized_queries = []
+        for i, query in enumerate(queries):
+            is_valid, sanitized_query, error_msg = validate_question(
+                query if isinstance(query, str) else '',
+                max_length=config.MAX_QUESTION_LENGTH
+            )
+            if not is_valid:
+                return jsonify({"error": f"queries[{i}]: {error_msg}", "success": False}), 400
+            sanitized_queries.append(sanitized_query)
+        
+        if not pdf_rag:
+            return jsonify({
+                "error": "PDF search not available",
+                "success": False
+            }), 503
+        
+        all_results = pdf_rag.search_many(sanitized_queries, top_k=top_k)
         
-        # Track API usage
         response_time_ms = (time.time() - start_time) * 1000
-        api_usage = APIUsage(
+        write_queue.put(
+            APIUsage,
             user_id=user_id,
-            endpoint='/api/chat',
+            endpoint='/api/search/batch',
             method='POST',
             status_code=200,
-            response_time_ms=response_time_ms,
-            gemini_tokens_used=len(response_text) // 4  # Rough estimate
+            response_time_ms=response_time_ms
         )
-        db.add(api_usage)
-        db.commit()
         
-        logger.info("Chat response generated", extra={
+        logger.info("Batch search completed", extra={
             "user_id": user_id,
-            "source": source,
-            "confidence": confidence,
+            "queries": len(sanitized_queries),
+            "top_k": top_k,
             "response_time_ms": response_time_ms
         })
         
         return jsonify({
-            "response": response_text,
-            "confidence": confidence,
-            "source": source,
-            "pdf_sources": pdf_sources,
+            "results": [
+                {
+                    "query": query,
+                    "results": [
+                        {
+                            "rank": r['rank'],
+                            "text": r['text'],
+                            "similarity_score": r['similarity_score'],
+                            "source": r['metadata']['source'],
+                            "chunk_id": r['metadata']['chunk_id'],
+                            "page_start": r['metadata']['page_start'],
+                            "page_end": r['metadata']['page_end']
+                        }
+                        for r in results
+                    ]
+                }
+                for query, results in zip(sanitized_queries, all_results)
+            ],
             "success": True
         }), 200
-        
+    
     except Exception as e:
-        logger.error("Chat error", extra={
+        logger.error("Batch search error", extra={
             "user_id": user_id,
             "error": str(e)
         }, exc_info=True)
-        
-        # Track error
-        db = next(get_db())
-        api_usage = APIUsage(
-            user_id=user_id,
-            endpoint='/api/chat',
-            method='POST',
-            status_code=500,
-            response_time_ms=(time.time() - start_time) * 1000,
-            error_message=str(e)[:500]
-        )
-        db.add(api_usage)
-        db.commit()
-        
         return jsonify({
             "error": "An error occurred processing your request",
             "success": False
         }), 500
 
 
+def _sse(event: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+@require_auth
+@limiter.limit(config.RATELIMIT_CHAT)
+def chat_stream():
+    """
+    Stream a chat answer as server-sent events:
+    'sources' (pdf_sources, confidence) right after retrieval, 'token' events
+    as Gemini generates, then 'done' with the complete record once the
+    ChatHistory row is saved ('error' if the request fails).
+    """
+    start_time = time.time()
+    user_id = get_jwt_identity()
+    
+    data = request.json or {}
+    is_valid, sanitized_question, error_msg = validate_question(
+        data.get('question', ''),
+        max_length=config.MAX_QUESTION_LENGTH
+    )
+    
+    if not is_valid:
+        return jsonify({"error": error_msg, "success": False}), 400
+    
+    if not pdf_rag or not gemini_ai:
+        return jsonify({
+            "error": "AI services not available",
+            "success": False
+        }), 503
+    
+    logger.info("Chat stream request received", extra={
+        "user_id": user_id,
+        "question_length": len(sanitized_question)
+    })
+    
+    def generate():
+        truncated = False  # Gemini failed part-way; the record keeps what arrived
+        try:
+            answer, retrieval = _retrieve_answer(sanitized_question)
+            
+            if answer is not None:
+                # Cached or nothing found: the whole answer is known already
+                yield _sse('sources', {key: answer[key] for key in ('pdf_sources', 'confidence', 'source')})
+                yield _sse('token', {"text": answer['response']})
+            else:
+                pdf_sources, confidence = retrieval['pdf_sources'], retrieval['confidence']
+                yield _sse('sources', {"pdf_sources": pdf_sources, "confidence": confidence, "source": "pdf_rag_gemini"})
+                
+                parts = []
+                stream_failed = not gemini_ai.is_available()
+                if not stream_failed:
+                    try:
+                        for text in gemini_ai.stream_response(sanitized_question, retrieval['pdf_context']):
+                            parts.append(text)
+                            yield _sse('token', {"text": text})
+                    except Exception as e:
+                        stream_failed = True
+                        logger.error("Gemini stream error", extra={"user_id": user_id, "error": str(e)})
+                
+                response_text = "".join(parts)
+                if response_text and stream_failed:
+                    truncated = True
+                    answer = {"response": response_text, "confidence": confidence,
+                              "source": "pdf_rag_gemini", "pdf_sources": pdf_sources}
+                else:
+                    # Complete answers are cached; nothing generated gets the pdf_raw fallback
+                    answer = _finish_answer(retrieval, response_text)
+                    if not response_text:
+                        yield _sse('token', {"text": answer['response']})
+            
+            # Save to database once the answer is complete
+            chat_history_id, response_time_ms = _save_chat(user_id, '/api/chat/stream', sanitized_question,
+                                                           answer, start_time, return_id=True)
+            
+            logger.info("Chat stream completed", extra={
+                "user_id": user_id,
+                "source": answer['source'],
+                "confidence": answer['confidence'],
+                "response_time_ms": response_time_ms
+            })
+            
+            yield _sse('done', {
+                "id": chat_history_id,
+                **answer,
+                "truncated": truncated,
+                "success": True
+            })
+        
+        except GeneratorExit:
+            logger.info("Chat stream closed by client", extra={"user_id": user_id})
+            raise
+        
+        except Exception as e:
+            logger.error("Chat stream error", extra={
+                "user_id": user_id,
+                "error": str(e)
+            }, exc_info=True)
+            
+            _save_chat_error(user_id, '/api/chat/stream', start_time, e)
+            
+            yield _sse('error', {
+                "error": "An error occurred processing your request",
+                "success": False
+            })
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # don't let nginx buffer the stream
+    })
+
+
 @app.route('/api/chat/history', methods=['GET'])
 @require_auth
 @limiter.limit("60 per minute")
@@ -478,7 +822,7 @@ def get_chat_history():
             "per_page": per_page,
             "pages": (total + per_page - 1) // per_page
         }), 200
-        
+    
     except Exception as e:
         logger.error("Get history error", extra={"error": str(e)}, exc_info=True)
         return jsonify({"error": "Failed to retrieve history"}), 500
@@ -561,11 +905,26 @@ def status():
     
     if pdf_rag:
         status_info["pdf_chunks"] = len(pdf_rag.chunks) if pdf_rag.chunks else 0
-        status_info["pdfs_processed"] = len(set([m['source'] for m in pdf_rag.metadata])) if pdf_rag.metadata else 0
+        status_info["pdfs_processed"] = len(pdf_rag.list_sources())
+        status_info["query_cache"] = pdf_rag.query_cache.stats()
     
     return jsonify(status_info), 200
 
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Counters and timings of this worker process"""
+    return jsonify({
+        **metrics.snapshot(),
+        "answer_cache": answer_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "write_behind": write_queue.stats(),
+        "gemini": gemini_ai.stats() if gemini_ai else None,
+        "reranker": reranker.stats(),
+        "memory": process_memory()
+    }), 200
+
+
 @app.route('/', methods=['GET'])
 def home():
     """API information"""
@@ -575,8 +934,9 @@ def home():
         "environment": config.ENV,
         "endpoints": {
             "auth": ["/api/auth/register", "/api/auth/login", "/api/auth/logout"],
-            "chat": ["/api/chat", "/api/chat/history"],
-            "health": ["/api/health", "/api/status"]
+            "chat": ["/api/chat", "/api/chat/stream", "/api/chat/history"],
+            "search": ["/api/search/batch"],
+            "health": ["/api/health", "/api/status", "/api/metrics"]
         }
     }), 200
 
@@ -606,6 +966,105 @@ def ratelimit_handler(e):
     return jsonify({"error": "Rate limit exceeded", "message": str(e.description)}), 429
 
 
+# ============================================================================
+# ASGI SERVING MODE (uvicorn main_production:asgi_app)
+# ============================================================================
+
+try:
+    from asgi import AsyncChatApp, flask_response
+    asgi_app = AsyncChatApp(app)
+except ImportError:
+    asgi_app = None
+
+
+@require_auth
+@limiter.limit(config.RATELIMIT_CHAT)
+def _admit_chat():
+    """Auth, rate limit and validation of an async /api/chat request"""
+    data = request.get_json(silent=True) or {}
+    is_valid, sanitized_question, error_msg = validate_question(
+        data.get('question', ''),
+        max_length=config.MAX_QUESTION_LENGTH
+    )
+    
+    if not is_valid:
+        return jsonify({"error": error_msg, "success": False}), 400
+    
+    if not pdf_rag or not gemini_ai:
+        return jsonify({
+            "error": "AI services not available",
+            "success": False
+        }), 503
+    
+    return {"user_id": get_jwt_identity(), "question": sanitized_question}
+
+
+def _call_in_context(ctx, view, preprocess: bool = False):
+    """
+    Run `view` inside the Flask request context of an async request (after
+    the before_request hooks if preprocess). A dict returned by the view is
+    passed back; anything else is finished as the Flask response.
+    """
+    with ctx:
+        try:
+            rv = app.preprocess_request() if preprocess else None
+            if rv is None:
+                rv = view()
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        return rv if isinstance(rv, dict) else flask_response(app, rv)
+
+
+if asgi_app is not None:
+    @asgi_app.route('/api/chat')
+    async def chat_async(async_request):
+        """/api/chat without holding a thread on Gemini: same checks, schema and records as chat()"""
+        start_time = time.time()
+        ctx = app.request_context(async_request.environ())
+        
+        admitted = await asgi_app.run_io(_call_in_context, ctx, _admit_chat, preprocess=True)
+        if not isinstance(admitted, dict):
+            return admitted
+        user_id, question = admitted['user_id'], admitted['question']
+        
+        logger.info("Chat request received", extra={
+            "user_id": user_id,
+            "question_length": len(question),
+            "asgi": True
+        })
+        
+        try:
+            answer, retrieval = await asgi_app.run_cpu(_retrieve_answer, question)
+            if answer is None:
+                gemini_response = await gemini_ai.get_response_async(question, retrieval['pdf_context'])
+                answer = await asgi_app.run_cpu(_finish_answer, retrieval, gemini_response)
+            
+            _, response_time_ms = await asgi_app.run_io(_save_chat, user_id, '/api/chat', question,
+                                                        answer, start_time)
+            
+            logger.info("Chat response generated", extra={
+                "user_id": user_id,
+                "source": answer['source'],
+                "confidence": answer['confidence'],
+                "response_time_ms": response_time_ms
+            })
+            payload, status_code = {**answer, "success": True}, 200
+        
+        except Exception as e:
+            logger.error("Chat error", extra={
+                "user_id": user_id,
+                "error": str(e)
+            }, exc_info=True)
+            
+            await asgi_app.run_io(_save_chat_error, user_id, '/api/chat', start_time, e)
+            payload, status_code = {
+                "error": "An error occurred processing your request",
+                "success": False
+            }, 500
+        
+        return await asgi_app.run_io(_call_in_context, ctx, lambda: (jsonify(payload), status_code))
+
+
 # ============================================================================
 # STARTUP
 # ============================================================================
@@ -0,0 +1,70 @@
+"""
+In-process metrics registry
+Counters and timing summaries shared by both Flask apps and exposed as JSON
+on /api/metrics. Values are per worker process.
+"""
+
+import os
+import threading
+from typing import Dict
+
+
+class Metrics:
+    """Thread-safe counters and latency summaries"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}  # name -> [count, total_ms, max_ms]
+    
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+    
+    def observe(self, name: str, ms: float):
+        with self._lock:
+            timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += ms
+            timing[2] = max(timing[2], ms)
+    
+    def ratio(self, hits: str, misses: str) -> float:
+        """hits / (hits + misses) for two counters"""
+        with self._lock:
+            total = self._counters.get(hits, 0) + self._counters.get(misses, 0)
+            return round(self._counters.get(hits, 0) / total, 4) if total else 0.0
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': {
+                    name: {'count': count, 'avg_ms': round(total / count, 2), 'max_ms': round(peak, 2)}
+                    for name, (count, total, peak) in self._timings.items()
+                }
+            }
+
+
+def process_memory() -> Dict:
+    """
+    Memory of this process in MB (Linux only, else empty): rss counts shared
+    pages in full, pss splits them between the processes sharing them and
+    uss is what only this process holds, i.e. what another worker costs.
+    """
+    fields = {}
+    try:
+        with open(f'/proc/{os.getpid()}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        return {}
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / 1024, 1),
+        'pss_mb': round(fields.get('Pss', 0) / 1024, 1),
+        'uss_mb': round((fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024, 1)
+    }
+
+
+metrics = Metrics()
@@ -4,8 +4,20 @@ Processes PDFs, creates embeddings, and enables semantic search
 """
 
 import os
-import pickle
-from typing import List, Dict, Tuple
+import re
+import json
+import shutil
+import time
+import uuid
+import hashlib
+import logging
+import unicodedata
+import threading
+import multiprocessing
+from bisect import bisect_right
+from collections import deque
+from itertools import chain, islice
+from typing import List, Dict, Tuple, Optional, Iterator, Iterable
 import numpy as np
 from pathlib import Path
 
@@ -33,17 +45,307 @@ except ImportError:
     os.system("pip install faiss-cpu")
     import faiss
 
+import ann_index
+import lexical_index
+from chunk_store import ChunkStore, ChunkStoreWriter
+from embedding_cache import CacheBusyError, EmbeddingCache
+from embedding_engine import EmbeddingEngine
+from lexical_index import LexicalIndex
+from lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+
+# Parallel ingestion settings (1 worker = parse in-process, like before)
+INGEST_WORKERS = int(os.getenv('PDF_INGEST_WORKERS', '1'))
+INGEST_TIMEOUT_SECONDS = float(os.getenv('PDF_INGEST_TIMEOUT_SECONDS', '300'))
+
+# Chunks are embedded and written to the chunk store in batches of this
+# size, which caps ingestion memory regardless of corpus size
+EMBED_BATCH_SIZE = int(os.getenv('PDF_EMBED_BATCH_SIZE', '256'))
+
+# Encoder batch size and CPU worker processes for ingestion embedding
+# (each worker loads its own model copy and gets cpu_count/workers threads)
+ENCODE_BATCH_SIZE = int(os.getenv('PDF_ENCODE_BATCH_SIZE', '64'))
+EMBED_WORKERS = int(os.getenv('PDF_EMBED_WORKERS', '1'))
+
+# Per-file record of what is in the index (hash, size, mtime, vector ids)
+MANIFEST_FILE = "manifest.json"
+
+# Memory-mapped chunk texts and metadata (see chunk_store.py)
+STORE_FOLDER = "chunk_store"
+
+# ANN index type: auto (pick by corpus size), flat, ivf, hnsw or ivfpq
+ANN_INDEX_TYPE = os.getenv('ANN_INDEX_TYPE', 'auto')
+INDEX_META_FILE = "index_meta.json"
+
+# Compressed first pass: the index holds fp16/int8 (ANN_CODEC) and/or
+# PCA-reduced (ANN_PCA_DIM) vectors, and the best top_k * ANN_RESCORE_FACTOR
+# candidates are rescored with the full-precision vectors of the chunk
+# store, read through its memory map
+ANN_CODEC = os.getenv('ANN_CODEC', 'none')
+ANN_PCA_DIM = int(os.getenv('ANN_PCA_DIM', '0'))
+ANN_RESCORE_FACTOR = int(os.getenv('ANN_RESCORE_FACTOR', '4'))
+
+# Versioned knowledge base: every build goes to versions/<version>/ and is
+# published by atomically replacing CURRENT; serving processes check CURRENT
+# between requests and swap to the new version. Retired versions are deleted
+# after a grace period (abandoned builds after a day).
+CURRENT_FILE = "CURRENT"
+VERSIONS_FOLDER = "versions"
+RETIRED_FILE = "RETIRED"
+FAISS_INDEX_FILE = "faiss_index.bin"
+KB_SWAP_CHECK_SECONDS = float(os.getenv('KB_SWAP_CHECK_SECONDS', '2'))
+KB_VERSION_GRACE_SECONDS = float(os.getenv('KB_VERSION_GRACE_SECONDS', '600'))
+STALE_BUILD_SECONDS = 86400
+
+# BM25 index saved with each version (see lexical_index.py). Retrieval mode:
+# hybrid fuses vector and BM25 rankings (reciprocal rank fusion over the top
+# HYBRID_CANDIDATES of each); dense and lexical use one of them alone.
+# Short queries naming an identifier ("Fe3O4", "980E") that occurs in the
+# corpus are answered from BM25 alone, without the encoder.
+LEXICAL_FOLDER = "lexical"
+RETRIEVAL_MODES = ('hybrid', 'dense', 'lexical')
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+RRF_K = 60
+LEXICAL_FAST_PATH_MAX_TERMS = 4
+
+# Map the saved FAISS index read-only instead of copying it to the heap, so
+# processes serving the same knowledge base share its pages
+INDEX_MMAP = os.getenv('FAISS_INDEX_MMAP', '1') == '1'
+
+# Chunk embeddings kept across rebuilds, keyed by (model, text hash); 0 disables
+EMBED_CACHE_FOLDER = "embedding_cache"
+EMBED_CACHE_MAX_MB = float(os.getenv('PDF_EMBED_CACHE_MAX_MB', '1024'))
+
+# Query embeddings cached per worker (0 disables)
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_EMBED_CACHE_SIZE', '2048'))
+
+# Embeddings are L2-normalized and indexed by inner product, so search scores
+# are cosine similarities and comparable across queries. The chat apps skip
+# Gemini when the best cosine score of the (reranked) results is below the
+# confidence threshold, calibrated on labelled questions with calibrate()
+# (saved per embedding model in calibration.json); CONFIDENCE_THRESHOLD
+# overrides it.
+INDEX_METRIC = 'ip'
+CALIBRATION_FILE = "calibration.json"
+DEFAULT_CONFIDENCE_THRESHOLD = 0.3
+CALIBRATION_TARGET_RECALL = 0.95
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length (zero rows stay zero)"""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _similarity(score: float, metric: str) -> float:
+    """Search score as a similarity: cosine for 'ip', 1 / (1 + distance) for 'l2'"""
+    return score if metric == 'ip' else 1 / (1 + score)
+
+
+def _file_sha256(path: str) -> str:
+    """Hash a file in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_pdf_pages(pdf_path: str) -> Iterator[str]:
+    """
+    Yield the text of each page of a PDF, one page at a time. A file that
+    can't be opened raises before anything is yielded; a page that can't be
+    read is logged and comes out empty, so later pages keep their numbers.
+    """
+    reader = PdfReader(pdf_path)
+    pages = reader.pages
+    for number in range(1, len(pages) + 1):
+        try:
+            text = pages[number - 1].extract_text() or ""
+        except Exception as e:
+            logger.error("Error reading page %d of %s: %s", number, pdf_path, e)
+            text = ""
+        yield text + "\n"
+
+
+def _extract_pdf_text(pdf_path: str) -> str:
+    """Extract text from a PDF file (module-level so worker processes can run it)"""
+    try:
+        return "".join(_iter_pdf_pages(pdf_path))
+    except Exception as e:
+        print(f"❌ Error reading {pdf_path}: {e}")
+        return ""
+
+
+_SPACE_RE = re.compile(r'\s*')
+
+
+def _iter_chunk_spans(pages: Iterable[str], chunk_size: int = 500,
+                      overlap: int = 50) -> Iterator[Tuple[str, int, int, int, int]]:
+    """
+    Split a stream of page texts into overlapping word windows.
+    Yields (text, start, end, first_page, last_page): start/end are character
+    offsets into the concatenated page text and pages are 1-based.
+    
+    Each chunk is a single slice of a rolling buffer that only holds the
+    not-yet-consumed tail of the stream. One regex match per window finds
+    both where the window ends and where the next one starts, so no
+    per-word strings or lists are built.
+    """
+    step = chunk_size - overlap
+    if overlap > 0:
+        # group 1 spans the first `step` words: its end is the next window's start
+        window_re = re.compile(r'((?:\S+\s+){%d})(?:\S+\s+){%d}\S+' % (step, overlap - 1))
+    else:
+        window_re = re.compile(r'()(?:\S+\s+){%d}\S+' % (chunk_size - 1))
+    step_re = re.compile(r'(?:\S+\s+){%d}' % step)
+    
+    pages = iter(pages)
+    buf = ""           # unconsumed tail of the page stream
+    base = 0           # document offset of buf[0]
+    pos = 0            # start of the current window in buf (always at a word)
+    page_starts = []   # document offset where each page begins
+    doc_len = 0
+    lookahead = 4096   # keep roughly two windows of text buffered
+    exhausted = False
+    
+    def span(start, end):
+        first_page = bisect_right(page_starts, base + start)
+        last_page = bisect_right(page_starts, base + end - 1)
+        return buf[start:end], base + start, base + end, first_page, last_page
+    
+    def pull_page():
+        nonlocal buf, base, pos, doc_len, exhausted
+        page = next(pages, None)
+        if page is None:
+            exhausted = True
+            return
+        buf = buf[pos:] + page
+        base += pos
+        page_starts.append(doc_len)
+        doc_len += len(page)
+        pos = _SPACE_RE.match(buf).end()
+    
+    while True:
+        while not exhausted and len(buf) - pos < lookahead:
+            pull_page()
+        
+        match = window_re.match(buf, pos)
+        
+        if match is not None:
+            end = match.end()
+            next_pos = match.end(1) if overlap > 0 else _SPACE_RE.match(buf, end).end()
+            lookahead = max(lookahead, 2 * (end - pos))
+        elif not exhausted:
+            # Unusually long words: buffer another page and retry
+            pull_page()
+            continue
+        else:
+            # Trailing windows, same as the final steps of a full-text split
+            if pos >= len(buf):
+                return
+            end = len(buf.rstrip())
+            advance = step_re.match(buf, pos)
+            next_pos = advance.end() if advance is not None else None
+        
+        chunk = span(pos, end)
+        if len(chunk[0]) > 50:  # Only keep meaningful chunks
+            yield chunk
+        
+        if next_pos is None:
+            return
+        pos = next_pos
+
+
+def _normalize_query(query: str) -> str:
+    """Cache key for a query: the model is uncased, so case and spacing don't matter"""
+    query = unicodedata.normalize('NFKC', query).casefold()
+    return ' '.join(query.split()).rstrip('?!. ')
+
+
+def _fast_path_identifiers(query: str) -> List[str]:
+    """Identifiers of a query short enough for the lexical fast path (else none)"""
+    words = set(lexical_index.tokenize(query, parts=False))
+    if len(words) > LEXICAL_FAST_PATH_MAX_TERMS:
+        return []
+    return sorted(word for word in words if lexical_index.is_identifier(word))
+
+
+def _split_chunks(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
+    """Split text into overlapping word windows"""
+    return [chunk[0] for chunk in _iter_chunk_spans([text], chunk_size, overlap)]
+
+
+def _parse_pdf_file(pdf_path: str) -> List[Tuple[str, int, int, int, int]]:
+    """Extract and chunk one PDF; runs inside ingestion worker processes"""
+    return list(_iter_chunk_spans(_iter_pdf_pages(pdf_path)))
+
 
 class PDFRAGSystem:
     """Advanced RAG system for PDF question answering"""
     
-    def __init__(self, pdf_folder: str = "pdfs", knowledge_base_folder: str = "knowledge_base"):
+    def __init__(self, pdf_folder: str = "pdfs", knowledge_base_folder: str = "knowledge_base",
+                 ingest_workers: int = INGEST_WORKERS,
+                 ingest_timeout: float = INGEST_TIMEOUT_SECONDS,
+                 embed_batch_size: int = EMBED_BATCH_SIZE,
+                 index_type: str = ANN_INDEX_TYPE,
+                 index_params: Optional[Dict] = None,
+                 codec: str = ANN_CODEC,
+                 pca_dim: int = ANN_PCA_DIM,
+                 rescore_factor: int = ANN_RESCORE_FACTOR,
+                 embed_cache_max_mb: float = EMBED_CACHE_MAX_MB,
+                 encode_batch_size: int = ENCODE_BATCH_SIZE,
+                 embed_workers: int = EMBED_WORKERS,
+                 query_cache_size: int = QUERY_CACHE_SIZE,
+                 mmap_index: bool = INDEX_MMAP,
+                 swap_check_interval: float = KB_SWAP_CHECK_SECONDS,
+                 retrieval_mode: str = RETRIEVAL_MODE):
         self.pdf_folder = pdf_folder
         self.kb_folder = knowledge_base_folder
+        self.ingest_workers = max(1, ingest_workers)
+        self.ingest_timeout = ingest_timeout
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        if codec not in ann_index.CODECS:
+            raise ValueError(f"codec must be one of {', '.join(ann_index.CODECS)}")
+        self.codec = codec
+        self.pca_dim = max(0, pca_dim)
+        self.rescore_factor = max(1, rescore_factor)
+        self.embed_cache_max_mb = embed_cache_max_mb
+        self.encode_batch_size = encode_batch_size
+        self.embed_workers = max(1, embed_workers)
+        self.embedding_model_name = EMBEDDING_MODEL
         self.embedding_model = None
+        self.embedding_cache = None  # open only while ingesting
+        self.embedding_engine = None  # likewise
+        self.query_cache = LRUCache(query_cache_size)
+        self._query_cache_model = None  # model the cached query embeddings came from
+        self.mmap_index = mmap_index
+        self.swap_check_interval = swap_check_interval
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {', '.join(RETRIEVAL_MODES)}")
+        self.retrieval_mode = retrieval_mode
+        self.version = None    # knowledge base version that is live in this process
         self.index = None
+        self.index_meta = None  # type and parameters of the FAISS index
+        self.index_mmapped = False  # index is a read-only view of faiss_index.bin
+        self.store = None      # ChunkStore; chunks/metadata are lazy views of it
+        self.lexical = None    # LexicalIndex over the store's rows
         self.chunks = []
         self.metadata = []
+        self.manifest = None
+        self.failed_files = []
+        self.confidence_threshold = self._load_confidence_threshold()
+        self._live_lock = threading.Lock()   # index/meta/store change together
+        self._swap_lock = threading.Lock()   # one thread loads a new version
+        self._swap_checked = time.monotonic()
         
         # Create folders if they don't exist
         os.makedirs(pdf_folder, exist_ok=True)
@@ -56,39 +358,120 @@ class PDFRAGSystem:
         """Load sentence transformer model for embeddings"""
         if self.embedding_model is None:
             print("📥 Loading embedding model (this may take a moment)...")
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.embedding_model = SentenceTransformer(self.embedding_model_name)
             print("✅ Embedding model loaded!")
         return self.embedding_model
     
+    def _kb_path(self, name: str) -> str:
+        return os.path.join(self.kb_folder, name)
+    
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """Extract text from a PDF file"""
-        try:
-            reader = PdfReader(pdf_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            print(f"❌ Error reading {pdf_path}: {e}")
-            return ""
+        return _extract_pdf_text(pdf_path)
     
     def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
         """Split text into overlapping chunks"""
-        words = text.split()
-        chunks = []
+        return _split_chunks(text, chunk_size, overlap)
+    
+    def _iter_parsed_parallel(self, pdf_files: List[Path], workers: int,
+                              timeout: float) -> Iterator[Tuple[Path, Optional[List[Tuple]]]]:
+        """
+        Extract and chunk PDFs in a process pool.
+        Results come back in the order of pdf_files; a file that fails or
+        exceeds the per-file timeout yields None instead of stalling the run.
+        At most two files per worker are in flight, so finished-but-unconsumed
+        results stay bounded.
+        """
+        print(f"⚙️  Parsing {len(pdf_files)} PDFs with {workers} worker processes...")
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            queued = iter(pdf_files)
+            in_flight = deque()
+            for pdf_file in islice(queued, workers * 2):
+                in_flight.append((pdf_file, pool.apply_async(_parse_pdf_file, (str(pdf_file),))))
+            
+            while in_flight:
+                pdf_file, job = in_flight.popleft()
+                try:
+                    chunks = job.get(timeout=timeout)
+                except multiprocessing.TimeoutError:
+                    print(f"   ⏱️  Timed out after {timeout:.0f}s: {pdf_file.name} (skipped)")
+                    chunks = None
+                except Exception as e:
+                    print(f"   ❌ Worker failed on {pdf_file.name}: {e}")
+                    chunks = None
+                
+                for next_file in islice(queued, 1):
+                    in_flight.append((next_file, pool.apply_async(_parse_pdf_file, (str(next_file),))))
+                
+                yield pdf_file, chunks
+        finally:
+            # terminate() also kills workers still stuck on a timed-out file
+            pool.terminate()
+            pool.join()
+    
+    def _scan_pdf_folder(self) -> Dict[str, Path]:
+        """Map file name -> path for every PDF in the folder, sorted by name"""
+        # Sorted so chunk ids are stable between runs regardless of worker timing
+        pdf_files = sorted(Path(self.pdf_folder).glob("*.pdf"), key=lambda p: p.name)
+        return {p.name: p for p in pdf_files}
+    
+    def iter_chunks(self, pdf_files: List[Path], workers: Optional[int] = None,
+                    timeout: Optional[float] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Stream (chunk, metadata) pairs for the given PDFs in file order.
+        In-process parsing reads page by page; worker processes return one
+        file's chunks at a time. Files that could not be opened, or whose
+        worker failed or timed out, are listed in self.failed_files afterwards.
+        """
+        self.failed_files = []
+        workers = min(workers or self.ingest_workers, len(pdf_files))
+        timeout = timeout or self.ingest_timeout
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = " ".join(words[i:i + chunk_size])
-            if len(chunk.strip()) > 50:  # Only keep meaningful chunks
-                chunks.append(chunk.strip())
+        if workers > 1:
+            parsed = self._iter_parsed_parallel(pdf_files, workers, timeout)
+        else:
+            parsed = ((pdf_file, None) for pdf_file in pdf_files)
         
-        return chunks
+        for pdf_file, chunks in parsed:
+            print(f"\n📄 Processing: {pdf_file.name}")
+            
+            if chunks is None:
+                if workers > 1:
+                    self.failed_files.append(pdf_file.name)
+                    continue
+                try:
+                    pages = _iter_pdf_pages(str(pdf_file))
+                    first = next(pages, None)  # opens the file
+                except Exception as e:
+                    logger.error("Error reading %s: %s", pdf_file, e)
+                    self.failed_files.append(pdf_file.name)
+                    continue
+                chunks = _iter_chunk_spans(chain([first], pages) if first is not None else [])
+            
+            count = 0
+            for count, (chunk, start, end, first_page, last_page) in enumerate(chunks, start=1):
+                yield chunk, {
+                    'source': pdf_file.name,
+                    'chunk_id': count - 1,
+                    'page_start': first_page,
+                    'page_end': last_page,
+                    'char_start': start,
+                    'char_end': end
+                }
+            
+            if count:
+                print(f"   ✅ Extracted {count} chunks")
+            else:
+                print(f"   ⚠️  No text extracted from {pdf_file.name}")
     
-    def process_pdfs(self) -> Tuple[List[str], List[Dict]]:
-        """Process all PDFs in the folder"""
+    def process_pdfs(self, pdf_files: Optional[List[Path]] = None, workers: Optional[int] = None,
+                     timeout: Optional[float] = None) -> Tuple[List[str], List[Dict]]:
+        """Process all PDFs in the folder (or just the given files) into memory"""
         print(f"\n📚 Processing PDFs from: {self.pdf_folder}")
         
-        pdf_files = list(Path(self.pdf_folder).glob("*.pdf"))
+        if pdf_files is None:
+            pdf_files = list(self._scan_pdf_folder().values())
         
         if not pdf_files:
             print(f"⚠️  No PDF files found in {self.pdf_folder}")
@@ -97,29 +480,15 @@ class PDFRAGSystem:
         
         all_chunks = []
         all_metadata = []
+        totals = {}
         
-        for pdf_file in pdf_files:
-            print(f"\n📄 Processing: {pdf_file.name}")
-            
-            # Extract text
-            text = self.extract_text_from_pdf(str(pdf_file))
-            
-            if not text.strip():
-                print(f"   ⚠️  No text extracted from {pdf_file.name}")
-                continue
-            
-            # Chunk text
-            chunks = self.chunk_text(text)
-            print(f"   ✅ Extracted {len(chunks)} chunks")
-            
-            # Store chunks with metadata
-            for i, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                all_metadata.append({
-                    'source': pdf_file.name,
-                    'chunk_id': i,
-                    'total_chunks': len(chunks)
-                })
+        for chunk, meta in self.iter_chunks(pdf_files, workers, timeout):
+            all_chunks.append(chunk)
+            all_metadata.append(meta)
+            totals[meta['source']] = meta['chunk_id'] + 1
+        
+        for meta in all_metadata:
+            meta['total_chunks'] = totals[meta['source']]
         
         print(f"\n✅ Total chunks processed: {len(all_chunks)}")
         return all_chunks, all_metadata
@@ -132,130 +501,876 @@ class PDFRAGSystem:
         print("✅ Embeddings created!")
         return embeddings
     
-    def create_faiss_index(self, embeddings: np.ndarray):
-        """Create FAISS index for fast similarity search"""
-        print("\n🔄 Creating FAISS index...")
-        dimension = embeddings.shape[1]
-        
-        # Use IndexFlatL2 for exact search (good for small datasets)
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings.astype('float32'))
+    def _embed_batch(self, chunks: List[str]) -> np.ndarray:
+        """Embed one ingestion batch, only encoding chunks missing from the embedding cache"""
+        model = self._load_embedding_model()
+        encode = (self.embedding_engine.encode if self.embedding_engine is not None else
+                  lambda texts: model.encode(texts, show_progress_bar=False).astype('float32'))
+        cache = self.embedding_cache
+        if cache is None:
+            return _normalize_rows(encode(chunks))
         
-        print(f"✅ FAISS index created with {index.ntotal} vectors!")
-        return index
+        keys, embeddings, missing = cache.lookup(chunks)
+        if missing:
+            fresh = encode([chunks[i] for i in missing])
+            cache.put(keys[missing], fresh)
+            if embeddings is None:
+                embeddings = np.empty((len(chunks), fresh.shape[1]), dtype='float32')
+            embeddings[missing] = fresh
+        return _normalize_rows(embeddings)
     
-    def save_index(self):
-        """Save index, chunks, and metadata to disk"""
-        print("\n💾 Saving knowledge base...")
+    def _open_embedding_cache(self):
+        if self.embed_cache_max_mb > 0:
+            try:
+                self.embedding_cache = EmbeddingCache(self._kb_path(EMBED_CACHE_FOLDER),
+                                                      self.embedding_model_name,
+                                                      int(self.embed_cache_max_mb * 1e6))
+            except CacheBusyError as e:
+                print(f"⚠️  {e}, embedding without it")
+    
+    def _open_embedding_engine(self, workers: Optional[int] = None) -> EmbeddingEngine:
+        self.embedding_engine = EmbeddingEngine(self._load_embedding_model(), SentenceTransformer,
+                                                self.embedding_model_name, self.encode_batch_size,
+                                                workers or self.embed_workers)
+        return self.embedding_engine
+    
+    def _close_embedding_engine(self):
+        engine, self.embedding_engine = self.embedding_engine, None
+        if engine is None:
+            return
+        engine.close()
+        stats = engine.stats()
+        if stats['chunks']:
+            print(f"⚡ Encoded {stats['chunks']} chunks in {stats['seconds']:.1f}s "
+                  f"({stats['chunks_per_sec']:.1f} chunks/sec, {stats['workers']} workers, "
+                  f"batch {stats['batch_size']})")
+    
+    def benchmark_embedding(self, worker_counts: Optional[List[int]] = None,
+                            sample: int = 2000) -> List[Dict]:
+        """Encoding throughput (chunks/sec) over stored chunks, per worker count"""
+        if self.store is None or not len(self.store):
+            return []
+        rows = np.random.default_rng(0).choice(len(self.store), min(sample, len(self.store)), replace=False)
+        texts = [self.store.text(int(row)) for row in rows]
         
-        # Save FAISS index
-        faiss.write_index(self.index, os.path.join(self.kb_folder, "faiss_index.bin"))
+        if worker_counts is None:
+            cpus = os.cpu_count() or 1
+            worker_counts = sorted({1, cpus} | {2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus})
+        
+        results = []
+        for workers in worker_counts:
+            engine = self._open_embedding_engine(workers)
+            try:
+                engine.encode(texts[:self.encode_batch_size])  # warm up the workers
+                engine.chunks, engine.seconds = 0, 0.0
+                engine.encode(texts)
+                results.append(engine.stats())
+            finally:
+                self.embedding_engine = None
+                engine.close()
+        return results
+    
+    def _close_embedding_cache(self):
+        cache, self.embedding_cache = self.embedding_cache, None
+        if cache is None:
+            return
+        cache.close()
+        stats = cache.stats()
+        print(f"📊 Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries, "
+              f"{stats['size_mb']:.1f} MB, {stats['evicted']} evicted")
+    
+    def create_faiss_index(self, embeddings: np.ndarray, ids: Optional[np.ndarray] = None) -> Tuple:
+        """
+        Create FAISS index for fast similarity search; returns (index, index_meta).
+        The type comes from index_type ('auto' picks Flat, HNSW, IVF or IVF-PQ
+        by corpus size); embeddings may be a memory-mapped array.
+        """
+        n, dimension = embeddings.shape
+        if n == 0:
+            return None, None
         
-        # Save chunks and metadata
-        with open(os.path.join(self.kb_folder, "chunks.pkl"), "wb") as f:
-            pickle.dump(self.chunks, f)
+        kind = self.index_type if self.index_type != 'auto' else ann_index.choose_index_type(n)
+        pca_dim = self._pca_dim(dimension, n)
+        if self.pca_dim and not pca_dim:
+            print(f"⚠️  PCA to {self.pca_dim} dims needs more vectors and dimensions, not reducing")
+        params = {**ann_index.default_params(kind, n, pca_dim or dimension), **self.index_params}
+        print(f"\n🔄 Creating FAISS index ({kind}, {params}, codec {self.codec}"
+              f"{f', PCA {pca_dim} dims' if pca_dim else ''})...")
         
-        with open(os.path.join(self.kb_folder, "metadata.pkl"), "wb") as f:
-            pickle.dump(self.metadata, f)
+        index = ann_index.build_index(kind, dimension, params, INDEX_METRIC, self.codec, pca_dim)
+        if ids is None:
+            ids = np.arange(n)
+        ann_index.populate(index, kind, params, embeddings, ids, self.codec, pca_dim)
         
+        print(f"✅ FAISS index created with {index.ntotal} vectors!")
+        return index, {'type': kind, 'params': params, 'dim': dimension, 'metric': INDEX_METRIC,
+                       'codec': self.codec, 'pca_dim': pca_dim}
+    
+    def _index_outdated(self, index_meta: Dict, n: int) -> bool:
+        """The index type or encoding isn't what the settings ask for n vectors"""
+        wanted = self.index_type if self.index_type != 'auto' else ann_index.choose_index_type(n)
+        return (index_meta['type'] != wanted or index_meta.get('codec', 'none') != self.codec
+                or index_meta.get('pca_dim', 0) != self._pca_dim(index_meta['dim'], n))
+    
+    def _pca_dim(self, dimension: int, n: int) -> int:
+        """PCA output size for n vectors (0 when there are too few to fit it)"""
+        return self.pca_dim if self.pca_dim < min(dimension, n) else 0
+    
+    def _version_path(self, version: str, *names: str) -> str:
+        return os.path.join(self.kb_folder, VERSIONS_FOLDER, version, *names)
+    
+    def _read_current(self) -> Optional[str]:
+        """The published version named by CURRENT, or None"""
+        try:
+            with open(self._kb_path(CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+    
+    def _begin_version(self) -> Tuple[str, str]:
+        """Name and build folder of a new version, built beside the published one"""
+        version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        build = self._version_path(version) + ".tmp"
+        os.makedirs(build)
+        return version, build
+    
+    def _save_version(self, build: str, index, index_meta: Optional[Dict], manifest: Dict):
+        """Write index, index metadata and manifest next to the chunk store in build"""
+        print("\n💾 Saving knowledge base...")
+        if index is not None:  # a version without content has no index
+            faiss.write_index(index, os.path.join(build, FAISS_INDEX_FILE))
+            with open(os.path.join(build, INDEX_META_FILE), "w") as f:
+                json.dump(index_meta, f, indent=1)
+        self._save_manifest(manifest, build)
         print("✅ Knowledge base saved!")
     
-    def load_index(self) -> bool:
-        """Load existing index from disk"""
-        index_path = os.path.join(self.kb_folder, "faiss_index.bin")
-        chunks_path = os.path.join(self.kb_folder, "chunks.pkl")
-        metadata_path = os.path.join(self.kb_folder, "metadata.pkl")
+    def _publish(self, version: str, build: str):
+        """
+        Move a finished build into place and point CURRENT at it. CURRENT is
+        replaced atomically, so readers see either the old or the new version;
+        the old one is marked retired and deleted after the grace period.
+        """
+        os.replace(build, self._version_path(version))
+        previous = self._read_current()
+        
+        current = self._kb_path(CURRENT_FILE)
+        with open(current + ".tmp", "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current + ".tmp", current)
+        print(f"📌 Published knowledge base version {version}")
         
-        if not all(os.path.exists(p) for p in [index_path, chunks_path, metadata_path]):
+        if previous and previous != version and os.path.isdir(self._version_path(previous)):
+            with open(self._version_path(previous, RETIRED_FILE), "w") as f:
+                f.write(str(time.time()))
+        else:
+            self._remove_unversioned_files()
+        self.collect_old_versions()
+    
+    def _remove_unversioned_files(self):
+        """Delete a knowledge base left in the folder root by older versions"""
+        for file in [FAISS_INDEX_FILE, 'chunks.pkl', 'metadata.pkl', MANIFEST_FILE, INDEX_META_FILE]:
+            path = self._kb_path(file)
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(self._kb_path(STORE_FOLDER), ignore_errors=True)
+    
+    def _save_manifest(self, manifest: Dict, folder: str):
+        """Atomically write the per-file manifest"""
+        path = os.path.join(folder, MANIFEST_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + ".tmp", path)
+    
+    @property
+    def index_version(self) -> str:
+        """Identifies the current knowledge base contents"""
+        return (self.manifest or {}).get('version', '')
+    
+    def _read_index(self, path: str, mmap: bool = False) -> Tuple[object, bool]:
+        """
+        Read a saved FAISS index; returns (index, mapped). With mmap the
+        vectors (flat and HNSW storage, IVF lists) stay in the file's pages,
+        shared with every process that maps it, and the index cannot be modified.
+        """
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', 0) if mmap else 0  # faiss >= 1.10
+        if flags:
+            return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY), True
+        return faiss.read_index(path), False
+    
+    def _set_live(self, version: Optional[str], index, index_meta: Optional[Dict],
+                  manifest: Optional[Dict], store: Optional[ChunkStore], mapped: bool = False,
+                  lexical: Optional[LexicalIndex] = None):
+        """Switch searches to another knowledge base in one step"""
+        with self._live_lock:
+            self.lexical = lexical
+            self.version = version
+            self.index = index
+            self.index_meta = index_meta
+            self.index_mmapped = mapped
+            self.manifest = manifest
+            self.store = store
+            self.chunks = store.texts if store is not None else []
+            self.metadata = store.metadata if store is not None else []
+    
+    def _live(self) -> Tuple:
+        """(index, index_meta, store, lexical) of one version, for a search to use throughout"""
+        with self._live_lock:
+            return self.index, self.index_meta, self.store, self.lexical
+    
+    def list_sources(self) -> List[str]:
+        """Names of the PDFs that have chunks in the knowledge base"""
+        store = self.store
+        return store.source_names() if store is not None else []
+    
+    def _load_version(self, version: str):
+        """Open a published version (index memory-mapped if enabled) and make it live"""
+        folder = self._version_path(version)
+        with open(os.path.join(folder, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        index, index_meta, mapped = None, None, False
+        if os.path.exists(os.path.join(folder, FAISS_INDEX_FILE)):
+            with open(os.path.join(folder, INDEX_META_FILE)) as f:
+                index_meta = json.load(f)
+            index, mapped = self._read_index(os.path.join(folder, FAISS_INDEX_FILE), self.mmap_index)
+        store = ChunkStore(os.path.join(folder, STORE_FOLDER))
+        lexical_folder = os.path.join(folder, LEXICAL_FOLDER)
+        lexical = LexicalIndex(lexical_folder) if LexicalIndex.exists(lexical_folder) else None
+        self._set_live(version, index, index_meta, manifest, store, mapped, lexical)
+    
+    def _build_lexical_index(self, folder: str, store: ChunkStore):
+        print("\n🔤 Building BM25 index...")
+        info = lexical_index.build(os.path.join(folder, LEXICAL_FOLDER), store.texts)
+        print(f"✅ BM25 index: {info['terms']} terms over {info['chunks']} chunks")
+    
+    def _add_lexical_index(self):
+        """Give a version saved before lexical search existed its BM25 index"""
+        store, lexical, version = self.store, self.lexical, self.version
+        if lexical is not None or store is None or version is None:
+            return
+        tmp = self._version_path(version, f"{LEXICAL_FOLDER}.{os.getpid()}.tmp")
+        self._build_lexical_index(tmp, store)
+        try:
+            os.rename(os.path.join(tmp, LEXICAL_FOLDER), self._version_path(version, LEXICAL_FOLDER))
+        except OSError:
+            pass  # another process added it first
+        shutil.rmtree(tmp, ignore_errors=True)
+        self._load_version(version)
+    
+    def load_index(self) -> bool:
+        """Load the published version from disk"""
+        version = self._read_current()
+        if version is None:
+            if os.path.exists(self._kb_path(FAISS_INDEX_FILE)):
+                print("⚠️  Knowledge base was built by an older version, rebuilding...")
             return False
         
         try:
-            print("📥 Loading existing knowledge base...")
-            self.index = faiss.read_index(index_path)
-            
-            with open(chunks_path, "rb") as f:
-                self.chunks = pickle.load(f)
-            
-            with open(metadata_path, "rb") as f:
-                self.metadata = pickle.load(f)
-            
+            print(f"📥 Loading knowledge base version {version}...")
+            self._load_version(version)
             print(f"✅ Loaded {len(self.chunks)} chunks from knowledge base!")
+            if self.index_meta is not None and self.index_meta.get('metric') != INDEX_METRIC:
+                print("⚠️  Knowledge base ranks by L2 distance, rebuilding for cosine similarity...")
+                return False
             return True
         except Exception as e:
             print(f"❌ Error loading index: {e}")
             return False
     
+    def swap_to_current(self, force: bool = False) -> bool:
+        """
+        Make the published version live if it isn't already, e.g. after
+        another process rebuilt the knowledge base. Called between requests:
+        CURRENT is read at most every swap_check_interval seconds, and
+        searches already running finish on the version they started with.
+        """
+        now = time.monotonic()
+        if not force and now - self._swap_checked < self.swap_check_interval:
+            return False
+        self._swap_checked = now
+        
+        version = self._read_current()
+        if version is None or version == self.version:
+            return False
+        if not self._swap_lock.acquire(blocking=False):
+            return False  # another thread is loading it
+        try:
+            if version == self.version:
+                return False
+            self._load_version(version)
+            print(f"🔀 Switched to knowledge base version {version} ({len(self.chunks)} chunks)")
+            return True
+        except Exception as e:
+            print(f"❌ Could not switch to knowledge base version {version}: {e}")
+            return False
+        finally:
+            self._swap_lock.release()
+    
+    def collect_old_versions(self, grace_seconds: Optional[float] = None) -> List[str]:
+        """
+        Delete versions retired more than grace_seconds ago, giving processes
+        still on them time to swap. The published version and the one this
+        process has loaded are kept; abandoned builds go after a day.
+        """
+        grace = KB_VERSION_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        root = self._kb_path(VERSIONS_FOLDER)
+        if not os.path.isdir(root):
+            return []
+        
+        keep = {self._read_current(), self.version}
+        now = time.time()
+        removed = []
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if name in keep or not os.path.isdir(path):
+                continue
+            marker = os.path.join(path, RETIRED_FILE)
+            if os.path.exists(marker):
+                age = now - os.path.getmtime(marker)
+            else:
+                # Never published: a build in progress or one that died
+                age = now - os.path.getmtime(path) - max(0.0, STALE_BUILD_SECONDS - grace)
+            if age > grace:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(name)
+        
+        if removed:
+            print(f"🧹 Removed {len(removed)} old knowledge base version(s)")
+        return removed
+    
     def _load_or_create_index(self):
-        """Load existing index or create new one"""
+        """Load existing index (picking up PDF changes) or create new one"""
         if self.load_index():
             # Load embedding model for queries
             self._load_embedding_model()
+            self._add_lexical_index()
+            self.refresh_index()
+            self.collect_old_versions()
             return
         
+        self._create_index()
+    
+    def _create_index(self):
+        """
+        Build a new version from every PDF in the folder and publish it.
+        Whatever is live keeps serving until then.
+        """
         print("\n🔨 Creating new knowledge base...")
         
-        # Process PDFs
-        chunks, metadata = self.process_pdfs()
+        manifest = {'next_id': 0, 'files': {}}
         
-        if not chunks:
+        pdf_files = list(self._scan_pdf_folder().values())
+        if not pdf_files:
+            print(f"⚠️  No PDF files found in {self.pdf_folder}")
+        
+        version, build = self._begin_version()
+        try:
+            writer = ChunkStoreWriter(os.path.join(build, STORE_FOLDER))
+            try:
+                count = self._ingest(pdf_files, writer, manifest)
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+            
+            store = ChunkStore(os.path.join(build, STORE_FOLDER))
+            index, index_meta = self.create_faiss_index(store.vectors, store.vector_ids)
+            self._build_lexical_index(build, store)
+            manifest['version'] = version
+            self._save_version(build, index, index_meta, manifest)
+            del store, index
+            self._publish(version, build)
+        except BaseException:
+            shutil.rmtree(build, ignore_errors=True)
+            raise
+        
+        self._load_version(version)
+        if count:
+            print("\n🎉 Knowledge base created successfully!")
+        else:
             print("\n⚠️  No content to index. Please add PDF files to the 'pdfs' folder.")
-            return
+    
+    def _ingest(self, pdf_files: List[Path], writer: ChunkStoreWriter, manifest: Dict) -> int:
+        """
+        Streaming ingestion: pages -> chunks -> embedding batches -> chunk store.
+        Each full batch is embedded and appended (text, metadata and vectors)
+        to the store before the next one is read, so memory use is bounded by
+        embed_batch_size rather than by corpus size. The index is then built
+        from the memory-mapped vectors. Returns the chunk count.
+        """
+        if not pdf_files:
+            return 0
         
-        self.chunks = chunks
-        self.metadata = metadata
+        print(f"\n📚 Ingesting {len(pdf_files)} PDFs (batches of {self.embed_batch_size} chunks)...")
+        files = manifest['files']
         
-        # Create embeddings
-        embeddings = self.create_embeddings(chunks)
+        # Every processed file gets a manifest record, even if it produced no
+        # chunks, so it is not re-parsed on each startup until it changes
+        for pdf_file in pdf_files:
+            stat = pdf_file.stat()
+            files[pdf_file.name] = {
+                'sha256': _file_sha256(str(pdf_file)),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'id_start': manifest['next_id'],
+                'id_count': 0
+            }
         
-        # Create FAISS index
-        self.index = self.create_faiss_index(embeddings)
+        texts, metas, ids = [], [], []
+        total = 0
+        self._open_embedding_cache()
+        self._open_embedding_engine()
         
-        # Save everything
-        self.save_index()
+        def flush():
+            writer.add_batch(texts, metas, ids, self._embed_batch(texts))
+            print(f"   🔄 Embedded {total} chunks")
         
-        print("\n🎉 Knowledge base created successfully!")
+        try:
+            for chunk, meta in self.iter_chunks(pdf_files):
+                record = files[meta['source']]
+                if meta['chunk_id'] == 0:
+                    record['id_start'] = manifest['next_id']
+                record['id_count'] = meta['chunk_id'] + 1
+                manifest['next_id'] = record['id_start'] + record['id_count']
+                
+                texts.append(chunk)
+                metas.append(meta)
+                ids.append(record['id_start'] + meta['chunk_id'])
+                total += 1
+                
+                if len(texts) >= self.embed_batch_size:
+                    flush()
+                    texts, metas, ids = [], [], []
+            
+            if texts:
+                flush()
+        finally:
+            self._close_embedding_engine()
+            self._close_embedding_cache()
+        
+        # Leave failed files out of the manifest so the next refresh retries them
+        for name in self.failed_files:
+            files.pop(name, None)
+        
+        print(f"\n✅ Total chunks processed: {total}")
+        return total
     
-    def search(self, query: str, top_k: int = 3) -> List[Dict]:
-        """Search for relevant chunks given a query"""
-        if self.index is None or len(self.chunks) == 0:
-            return []
+    def refresh_index(self) -> Dict[str, List[str]]:
+        """
+        Bring the knowledge base in line with the PDF folder.
+        Only new or changed files are embedded; vectors of deleted files are
+        dropped. Changes are built as a new version and published.
+        """
+        if self.manifest is None or self.store is None:
+            self._create_index()
+            return {'added': sorted(self.manifest['files']), 'updated': [], 'removed': []}
         
-        # Create query embedding
+        index, index_meta, store, _ = self._live()
+        manifest = json.loads(json.dumps(self.manifest))  # the live one stays as it is
+        on_disk = self._scan_pdf_folder()
+        known = manifest['files']
+        added, updated = [], []
+        touched = False
+        
+        for name, pdf_file in on_disk.items():
+            record = known.get(name)
+            if record is None:
+                added.append(name)
+                continue
+            
+            # Cheap size/mtime check first; only hash files that look different
+            stat = pdf_file.stat()
+            if stat.st_size == record['size'] and stat.st_mtime == record['mtime']:
+                continue
+            if stat.st_size == record['size'] and _file_sha256(str(pdf_file)) == record['sha256']:
+                record['mtime'] = stat.st_mtime
+                touched = True
+                continue
+            updated.append(name)
+        
+        removed = [name for name in known if name not in on_disk]
+        changes = {'added': added, 'updated': updated, 'removed': removed}
+        # A version without an index (no chunks yet) only needs one once it has chunks
+        reindex = (self._index_outdated(index_meta, len(store)) if index_meta is not None
+                   else len(store) > 0)
+        
+        if not (added or updated or removed or reindex):
+            if touched:
+                self._save_manifest(manifest, self._version_path(self.version))
+                self.manifest = manifest
+            print("✅ Knowledge base is up to date")
+            return changes
+        
+        if added or updated or removed:
+            print(f"\n🔄 Refreshing knowledge base: {len(added)} new, "
+                  f"{len(updated)} changed, {len(removed)} removed")
+        else:
+            print("\n🔄 Index settings changed, re-indexing the knowledge base...")
+        
+        # Copy the surviving chunks into a new store, then append the new files
+        doomed = updated + removed
+        doomed_rows = store.rows_for_sources(doomed)
+        doomed_ids = np.asarray(store.vector_ids[doomed_rows], dtype='int64')
+        keep_rows = np.setdiff1d(np.arange(len(store)), doomed_rows)
+        for name in doomed:
+            known.pop(name, None)
+        
+        version, build = self._begin_version()
+        try:
+            writer = ChunkStoreWriter(os.path.join(build, STORE_FOLDER))
+            try:
+                writer.extend_from(store, keep_rows)
+                self._ingest([on_disk[name] for name in sorted(added + updated)], writer, manifest)
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+            new_store = ChunkStore(os.path.join(build, STORE_FOLDER))
+            
+            # Update a copy of the index unless there is none (or nothing left to
+            # index), the corpus outgrew its type, the settings changed or the
+            # type cannot remove vectors; rebuilding needs no re-embedding
+            if (index_meta is None or not len(new_store)
+                    or self._index_outdated(index_meta, len(new_store))
+                    or (len(doomed_ids) and not ann_index.supports_remove(index_meta['type']))):
+                index, index_meta = self.create_faiss_index(new_store.vectors, new_store.vector_ids)
+            else:
+                # Never the live index: it may be mapped read-only, and searches are using it
+                index, _ = self._read_index(self._version_path(self.version, FAISS_INDEX_FILE))
+                if len(doomed_ids):
+                    index.remove_ids(doomed_ids)
+                kept = len(keep_rows)
+                ann_index.add_vectors(index, new_store.vectors[kept:], new_store.vector_ids[kept:])
+            
+            if index is None:
+                print("\n⚠️  No content left to index.")
+            self._build_lexical_index(build, new_store)
+            manifest['version'] = version
+            self._save_version(build, index, index_meta, manifest)
+            del new_store, index
+            self._publish(version, build)
+        except BaseException:
+            shutil.rmtree(build, ignore_errors=True)
+            raise
+        
+        self._load_version(version)
+        return changes
+    
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Embeddings of search queries, shape (len(queries), dim). Cached ones come
+        from the LRU; the rest are encoded together in one batch.
+        """
         model = self._load_embedding_model()
-        query_embedding = model.encode([query])
+        if self._query_cache_model is not model:
+            # A different model makes every cached embedding meaningless
+            self.query_cache.clear()
+            self._query_cache_model = model
+        
+        keys = [_normalize_query(query) for query in queries]
+        cached = [self.query_cache.get(key) for key in keys]
+        # First spelling of each uncached key is encoded; duplicates share it
+        missing = {}
+        for i, embedding in enumerate(cached):
+            if embedding is None:
+                missing.setdefault(keys[i], i)
+        if missing:
+            fresh = _normalize_rows(model.encode([queries[i] for i in missing.values()]))
+            for key, embedding in zip(missing, fresh):
+                embedding.setflags(write=False)
+                self.query_cache.put(key, embedding)
+                missing[key] = embedding
+            cached = [missing[key] if embedding is None else embedding
+                      for key, embedding in zip(keys, cached)]
+        return np.stack(cached) if cached else np.zeros((0, 0), dtype='float32')
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embedding of one search query, shape (1, dim)"""
+        return self.embed_queries([query])
+    
+    def search(self, query: str, top_k: int = 3, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> List[Dict]:
+        """
+        Search for relevant chunks given a query.
+        nprobe (IVF indexes) and ef_search (HNSW) trade recall for speed per query.
+        """
+        return self.search_many([query], top_k, nprobe, ef_search)[0]
+    
+    def search_many(self, queries: List[str], top_k: int = 3, nprobe: Optional[int] = None,
+                    ef_search: Optional[int] = None) -> List[List[Dict]]:
+        """
+        Search for several queries at once: one encode call and one matrix
+        index search, fused with BM25 in hybrid mode. Returns one ranked
+        result list per query. Each result's score_kind says what its
+        similarity_score is: 'cosine' (vector similarity), 'identifier' (the
+        identifier fast path) or 'coverage' (lexical mode); the latter two are
+        the share of query terms the chunk contains.
+        """
+        index, index_meta, store, lexical = self._live()  # one version for the whole call
+        if store is None or len(store) == 0 or not queries:
+            return [[] for _ in queries]
+        use_dense = index is not None and self.retrieval_mode != 'lexical'
+        use_lexical = lexical is not None and self.retrieval_mode != 'dense'
+        if not (use_dense or use_lexical):
+            return [[] for _ in queries]
+        
+        ranked = [None] * len(queries)  # per query: [(row, similarity)]
+        kinds = ['cosine'] * len(queries)
+        terms = [lexical_index.tokenize(query) for query in queries] if use_lexical else None
+        if use_lexical and use_dense:
+            for i, query in enumerate(queries):
+                ranked[i] = self._identifier_search(lexical, terms[i], query, top_k)
+                if ranked[i] is not None:
+                    kinds[i] = 'identifier'
+        elif use_lexical:
+            for i, query in enumerate(queries):
+                hits = lexical.search(query, top_k)
+                ranked[i] = self._lexical_similarity(lexical, terms[i], hits)
+                kinds[i] = 'coverage'
         
-        # Search in FAISS index
-        distances, indices = self.index.search(query_embedding.astype('float32'), top_k)
+        pending = [i for i, rows in enumerate(ranked) if rows is None]
+        if pending:
+            query_embeddings = self.embed_queries([queries[i] for i in pending])
+            
+            # Search in FAISS index (deeper in hybrid mode, to give fusion candidates,
+            # and with a compressed index, whose candidates are rescored)
+            depth = max(top_k, HYBRID_CANDIDATES) if use_lexical else top_k
+            rescore = ann_index.is_compressed(index_meta)
+            if rescore:
+                depth = max(depth, top_k * self.rescore_factor)
+            search_kwargs = {}
+            params = ann_index.search_params(index_meta['type'], index_meta['params'],
+                                             nprobe, ef_search)
+            if params is not None:
+                search_kwargs['params'] = params
+            scores, labels = index.search(query_embeddings, depth, **search_kwargs)
+            metric = index_meta.get('metric', 'l2')
+            
+            for i, query_embedding, query_scores, query_labels in zip(pending, query_embeddings,
+                                                                      scores, labels):
+                dense = {}
+                for score, row in zip(query_scores, store.find_rows(query_labels)):
+                    if row is not None:
+                        dense[row] = _similarity(float(score), metric)
+                rows = list(dense)
+                if rescore and rows:
+                    rows, exact = ann_index.rescore(store.vectors, rows, query_embedding, metric)
+                    rows = rows.tolist()
+                    dense = {row: _similarity(float(score), metric) for row, score in zip(rows, exact)}
+                if use_lexical:
+                    lexical_rows = [row for row, _ in lexical.search(queries[i], HYBRID_CANDIDATES)]
+                    rows = lexical_index.reciprocal_rank_fusion([rows, lexical_rows], k=RRF_K)
+                rows = rows[:top_k]
+                ranked[i] = [(row, dense[row] if row in dense
+                              else self._exact_similarity(store, query_embedding, row, metric))
+                             for row in rows]
         
         # Prepare results
-        results = []
-        for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.chunks):
-                results.append({
-                    'rank': i + 1,
-                    'text': self.chunks[idx],
-                    'metadata': self.metadata[idx],
-                    'similarity_score': float(1 / (1 + dist))  # Convert distance to similarity
-                })
+        all_results = []
+        for rows, kind in zip(ranked, kinds):
+            all_results.append([{
+                'rank': rank,
+                'text': store.text(row),
+                'metadata': store.meta(row),
+                'similarity_score': float(similarity),
+                'score_kind': kind
+            } for rank, (row, similarity) in enumerate(rows, start=1)])
         
-        return results
+        return all_results
+    
+    def answers_lexically(self, query: str) -> bool:
+        """
+        search() would answer the query from BM25 alone (the identifier fast
+        path, or lexical mode) without encoding it. One BM25 lookup.
+        """
+        index, _, store, lexical = self._live()
+        if store is None or lexical is None or self.retrieval_mode == 'dense':
+            return False
+        if index is None or self.retrieval_mode == 'lexical':
+            return True
+        return self._identifier_search(lexical, lexical_index.tokenize(query), query, 1) is not None
+    
+    def _identifier_search(self, lexical: LexicalIndex, terms: List[str], query: str,
+                           top_k: int) -> Optional[List[Tuple[int, float]]]:
+        """
+        Lexical-only answer for short queries naming identifiers the corpus
+        contains ("Komatsu 980E specs"): chunks holding all of them, by BM25.
+        None when the query needs the vector search.
+        """
+        identifiers = _fast_path_identifiers(query)
+        if not identifiers:
+            return None
+        hits = lexical.search_all_of(identifiers, query, top_k)
+        return self._lexical_similarity(lexical, terms, hits) if hits else None
+    
+    @staticmethod
+    def _lexical_similarity(lexical: LexicalIndex, terms: List[str],
+                            hits: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        rows = [row for row, _ in hits]
+        return list(zip(rows, lexical.coverage(terms, rows).tolist()))
+    
+    @staticmethod
+    def _exact_similarity(store: ChunkStore, query_embedding: np.ndarray, row: int,
+                          metric: str) -> float:
+        """Similarity of a query to a stored chunk, as the index would score it"""
+        vector = np.asarray(store.vectors[row], dtype='float32')
+        if metric == 'ip':
+            return float(np.dot(vector, query_embedding))
+        diff = vector - query_embedding
+        return _similarity(float(np.dot(diff, diff)), metric)
+    
+    def index_report(self, queries: Optional[List[str]] = None, k: int = 10,
+                     sample: int = 200) -> List[Dict]:
+        """
+        Recall@k vs latency of the current index for each nprobe/efSearch
+        setting, against exact search. Without queries, a sample of stored
+        chunk vectors is used as the query set.
+        """
+        if self.index is None or not len(self.store):
+            return []
+        
+        if queries:
+            self._load_embedding_model()
+            query_vectors = self._embed_batch(queries)
+        else:
+            rng = np.random.default_rng(0)
+            rows = np.sort(rng.choice(len(self.store), min(sample, len(self.store)), replace=False))
+            query_vectors = np.asarray(self.store.vectors[rows])
+        
+        return ann_index.recall_report(self.index, self.index_meta['type'], self.index_meta['params'],
+                                       self.store.vectors, self.store.vector_ids, query_vectors, k=k,
+                                       metric=self.index_meta.get('metric', 'l2'))
+    
+    def compression_report(self, queries: Optional[List[str]] = None, k: int = 10,
+                           sample: int = 200) -> List[Dict]:
+        """
+        Index size vs recall@k of each compressed first-pass encoding over the
+        stored vectors, before and after exact rescoring (see ann_index).
+        Without queries, a sample of stored chunk vectors is the query set.
+        """
+        if self.store is None or not len(self.store):
+            return []
+        
+        if queries:
+            self._load_embedding_model()
+            query_vectors = self._embed_batch(queries)
+        else:
+            rng = np.random.default_rng(0)
+            rows = np.sort(rng.choice(len(self.store), min(sample, len(self.store)), replace=False))
+            query_vectors = np.asarray(self.store.vectors[rows])
+        
+        metric = (self.index_meta or {}).get('metric', INDEX_METRIC)
+        return ann_index.compression_report(self.store.vectors, query_vectors, k=k, metric=metric,
+                                            rescore_factor=self.rescore_factor)
+    
+    def _load_confidence_threshold(self) -> float:
+        """CONFIDENCE_THRESHOLD, else the threshold calibrated for the embedding model"""
+        if os.getenv('CONFIDENCE_THRESHOLD'):
+            return float(os.getenv('CONFIDENCE_THRESHOLD'))
+        try:
+            with open(self._kb_path(CALIBRATION_FILE)) as f:
+                calibration = json.load(f).get(self.embedding_model_name, {})
+        except (OSError, ValueError):
+            calibration = {}
+        return float(calibration.get('threshold', DEFAULT_CONFIDENCE_THRESHOLD))
+    
+    @staticmethod
+    def confidence(results: List[Dict]) -> Optional[float]:
+        """
+        What the confidence gate judges: the best cosine similarity among
+        the results the prompt is built from. None when no result was scored
+        by cosine (identifier and lexical-mode matches), which the gate lets
+        through; 0.0 without results.
+        """
+        scores = [r['similarity_score'] for r in results if r.get('score_kind', 'cosine') == 'cosine']
+        if not scores:
+            return None if results else 0.0
+        return max(scores)
+    
+    def calibrate(self, labelled: List[Tuple[str, bool]],
+                  target_recall: float = CALIBRATION_TARGET_RECALL, save: bool = True,
+                  reranker=None) -> Dict:
+        """
+        Confidence threshold from questions labelled answerable (the PDFs
+        cover them) or not: the highest confidence() that still lets
+        target_recall of the answerable questions through. Questions are
+        retrieved and reranked as the chat apps do (reranker defaults to one
+        built from the RERANK_* settings), so the threshold is calibrated on
+        the score the gate sees. Reports the share of unanswerable questions
+        it stops; saved for the embedding model.
+        """
+        if reranker is None:
+            from reranker import Reranker
+            reranker = Reranker()
+        questions = [question for question, _ in labelled]
+        scores = [self.confidence(reranker.rerank(question, results, self.index_version))
+                  for question, results in zip(questions,
+                                               self.search_many(questions, top_k=reranker.candidates))]
+        # Lexical matches pass the gate whatever the threshold
+        gated = [(score, ok) for score, (_, ok) in zip(scores, labelled) if score is not None]
+        answerable = sorted(score for score, ok in gated if ok)
+        unanswerable = [score for score, ok in gated if not ok]
+        if not answerable:
+            raise ValueError("Calibration needs at least one answerable question the gate judges "
+                             "by cosine similarity")
+        
+        threshold = answerable[int((1 - target_recall) * len(answerable))]
+        report = {
+            'threshold': round(threshold, 4),
+            'target_recall': target_recall,
+            'answerable': len(answerable),
+            'unanswerable': len(unanswerable),
+            'ungated': len(labelled) - len(gated),
+            'recall': sum(score >= threshold for score in answerable) / len(answerable),
+            'rejected_unanswerable': (sum(score < threshold for score in unanswerable) / len(unanswerable)
+                                      if unanswerable else None),
+            'index_version': self.index_version
+        }
+        
+        if save:
+            path = self._kb_path(CALIBRATION_FILE)
+            try:
+                with open(path) as f:
+                    calibration = json.load(f)
+            except (OSError, ValueError):
+                calibration = {}
+            calibration[self.embedding_model_name] = report
+            with open(path + ".tmp", "w") as f:
+                json.dump(calibration, f, indent=1)
+            os.replace(path + ".tmp", path)
+            self.confidence_threshold = self._load_confidence_threshold()
+        return report
     
     def rebuild_index(self):
         """Rebuild the entire index from PDFs"""
         print("\n🔄 Rebuilding knowledge base...")
         
-        # Remove old index
-        for file in ['faiss_index.bin', 'chunks.pkl', 'metadata.pkl']:
-            path = os.path.join(self.kb_folder, file)
-            if os.path.exists(path):
-                os.remove(path)
-        
-        # Recreate
-        self._load_or_create_index()
+        # Built beside the live version, which keeps serving until it is replaced
+        self._create_index()
 
 
 def main():
     """Test the PDF RAG system"""
+    import argparse
+    parser = argparse.ArgumentParser(description="PDF RAG System - Test")
+    parser.add_argument("--index-report", action="store_true",
+                        help="print recall@k vs latency for the current index")
+    parser.add_argument("--compression-report", action="store_true",
+                        help="print index size vs recall@k for fp16/int8/PCA first-pass encodings")
+    parser.add_argument("--embed-benchmark", action="store_true",
+                        help="print encoding throughput (chunks/sec) per worker count")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="build a new knowledge base version from every PDF and publish it")
+    parser.add_argument("--calibrate", metavar="FILE",
+                        help="set the confidence threshold from labelled questions "
+                             '(JSON lines: {"question": ..., "answerable": true|false})')
+    parser.add_argument("--context-report", metavar="FILE",
+                        help="prompt context tokens with and without packing for a query log "
+                             "(one question per line)")
+    args = parser.parse_args()
+    
     print("=" * 60)
     print("PDF RAG System - Test")
     print("=" * 60)
@@ -263,6 +1378,68 @@ def main():
     # Initialize system
     rag = PDFRAGSystem()
     
+    if args.rebuild:
+        rag.rebuild_index()
+    
+    if args.calibrate:
+        with open(args.calibrate) as f:
+            labelled = [(row['question'], bool(row['answerable']))
+                        for row in map(json.loads, filter(str.strip, f))]
+        report = rag.calibrate(labelled)
+        print("\n" + "=" * 60)
+        print(f"Confidence Calibration ({rag.embedding_model_name})")
+        print("=" * 60)
+        rejected = report['rejected_unanswerable']
+        print(f"threshold={report['threshold']:.3f}  recall={report['recall']:.1%} "
+              f"of {report['answerable']} answerable  "
+              f"rejected={'n/a' if rejected is None else f'{rejected:.1%}'} "
+              f"of {report['unanswerable']} unanswerable")
+        if report['ungated']:
+            print(f"{report['ungated']} question(s) were matched lexically and pass the gate unscored")
+        if os.getenv('CONFIDENCE_THRESHOLD'):
+            print(f"⚠️  CONFIDENCE_THRESHOLD={os.getenv('CONFIDENCE_THRESHOLD')} overrides it")
+    
+    if args.context_report:
+        from context_packer import pack_context
+        with open(args.context_report) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        packed = [pack_context(results) for results in rag.search_many(questions, top_k=5)]
+        raw_tokens = np.asarray([row['raw_tokens'] for row in packed] or [0])
+        tokens = np.asarray([row['tokens'] for row in packed] or [0])
+        print("\n" + "=" * 60)
+        print(f"Context Packing ({len(packed)} questions, top 5 hits)")
+        print("=" * 60)
+        print(f"joined: mean={raw_tokens.mean():.0f} p95={np.percentile(raw_tokens, 95):.0f} tokens")
+        print(f"packed: mean={tokens.mean():.0f} p95={np.percentile(tokens, 95):.0f} tokens "
+              f"({1 - tokens.sum() / max(raw_tokens.sum(), 1):.1%} fewer)")
+    
+    if args.index_report:
+        print("\n" + "=" * 60)
+        print(f"Index Report ({rag.index_meta['type'] if rag.index_meta else 'none'})")
+        print("=" * 60)
+        for row in rag.index_report():
+            setting = ', '.join(f"{key}={row[key]}" for key in ('nprobe', 'ef_search') if key in row)
+            print(f"{setting or 'exact':<16} recall@10={row['recall@10']:.3f}  "
+                  f"mean={row['mean_ms']:.2f}ms  p95={row['p95_ms']:.2f}ms")
+    
+    if args.compression_report:
+        print("\n" + "=" * 60)
+        print(f"Compression Report (flat scan, rescoring top {rag.rescore_factor}x)")
+        print("=" * 60)
+        for row in rag.compression_report():
+            encoding = row['codec'] + (f"+pca{row['pca_dim']}" if row['pca_dim'] else '')
+            print(f"{encoding:<12} {row['bytes_per_vector']:7.1f} B/vector  {row['index_mb']:8.2f} MB  "
+                  f"recall@10={row['recall@10']:.3f}  rescored={row['recall@10_rescored']:.3f}  "
+                  f"mean={row['mean_ms']:.2f}ms")
+    
+    if args.embed_benchmark:
+        print("\n" + "=" * 60)
+        print(f"Embedding Throughput (batch {rag.encode_batch_size})")
+        print("=" * 60)
+        for row in rag.benchmark_embedding():
+            print(f"{row['workers']:>3} workers: {row['chunks_per_sec']:.1f} chunks/sec "
+                  f"({row['chunks']} chunks in {row['seconds']:.1f}s)")
+    
     # Test search
     if rag.index is not None:
         print("\n" + "=" * 60)
@@ -0,0 +1,154 @@
+"""
+Cross-encoder reranking of retrieved chunks
+Retrieval fetches RERANK_CANDIDATES chunks, a cross-encoder scores every
+(question, chunk) pair in one batched call and only the best RERANK_TOP_K
+go into the prompt. Scores are cached per (question, chunk). Scoring runs
+on a worker thread against a per-request budget: a request whose scores
+aren't ready in time keeps the vector order (the scores still land in the
+cache for the next time the question is asked).
+"""
+
+import os
+import time
+import hashlib
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List
+
+from lru_cache import LRUCache
+from metrics import metrics
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+# Empty disables reranking, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANK_MODEL = os.getenv('RERANK_MODEL', '')
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '20'))
+RERANK_TOP_K = int(os.getenv('RERANK_TOP_K', '3'))
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '150'))
+RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', '20000'))
+RERANK_WORKERS = int(os.getenv('RERANK_WORKERS', '2'))
+RERANK_BATCH_SIZE = 32
+
+# Chunks a question gets without reranking
+DEFAULT_TOP_K = 5
+
+
+def _question_key(question: str) -> str:
+    text = ' '.join(unicodedata.normalize('NFKC', question).casefold().split())
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class Reranker:
+    """Reorders search results by cross-encoder score (a no-op when disabled)"""
+    
+    def __init__(self, model_name: str = RERANK_MODEL, candidates: int = RERANK_CANDIDATES,
+                 top_k: int = RERANK_TOP_K, budget_ms: float = RERANK_BUDGET_MS,
+                 cache_size: int = RERANK_CACHE_SIZE, workers: int = RERANK_WORKERS):
+        self.model_name = model_name
+        self.model = self._load_model(model_name) if model_name else None
+        self.enabled = self.model is not None
+        self.top_k = top_k if self.enabled else DEFAULT_TOP_K
+        self.candidates = max(candidates, top_k) if self.enabled else DEFAULT_TOP_K
+        self.budget_ms = budget_ms
+        self.workers = max(1, workers)
+        self._scores = LRUCache(cache_size)
+        self._executor = None  # started on first use, so a forked worker gets its own
+        self._inflight = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _load_model(model_name: str):
+        if CrossEncoder is None:
+            print("⚠️  sentence-transformers not available, reranking disabled")
+            return None
+        try:
+            print(f"📥 Loading reranking model {model_name}...")
+            model = CrossEncoder(model_name)
+            print("✅ Reranking model loaded!")
+            return model
+        except Exception as e:
+            print(f"⚠️  Reranking model failed to load, reranking disabled: {e}")
+            return None
+    
+    def _score(self, question: str, texts: List[str], keys: List[tuple]) -> List[float]:
+        """Cross-encoder scores of (question, text) pairs, cached as they arrive"""
+        try:
+            scores = self.model.predict([(question, text) for text in texts],
+                                        batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+            scores = [float(score) for score in scores]
+            for key, score in zip(keys, scores):
+                self._scores.put(key, score)
+            return scores
+        finally:
+            with self._lock:
+                self._inflight -= 1
+    
+    def _submit(self, question: str, texts: List[str], keys: List[tuple]):
+        """Future of the scores, or None when every worker is busy"""
+        with self._lock:
+            if self._inflight >= self.workers:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="rerank")
+            self._inflight += 1
+        return self._executor.submit(self._score, question, texts, keys)
+    
+    def rerank(self, question: str, results: List[Dict], version: str = '') -> List[Dict]:
+        """
+        The top_k of `results` (search() output, best first) by cross-encoder
+        score, each with a rerank_score, or the first top_k unchanged when
+        scoring is disabled, fails or doesn't finish within the budget.
+        """
+        if not self.enabled or len(results) <= 1:
+            return results[:self.top_k]
+        start = time.perf_counter()
+        
+        question_key = _question_key(question)
+        keys = [(question_key, version, r['metadata']['source'], r['metadata']['chunk_id'])
+                for r in results]
+        scores = [self._scores.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        
+        if missing:
+            future = self._submit(question, [results[i]['text'] for i in missing],
+                                  [keys[i] for i in missing])
+            if future is None:
+                return self._fallback(results, start, 'rerank.busy')
+            remaining = self.budget_ms / 1000 - (time.perf_counter() - start)
+            try:
+                for i, score in zip(missing, future.result(timeout=max(0.0, remaining))):
+                    scores[i] = score
+            except FutureTimeout:
+                return self._fallback(results, start, 'rerank.over_budget')
+            except Exception as e:
+                print(f"⚠️  Reranking failed: {e}")
+                return self._fallback(results, start, 'rerank.errors')
+        else:
+            metrics.inc('rerank.cached')
+        
+        order = sorted(range(len(results)), key=lambda i: scores[i], reverse=True)[:self.top_k]
+        reranked = [{**results[i], 'rank': rank, 'rerank_score': scores[i]}
+                    for rank, i in enumerate(order, start=1)]
+        metrics.observe('rerank', (time.perf_counter() - start) * 1000)
+        return reranked
+    
+    def _fallback(self, results: List[Dict], start: float, reason: str) -> List[Dict]:
+        metrics.inc(reason)
+        metrics.inc('rerank.fallbacks')
+        metrics.observe('rerank', (time.perf_counter() - start) * 1000)
+        return results[:self.top_k]
+    
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'model': self.model_name or None,
+            'candidates': self.candidates,
+            'top_k': self.top_k,
+            'budget_ms': self.budget_ms,
+            'score_cache': self._scores.stats()
+        }
@@ -0,0 +1,129 @@
+"""
+Semantic answer cache
+Keeps a small FAISS inner-product index over the (normalized) embeddings of
+recently answered questions. A new question whose cosine similarity to a
+cached one reaches the threshold gets that answer and its citations back
+without retrieval or a Gemini call, provided both name the same identifiers
+("980E" and "930E" embed almost alike). Entries are evicted least recently
+used first and the whole cache is dropped when the knowledge base version or
+the model changes.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+import numpy as np
+import faiss
+
+import lexical_index
+from metrics import metrics
+
+# Response `source` of a semantic hit; the original source moves to cached_source
+CACHE_SOURCE = "semantic_cache"
+
+# Nearest cached questions checked for one with the same identifiers
+SEARCH_DEPTH = 4
+
+
+def _identifiers(question: str) -> frozenset:
+    """Model numbers, clause ids, years, quantities: the terms of a question with a digit"""
+    return frozenset(term for term in lexical_index.tokenize(question, parts=False)
+                     if any(ch.isdigit() for ch in term))
+
+
+class SemanticCache:
+    """Near-duplicate question -> chat response cache (per process)"""
+    
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1000):
+        self.threshold = threshold
+        self.max_entries = max(0, max_entries)
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()  # id -> (question, identifiers, response), oldest first
+        self._next_id = 0
+        self._scope = None  # (index_version, model) the entries belong to
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.array(embedding, dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+    
+    def _check_scope(self, index_version: str, model: str, dim: int):
+        """Drop everything cached for another knowledge base version or model"""
+        if self._scope != (index_version, model) or self._index is None or self._index.d != dim:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+            self._entries.clear()
+            self._scope = (index_version, model)
+    
+    def get(self, question: str, embedding: np.ndarray, index_version: str,
+            model: str) -> Optional[Dict]:
+        """
+        Answer of the most similar cached question at or above the threshold
+        that names the same identifiers as `question`
+        """
+        if not self.max_entries:
+            return None
+        vector = self._normalize(embedding)
+        identifiers = _identifiers(question)
+        
+        with self._lock:
+            self._check_scope(index_version, model, vector.shape[1])
+            hit = None
+            mismatched = False
+            if self._index.ntotal:
+                similarities, ids = self._index.search(vector, min(SEARCH_DEPTH, self._index.ntotal))
+                for similarity, entry_id in zip(similarities[0], ids[0]):
+                    if entry_id < 0 or similarity < self.threshold:
+                        break
+                    entry_id = int(entry_id)
+                    if self._entries[entry_id][1] != identifiers:
+                        mismatched = True
+                        continue
+                    self._entries.move_to_end(entry_id)
+                    hit = (self._entries[entry_id], float(similarity))
+                    break
+        
+        if hit is None:
+            if mismatched:
+                metrics.inc('semantic_cache.identifier_mismatches')
+            metrics.inc('semantic_cache.misses')
+            return None
+        
+        metrics.inc('semantic_cache.hits')
+        (cached_question, _, response), similarity = hit
+        return {
+            **response,
+            "source": CACHE_SOURCE,
+            "cached_source": response.get("source"),
+            "matched_question": cached_question,
+            "cache_similarity": round(similarity, 4)
+        }
+    
+    def put(self, question: str, embedding: np.ndarray, index_version: str, model: str,
+            response: Dict):
+        if not self.max_entries:
+            return
+        vector = self._normalize(embedding)
+        
+        with self._lock:
+            self._check_scope(index_version, model, vector.shape[1])
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype='int64'))
+            self._entries[entry_id] = (question, _identifiers(question), dict(response))
+            
+            if len(self._entries) > self.max_entries:
+                evicted = []
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[0])
+                self._index.remove_ids(np.asarray(evicted, dtype='int64'))
+                metrics.inc('semantic_cache.evictions', len(evicted))
+    
+    def stats(self) -> Dict:
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'threshold': self.threshold,
+            'hit_rate': metrics.ratio('semantic_cache.hits', 'semantic_cache.misses')
+        }
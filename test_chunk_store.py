@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the memory-mapped chunk store
+Run with: python -m pytest test_chunk_store.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from chunk_store import ChunkStore, ChunkStoreWriter
+
+DIM = 3
+
+
+def meta(source, chunk_id, page):
+    return {'source': source, 'chunk_id': chunk_id, 'page_start': page, 'page_end': page + 1,
+            'char_start': chunk_id * 100, 'char_end': chunk_id * 100 + 90}
+
+
+def vectors(ids):
+    return np.asarray([[i, i * 2, -i] for i in ids], dtype=np.float32)
+
+
+def write(folder, rows, store=None, keep=()):
+    """rows: (text, source, chunk_id, page, vector_id); kept store rows go first"""
+    writer = ChunkStoreWriter(folder)
+    if store is not None:
+        writer.extend_from(store, np.asarray(keep, dtype=np.int64))
+    if rows:
+        texts, sources, chunk_ids, pages, ids = zip(*rows)
+        writer.add_batch(list(texts), [meta(*m) for m in zip(sources, chunk_ids, pages)],
+                         list(ids), vectors(ids))
+    writer.close()
+    return ChunkStore(folder)
+
+
+ROWS = [
+    ("Haul road grades above 10% need runaway lanes", "roads.pdf", 0, 1, 0),
+    ("Berm height must be at least half the wheel height", "roads.pdf", 1, 2, 1),
+    ("Blasting permits — issued by the inspector", "blasting.pdf", 0, 1, 2),
+    ("Flyrock exclusion zone of 500 m", "blasting.pdf", 1, 3, 3),
+]
+
+
+def test_roundtrip(tmp_path):
+    store = write(str(tmp_path / "store"), ROWS)
+    assert len(store) == 4
+    assert list(store.texts) == [row[0] for row in ROWS]
+    assert store.texts[-1] == ROWS[-1][0]
+    assert store.metadata[2] == {'source': "blasting.pdf", 'chunk_id': 0, 'total_chunks': 2,
+                                 'page_start': 1, 'page_end': 2, 'char_start': 0, 'char_end': 90}
+    np.testing.assert_array_equal(store.vectors, vectors(range(4)))
+    with pytest.raises(IndexError):
+        store.texts[4]
+
+
+def test_find_rows_and_sources(tmp_path):
+    store = write(str(tmp_path / "store"), ROWS)
+    assert store.find_rows([3, 0, 7]) == [3, 0, None]
+    assert store.rows_for_sources(["blasting.pdf", "missing.pdf"]).tolist() == [2, 3]
+    assert store.source_names() == ["roads.pdf", "blasting.pdf"]
+
+
+def test_extend_from_keeps_rows_and_appends(tmp_path):
+    old = write(str(tmp_path / "old"), ROWS)
+    keep = np.setdiff1d(np.arange(len(old)), old.rows_for_sources(["roads.pdf"]))
+    new = write(str(tmp_path / "new"), [("Roads rewritten: grades above 8%", "roads.pdf", 0, 1, 4)],
+                store=old, keep=keep)
+    assert list(new.texts) == [ROWS[2][0], ROWS[3][0], "Roads rewritten: grades above 8%"]
+    assert new.vector_ids.tolist() == [2, 3, 4]
+    assert [m['source'] for m in new.metadata] == ["blasting.pdf", "blasting.pdf", "roads.pdf"]
+    assert new.metadata[1]['page_start'] == 3
+    np.testing.assert_array_equal(new.vectors, vectors([2, 3, 4]))
+
+
+def test_close_replaces_the_folder(tmp_path):
+    folder = str(tmp_path / "store")
+    old = write(folder, ROWS)
+    new = write(folder, ROWS[:1])
+    assert len(new) == 1
+    assert old.texts[3] == ROWS[3][0]  # readers keep their mmaps after the swap
+    assert not os.path.exists(folder + ".tmp")
+
+
+def test_empty_store(tmp_path):
+    store = write(str(tmp_path / "store"), [])
+    assert ChunkStore.exists(store.folder)
+    assert len(store) == 0
+    assert store.find_rows([0]) == [None]
+    assert store.vectors.shape == (0, 0)
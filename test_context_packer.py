@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Unit tests for prompt context packing
+Run with: python -m pytest test_context_packer.py
+"""
+
+from context_packer import drop_after_gap, estimate_tokens, merge_adjacent, pack_context
+
+DOCUMENT = ' '.join(f"word{i:03d}" for i in range(100))  # 7 chars + space per word
+
+
+def result(chunk_id, score, source="roads.pdf", words=20, step=15, **extra):
+    """A chunk of DOCUMENT as search returns it: `words` words every `step` words"""
+    start = chunk_id * step * 8
+    end = start + words * 8 - 1
+    return {
+        'text': DOCUMENT[start:end],
+        'similarity_score': score,
+        'metadata': {'source': source, 'chunk_id': chunk_id, 'page_start': chunk_id + 1,
+                     'page_end': chunk_id + 1, 'char_start': start, 'char_end': end},
+        **extra
+    }
+
+
+def test_drop_after_gap_keeps_the_ranked_order():
+    results = [result(3, 0.80), result(0, 0.75), result(5, 0.60), result(1, 0.58)]
+    assert drop_after_gap(results, 0.1) == results[:2]
+    assert drop_after_gap(results, 0.3) == results
+    assert drop_after_gap(results, 0) == results
+
+
+def test_drop_after_gap_leaves_reranked_and_lexical_results_alone():
+    reranked = [result(0, 0.9, rerank_score=2.0), result(1, 0.2, rerank_score=1.5)]
+    assert drop_after_gap(reranked, 0.1) == reranked
+    lexical = [result(0, 1.0, score_kind='coverage'), result(1, 0.5, score_kind='coverage')]
+    assert drop_after_gap(lexical, 0.1) == lexical
+
+
+def test_merge_adjacent_keeps_the_overlap_once():
+    spans = merge_adjacent([result(2, 0.7), result(1, 0.9), result(0, 0.4, source="other.pdf")])
+    assert [span['chunk_ids'] for span in spans] == [[1, 2], [0]]
+    merged = spans[0]
+    assert merged['text'] == DOCUMENT[15 * 8:(30 + 20) * 8 - 1]
+    assert (merged['page_start'], merged['page_end']) == (2, 3)
+    assert merged['similarity_score'] == 0.9
+    assert spans[1]['source'] == "other.pdf"
+
+
+def test_merge_adjacent_ignores_duplicates_and_gaps():
+    spans = merge_adjacent([result(0, 0.9), result(0, 0.9), result(2, 0.8)])
+    assert [span['chunk_ids'] for span in spans] == [[0], [2]]
+
+
+def test_pack_context_fits_the_budget():
+    results = [result(0, 0.9, source="a.pdf"), result(0, 0.88, source="b.pdf"),
+               result(0, 0.86, source="c.pdf")]
+    chunk_tokens = estimate_tokens(results[0]['text'])
+    
+    packed = pack_context(results, token_budget=1000, score_gap=0)
+    assert packed['sources'] == ["a.pdf", "b.pdf", "c.pdf"]
+    assert packed['tokens'] == packed['raw_tokens']
+    
+    packed = pack_context(results, token_budget=2 * chunk_tokens + 1, score_gap=0)
+    assert packed['sources'] == ["a.pdf", "b.pdf"]
+    assert packed['tokens'] <= 2 * chunk_tokens + 1
+    assert packed['context'] == results[0]['text'] + "\n\n" + results[1]['text']
+
+
+def test_pack_context_cuts_an_oversized_first_span():
+    long = result(0, 0.9, words=100, step=0)
+    packed = pack_context([long], token_budget=120, score_gap=0)
+    assert packed['spans'][0]['truncated']
+    assert packed['tokens'] <= 120
+    assert long['text'].startswith(packed['context'])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the persistent embedding cache
+Run with: python -m pytest test_embedding_cache.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from embedding_cache import CacheBusyError, EmbeddingCache, KEYS_FILE, VECTORS_FILE
+
+MODEL = "test-model"
+DIM = 4
+
+
+def embed(texts):
+    """Distinct, recognisable vector per text"""
+    return np.asarray([[len(text), sum(map(ord, text)) % 97, i, 1.0] for i, text in enumerate(texts)],
+                      dtype=np.float32)
+
+
+def fill(cache, texts):
+    keys, _, missing = cache.lookup(texts)
+    vectors = embed(texts)
+    cache.put(keys[missing], vectors[missing])
+    return vectors
+
+
+def test_vectors_stay_aligned_after_reopen(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, 1 << 20)
+    first = fill(cache, ["alpha", "beta", "gamma"])
+    second = fill(cache, ["gamma", "delta"])
+    cache.close()
+    
+    cache = EmbeddingCache(str(tmp_path), MODEL, 1 << 20)
+    _, vectors, missing = cache.lookup(["delta", "alpha", "gamma", "beta", "epsilon"])
+    assert missing == [4]
+    np.testing.assert_array_equal(vectors[:4], [second[1], first[0], first[2], first[1]])
+    cache.close()
+
+
+def test_partial_rows_of_a_crashed_run_are_dropped(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, 1 << 20)
+    expected = fill(cache, ["alpha", "beta"])
+    cache._lock.close()  # crash: no close(), the OS releases the lock
+    with open(os.path.join(cache.folder, KEYS_FILE), "ab") as f:
+        f.write(b"\1" * 8)  # a key whose vector never made it
+    with open(os.path.join(cache.folder, VECTORS_FILE), "ab") as f:
+        f.write(b"\0" * 6)
+    
+    cache = EmbeddingCache(str(tmp_path), MODEL, 1 << 20)
+    assert len(cache) == 2
+    _, vectors, missing = cache.lookup(["alpha", "beta"])
+    assert missing == []
+    np.testing.assert_array_equal(vectors, expected)
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry_bytes = 8 + 4 + 4 * DIM
+    cache = EmbeddingCache(str(tmp_path), MODEL, 4 * entry_bytes)
+    fill(cache, ["old-1", "old-2", "old-3"])
+    cache.close()
+    
+    cache = EmbeddingCache(str(tmp_path), MODEL, 4 * entry_bytes)
+    cache.lookup(["old-2"])
+    expected = fill(cache, ["new-1", "new-2"])
+    cache.close()
+    assert cache.evicted == 2
+    
+    cache = EmbeddingCache(str(tmp_path), MODEL, 4 * entry_bytes)
+    _, vectors, missing = cache.lookup(["old-1", "old-2", "old-3", "new-1", "new-2"])
+    assert missing == [0, 2]
+    np.testing.assert_array_equal(vectors[3:], expected)
+    cache.close()
+
+
+def test_a_second_writer_is_refused(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, 1 << 20)
+    with pytest.raises(CacheBusyError):
+        EmbeddingCache(str(tmp_path), MODEL, 1 << 20)
+    cache.close()
+    EmbeddingCache(str(tmp_path), MODEL, 1 << 20).close()
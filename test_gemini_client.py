@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Gemini client's circuit breaker
+Run with: python -m pytest test_gemini_client.py
+"""
+
+import time
+
+import httpx
+import pytest
+
+from gemini_client import GeminiClient, GeminiError, CircuitBreaker, CircuitOpenError
+
+OK_BODY = {'candidates': [{'content': {'parts': [{'text': 'ok'}]}}]}
+
+
+def make_client(handler, breaker):
+    """A GeminiClient whose requests go to handler(request) instead of the network"""
+    client = GeminiClient('test-key', base_url='http://gemini.test', max_retries=0,
+                          hedge=False, breaker=breaker)
+    client._http = httpx.Client(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker(failures=1, cooldown=0.0)
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=2, cooldown=60.0)
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_failed_trial_reopens():
+    breaker = half_open_breaker()
+    breaker.cooldown = 60.0
+    breaker._opened_at = time.monotonic() - 60.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_release_frees_the_trial():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+
+
+def test_trial_with_malformed_body_resolves():
+    client = make_client(lambda request: httpx.Response(200, text='<html>not json</html>'),
+                         half_open_breaker())
+    with pytest.raises(GeminiError) as raised:
+        client.generate('gemini-test', 'hello')
+    assert raised.value.status == 200
+    assert client.breaker.state == 'closed'
+
+
+def test_trial_with_unexpected_shape_resolves():
+    client = make_client(lambda request: httpx.Response(200, json={'candidates': 'oops'}),
+                         half_open_breaker())
+    with pytest.raises(GeminiError):
+        client.generate('gemini-test', 'hello')
+    assert client.breaker.allow()
+
+
+def test_trial_failing_with_server_error_reopens():
+    client = make_client(lambda request: httpx.Response(503, json={'error': {'message': 'busy'}}),
+                         half_open_breaker())
+    client.breaker.cooldown = 60.0
+    with pytest.raises(GeminiError):
+        client.generate('gemini-test', 'hello')
+    assert client.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        client.generate('gemini-test', 'hello')
+
+
+def test_trial_past_its_deadline_is_released():
+    client = make_client(lambda request: httpx.Response(200, json=OK_BODY), half_open_breaker())
+    with pytest.raises(GeminiError):
+        client.generate('gemini-test', 'hello', timeout=-1)
+    assert client.breaker.state == 'half_open'
+    assert client.breaker.allow()
+
+
+def test_abandoned_stream_resolves_trial():
+    events = ''.join(f'data: {{"candidates": [{{"content": {{"parts": [{{"text": "{word} "}}]}}}}]}}\n\n'
+                     for word in ('one', 'two', 'three'))
+    client = make_client(lambda request: httpx.Response(200, text=events), half_open_breaker())
+    stream = client.stream('gemini-test', 'hello')
+    assert next(stream) == 'one '
+    stream.close()  # the HTTP client disconnected mid-answer
+    assert client.breaker.state == 'closed'
+
+
+def test_stream_with_malformed_event_resolves_trial():
+    client = make_client(lambda request: httpx.Response(200, text='data: {truncated\n\n'),
+                         half_open_breaker())
+    with pytest.raises(GeminiError):
+        list(client.stream('gemini-test', 'hello'))
+    assert client.breaker.allow()
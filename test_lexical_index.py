@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the BM25 index
+Run with: python -m pytest test_lexical_index.py
+"""
+
+import os
+
+import lexical_index
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "Komatsu 980E haul truck payload and tyre pressure",
+    "Blasting near schools needs a permit from the inspector",
+    "Magnetite Fe3O4 ore grading and haul road dust",
+    "Haul truck brakes must be tested every shift",
+    "",
+    "ISO-45001 occupational health and safety management",
+]
+
+
+def build(tmp_path, texts=TEXTS, **kwargs):
+    folder = str(tmp_path / "lexical")
+    lexical_index.build(folder, texts, **kwargs)
+    return LexicalIndex(folder)
+
+
+def test_tokenize_keeps_compounds_and_their_parts():
+    assert tokenize("ISO-45001 and the Fe3O4") == ['iso-45001', 'iso', '45001', 'fe3o4']
+    assert tokenize("ISO-45001", parts=False) == ['iso-45001']
+
+
+def test_search_ranks_matching_chunks(tmp_path):
+    index = build(tmp_path)
+    assert len(index) == len(TEXTS)
+    rows = [row for row, _ in index.search("haul truck payload")]
+    assert rows[0] == 0
+    assert set(rows) == {0, 2, 3}
+    assert index.search("iso 45001")[0][0] == 5
+    assert index.search("nothing like this") == []
+
+
+def test_search_all_of_needs_every_term(tmp_path):
+    index = build(tmp_path)
+    assert [row for row, _ in index.search_all_of(['haul', 'truck'], "haul truck")] == [0, 3]
+    assert index.search_all_of(['980e', 'fe3o4'], "980e fe3o4") == []
+
+
+def test_coverage(tmp_path):
+    index = build(tmp_path)
+    assert index.coverage(['haul', 'payload'], [0, 3, 1]).tolist() == [1.0, 0.5, 0.0]
+
+
+def test_build_does_not_depend_on_block_size(tmp_path):
+    texts = [f"shift {i} report truck {i % 7} haul road grade {i % 3}" for i in range(300)] + TEXTS
+    lexical_index.build(str(tmp_path / "one"), texts)
+    lexical_index.build(str(tmp_path / "many"), texts, block_postings=50)
+    for name in os.listdir(tmp_path / "one"):
+        with open(tmp_path / "one" / name, "rb") as a, open(tmp_path / "many" / name, "rb") as b:
+            assert a.read() == b.read(), name
+    assert not os.path.exists(tmp_path / "many" / lexical_index.RUNS_FOLDER)
+
+
+def test_empty_corpus(tmp_path):
+    index = build(tmp_path, [])
+    assert len(index) == 0
+    assert index.search("haul") == []
+
+
+def test_reciprocal_rank_fusion_prefers_rows_both_rankings_agree_on():
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]]) == [1, 3, 2, 4]
+    assert reciprocal_rank_fusion([[5], []]) == [5]
+
+
+def test_identifiers_mix_letters_and_digits():
+    for term in ('980e', 'fe3o4', 'pc8000', 'd11', 'iso-45001', '04/0007/2003', '3.2.1'):
+        assert lexical_index.is_identifier(term), term
+    for term in ('10', '2019', '3.5', '45001-2018', '100m', '10kg', '2nd', '1990s', 'haul'):
+        assert not lexical_index.is_identifier(term), term
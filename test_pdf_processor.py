@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the PDF chunker (word windows and page provenance), page
+reading and the identifier fast path
+Run with: python -m pytest test_pdf_processor.py
+"""
+
+import logging
+
+import pdf_processor
+from pdf_processor import PDFRAGSystem, _fast_path_identifiers, _iter_chunk_spans, _split_chunks
+
+
+def words(start, count):
+    return [f"paragraph-word-{i:04d}" for i in range(start, start + count)]
+
+
+def test_windows_overlap_by_the_overlap():
+    text = ' '.join(words(0, 25))
+    chunks = [chunk.split() for chunk in _split_chunks(text, chunk_size=10, overlap=3)]
+    assert chunks[0] == words(0, 10)
+    assert chunks[1] == words(7, 10)
+    assert chunks[2] == words(14, 10)
+    assert chunks[-1][-1] == "paragraph-word-0024"
+
+
+def test_spans_are_slices_of_the_text():
+    pages = [' '.join(words(0, 30)) + "\n", ' '.join(words(30, 30)) + "\n"]
+    document = ''.join(pages)
+    for text, start, end, _, _ in _iter_chunk_spans(pages, chunk_size=12, overlap=2):
+        assert document[start:end] == text
+
+
+def test_page_numbers_follow_the_text():
+    pages = [' '.join(words(0, 20)) + "\n", ' '.join(words(20, 20)) + "\n"]
+    spans = list(_iter_chunk_spans(pages, chunk_size=15, overlap=5))
+    assert (spans[0][3], spans[0][4]) == (1, 1)
+    assert (spans[1][3], spans[1][4]) == (1, 2)  # words 10-24 cross the page break
+    assert (spans[-1][3], spans[-1][4]) == (2, 2)
+
+
+def test_no_overlap_and_odd_spacing():
+    text = "  " + "\t\n ".join(words(0, 9)) + "  \n"
+    chunks = _split_chunks(text, chunk_size=3, overlap=0)
+    assert [chunk.split() for chunk in chunks] == [words(0, 3), words(3, 3), words(6, 3)]
+
+
+def test_short_chunks_are_dropped():
+    assert _split_chunks("too short to keep", chunk_size=10, overlap=2) == []
+
+
+def test_plain_numbers_do_not_take_the_identifier_fast_path():
+    assert _fast_path_identifiers("Komatsu 980E payload") == ['980e']
+    assert _fast_path_identifiers("clause 04/0007/2003") == ['04/0007/2003']
+    assert _fast_path_identifiers("safety rules from 2019") == []
+    assert _fast_path_identifiers("what is the 10 year limit") == []
+    assert _fast_path_identifiers("100m haul road") == []
+
+
+class FakePage:
+    def __init__(self, text):
+        self.text = text
+    
+    def extract_text(self):
+        if self.text is None:
+            raise ValueError("broken content stream")
+        return self.text
+
+
+class FakeReader:
+    """PdfReader stand-in: 'broken.pdf' won't open, None pages won't read"""
+    documents = {}
+    
+    def __init__(self, path):
+        if path.endswith("broken.pdf"):
+            raise OSError("EOF marker not found")
+        self.pages = [FakePage(text) for text in self.documents[path]]
+
+
+def test_unreadable_files_fail_and_bad_pages_are_logged(tmp_path, monkeypatch, caplog):
+    good, broken = tmp_path / "good.pdf", tmp_path / "broken.pdf"
+    FakeReader.documents = {str(good): [' '.join(words(0, 20)), None, ' '.join(words(20, 20))]}
+    monkeypatch.setattr(pdf_processor, "PdfReader", FakeReader)
+    rag = PDFRAGSystem(pdf_folder=str(tmp_path), knowledge_base_folder=str(tmp_path / "kb"))
+    
+    with caplog.at_level(logging.ERROR, logger="pdf_processor"):
+        chunks = list(rag.iter_chunks([broken, good], workers=1))
+    assert rag.failed_files == ["broken.pdf"]
+    assert {meta['source'] for _, meta in chunks} == {"good.pdf"}
+    assert chunks[-1][1]['page_end'] == 3
+    assert "page 2 of" in caplog.text
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the semantic answer cache
+Run with: python -m pytest test_semantic_cache.py
+"""
+
+import numpy as np
+
+from semantic_cache import CACHE_SOURCE, SemanticCache
+
+VERSION = "v1"
+MODEL = "test-model"
+
+
+def vector(angle):
+    """Unit vector whose cosine with vector(0) is cos(angle)"""
+    return np.asarray([np.cos(angle), np.sin(angle), 0.0], dtype=np.float32)
+
+
+def answer(text):
+    return {"response": text, "source": "pdf_rag_gemini", "sources": ["roads.pdf"]}
+
+
+def test_near_duplicates_hit_and_others_miss():
+    cache = SemanticCache(threshold=0.95)
+    cache.put("What is the haul road grade limit?", vector(0), VERSION, MODEL, answer("10%"))
+    
+    hit = cache.get("What's the grade limit for haul roads?", vector(0.2) * 3, VERSION, MODEL)
+    assert hit["response"] == "10%"
+    assert hit["source"] == CACHE_SOURCE
+    assert hit["cached_source"] == "pdf_rag_gemini"
+    assert hit["matched_question"] == "What is the haul road grade limit?"
+    assert hit["cache_similarity"] == round(float(np.cos(0.2)), 4)
+    
+    assert cache.get("Who issues blasting permits?", vector(0.5), VERSION, MODEL) is None
+
+
+def test_different_identifiers_never_share_an_answer():
+    cache = SemanticCache(threshold=0.9)
+    cache.put("Komatsu 980E payload", vector(0), VERSION, MODEL, answer("363 t"))
+    assert cache.get("Komatsu 930E payload", vector(0.01), VERSION, MODEL) is None
+    assert cache.get("komatsu 980e payload?", vector(0.01), VERSION, MODEL)["response"] == "363 t"
+    
+    # A close entry with other identifiers doesn't hide a matching one behind it
+    cache.put("Komatsu 930E payload", vector(0.005), VERSION, MODEL, answer("290 t"))
+    assert cache.get("Komatsu 930E payload", vector(0.004), VERSION, MODEL)["response"] == "290 t"
+    assert cache.get("Komatsu 980E payload", vector(0.004), VERSION, MODEL)["response"] == "363 t"
+
+
+def test_new_version_or_model_empties_the_cache():
+    cache = SemanticCache(threshold=0.9)
+    cache.put("haul road grade limit", vector(0), VERSION, MODEL, answer("10%"))
+    assert cache.get("haul road grade limit", vector(0), "v2", MODEL) is None
+    cache.put("haul road grade limit", vector(0), "v2", MODEL, answer("8%"))
+    assert cache.get("haul road grade limit", vector(0), "v2", "other-model") is None
+    assert cache.stats()['size'] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SemanticCache(threshold=0.99, max_entries=2)
+    cache.put("first", vector(0), VERSION, MODEL, answer("one"))
+    cache.put("second", vector(1), VERSION, MODEL, answer("two"))
+    assert cache.get("first", vector(0), VERSION, MODEL)["response"] == "one"
+    cache.put("third", vector(2), VERSION, MODEL, answer("three"))
+    
+    assert cache.stats()['size'] == 2
+    assert cache.get("second", vector(1), VERSION, MODEL) is None
+    assert cache.get("first", vector(0), VERSION, MODEL)["response"] == "one"
+    assert cache.get("third", vector(2), VERSION, MODEL)["response"] == "three"
+
+
+def test_disabled_cache_stores_nothing():
+    cache = SemanticCache(max_entries=0)
+    cache.put("haul road grade limit", vector(0), VERSION, MODEL, answer("10%"))
+    assert cache.get("haul road grade limit", vector(0), VERSION, MODEL) is None
@@ -0,0 +1,166 @@
+"""
+Write-behind queue for log-style database rows
+Request handlers put ChatHistory, APIUsage and AuditLog rows on a bounded
+queue and return; a background thread inserts them in bulk, one transaction
+per batch, whenever batch_size rows are waiting or flush_interval has passed
+since the first of them. close() (registered with atexit) drains the queue.
+
+When the queue is full the overflow policy decides:
+    block - wait up to block_seconds for room, then insert in the caller
+    sync  - insert in the caller right away
+    drop  - discard the row (counted in write_behind.dropped)
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import insert
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('block', 'sync', 'drop')
+
+
+class WriteBehindQueue:
+    """Bounded queue of rows flushed by a background thread in bulk inserts"""
+    
+    def __init__(self, session_factory: Callable, max_size: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 0.5, overflow: str = 'block', block_seconds: float = 1.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.session_factory = session_factory
+        self.max_size = max(1, max_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_seconds = block_seconds
+        self.high_water = 0
+        self._queue = queue.Queue(self.max_size)
+        self._closing = threading.Event()
+        self._start()
+        atexit.register(self.close)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+    
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+    
+    def _after_fork(self):
+        """
+        A forked worker (gunicorn --preload) has no writer thread and may have
+        inherited the queue's locks mid-use: give it a fresh queue and thread.
+        """
+        self.high_water = 0
+        self._queue = queue.Queue(self.max_size)
+        self._closing = threading.Event()
+        self._start()
+    
+    def put(self, model, **values) -> bool:
+        """Queue one row of `model`; False if it was dropped"""
+        if 'created_at' in model.__table__.c and 'created_at' not in values:
+            values['created_at'] = datetime.utcnow()  # time of the event, not of the flush
+        row = (model, values)
+        
+        if self._closing.is_set():
+            self._write([row])
+            return True
+        
+        try:
+            if self.overflow == 'block':
+                self._queue.put(row, timeout=self.block_seconds)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            if self.overflow == 'drop':
+                metrics.inc('write_behind.dropped')
+                logger.warning("Write-behind queue full, row dropped", extra={"table": model.__tablename__})
+                return False
+            metrics.inc('write_behind.inline_writes')
+            self._write([row])
+            return True
+        
+        self.high_water = max(self.high_water, self._queue.qsize())
+        return True
+    
+    def close(self, timeout: float = 10.0):
+        """Stop taking rows into the queue and flush what is in it"""
+        if self._closing.is_set():
+            return
+        self._closing.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Write-behind queue did not drain", extra={"pending": self._queue.qsize()})
+    
+    def _run(self):
+        while not (self._closing.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+    
+    def _next_batch(self) -> List[Tuple]:
+        """Up to batch_size rows, waiting at most flush_interval after the first"""
+        batch, deadline = [], None
+        while len(batch) < self.batch_size:
+            if self._closing.is_set():
+                timeout = 0  # draining: take what is there
+            elif deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch
+    
+    def _write(self, rows: List[Tuple]):
+        """Insert rows with one executemany per table in a single transaction"""
+        start = time.perf_counter()
+        by_model: Dict = {}
+        for model, values in rows:
+            by_model.setdefault(model, []).append(values)
+        
+        session = self.session_factory()
+        try:
+            for model, values in by_model.items():
+                session.execute(insert(model), values)
+            session.commit()
+            metrics.inc('write_behind.rows', len(rows))
+        except Exception as e:
+            session.rollback()
+            logger.error("Write-behind batch failed", extra={"rows": len(rows), "error": str(e)})
+            if len(rows) > 1:
+                # Retry one by one so a bad row doesn't lose the whole batch
+                session.close()
+                for row in rows:
+                    self._write([row])
+                return
+            metrics.inc('write_behind.errors')
+        finally:
+            session.close()
+        
+        metrics.observe('write_behind.flush', (time.perf_counter() - start) * 1000)
+    
+    def stats(self) -> Dict:
+        return {
+            'depth': self._queue.qsize(),
+            'max_size': self.max_size,
+            'high_water': self.high_water,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'overflow': self.overflow
+        }